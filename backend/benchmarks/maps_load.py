@@ -0,0 +1,110 @@
+"""
+Benchmark: Maps client under bursty load.
+
+Starts the Maps API stub (maps_stub.py) with the requested faults, then
+starts --solves concurrent "solves" at once, each geocoding its addresses
+and fetching their travel-time matrix straight from maps_client (no
+geocode store or travel-time cache), the way solves arriving together do.
+They solve --jobs distinct jobs (the rest are re-solves of the same
+jobs), whose addresses are drawn from a shared pool, so their lookups
+overlap.
+
+Reports how many solves got all their data, the wall time, the upstream
+requests the stub served (by outcome), and how many lookups were
+coalesced, retried or rejected by the circuit breaker.
+
+    python -m backend.benchmarks.maps_load --solves 10 --error-rate 0.1 --quota-qps 20
+"""
+
+import os
+
+# The backend modules read DATABASE_URL at import; nothing here uses it
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+# Any well-formed key: the stub ignores it
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "AIza" + "0" * 35)
+# One process, with client-side limits well above the stub's --quota-qps
+# unless set: the quota errors are what's under test
+os.environ.setdefault("MAPS_PROCESSES", "1")
+os.environ.setdefault("GEOCODE_QPS", "1000")
+os.environ.setdefault("ROUTE_MATRIX_EPM", "10000000")
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.request
+
+from backend import maps_client, telemetry
+from backend.benchmarks import maps_stub
+
+
+def run_solve(addresses, outcomes, index):
+    try:
+        coords = maps_client.geocode_locations(addresses)
+        if None in coords.values():
+            raise ValueError("some addresses were not found")
+        maps_client.get_distance_matrix(addresses)
+        outcomes[index] = "ok"
+    except Exception as e:
+        outcomes[index] = f"{type(e).__name__}: {e}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--solves", type=int, default=10, help="solves started at once")
+    parser.add_argument("--jobs", type=int, default=4, help="distinct jobs among the solves")
+    parser.add_argument("--stops", type=int, default=40, help="addresses per job")
+    parser.add_argument("--pool", type=int, default=60, help="distinct addresses the solves draw from")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--quota-qps", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, state = maps_stub.start_stub(
+        latency=args.latency, error_rate=args.error_rate, quota_qps=args.quota_qps,
+    )
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    # The clients are built on first use, i.e. after this
+    maps_client.MAPS_API_ENDPOINT = endpoint
+
+    rng = random.Random(args.seed)
+    pool = [f"{100 + k} Stub Street, New York, NY" for k in range(args.pool)]
+    jobs = [rng.sample(pool, min(args.stops, len(pool))) for _ in range(args.jobs)]
+    solves = [jobs[k % len(jobs)] for k in range(args.solves)]
+
+    stats = telemetry.start_solve()
+    outcomes = [None] * len(solves)
+    threads = [
+        threading.Thread(target=run_solve, args=(addresses, outcomes, k))
+        for k, addresses in enumerate(solves)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    with urllib.request.urlopen(f"{endpoint}/stats") as response:
+        upstream = json.load(response)
+    server.shutdown()
+
+    succeeded = outcomes.count("ok")
+    print(f"solves succeeded      {succeeded}/{len(solves)}")
+    print(f"wall time             {wall:.2f}s")
+    for path, by_outcome in sorted(upstream.items()):
+        counts = ", ".join(f"{outcome} {n}" for outcome, n in sorted(by_outcome.items()))
+        print(f"upstream {path:<40} {counts}")
+    for name in ("geocode_requests", "maps_api_coalesced", "maps_api_retries", "maps_api_rejected"):
+        print(f"{name:<22}{stats.counters.get(name, 0)}")
+    for outcome in sorted({o for o in outcomes if o != "ok"}):
+        print(f"failed: {outcome}", file=sys.stderr)
+    if succeeded < len(solves):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
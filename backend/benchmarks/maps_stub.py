@@ -0,0 +1,229 @@
+"""
+Local stand-in for the Maps APIs, for testing maps_client offline.
+
+Serves the three calls the backend makes, with made-up but consistent
+answers:
+
+    GET  /maps/api/geocode/json                Geocoding API: every address
+                                               maps to a point near midtown
+                                               Manhattan, derived from its hash
+    POST /distanceMatrix/v2:computeRouteMatrix Routes API (REST): travel
+                                               times between those points
+    POST /directions/v2:computeRoutes          Routes API (REST): straight legs
+
+and can misbehave on demand: --latency adds a delay to every response,
+--error-rate answers that fraction of requests with 503 UNAVAILABLE, and
+--quota-qps answers requests beyond that rate with a quota error (429
+RESOURCE_EXHAUSTED, or OVER_QUERY_LIMIT for geocoding). GET /stats returns
+the requests served, by path and outcome.
+
+Point the backend at it with MAPS_API_ENDPOINT:
+
+    python -m backend.benchmarks.maps_stub --port 8700 --error-rate 0.1
+    MAPS_API_ENDPOINT=http://127.0.0.1:8700 GOOGLE_MAPS_API_KEY=AIza... uvicorn backend.main:app
+"""
+
+import os
+
+# The backend modules read DATABASE_URL at import; nothing here uses it
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from backend.distance import encode_polyline
+
+# Stub addresses land within about 15 km of this point
+CENTER = (40.75, -73.99)
+SPREAD_DEGREES = 0.135
+SPEED_MPS = 10.0
+
+GEOCODE_PATH = "/maps/api/geocode/json"
+MATRIX_PATH = "/distanceMatrix/v2:computeRouteMatrix"
+ROUTES_PATH = "/directions/v2:computeRoutes"
+
+
+def address_point(address: str):
+    """
+    Returns the (lat, lng) the stub geocodes 'address' to. Addresses that
+    only differ in case or spacing get the same point.
+    """
+    key = " ".join(address.lower().split())
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    u = int.from_bytes(digest[:4], "big") / 2**32 - 0.5
+    v = int.from_bytes(digest[4:8], "big") / 2**32 - 0.5
+    return CENTER[0] + u * 2 * SPREAD_DEGREES, CENTER[1] + v * 2 * SPREAD_DEGREES
+
+
+def waypoint_point(waypoint: dict):
+    location = waypoint.get("location")
+    if location:
+        lat_lng = location["latLng"]
+        return lat_lng.get("latitude", 0.0), lat_lng.get("longitude", 0.0)
+    return address_point(waypoint["address"])
+
+
+def travel_seconds(a, b) -> int:
+    dlat = (b[0] - a[0]) * 111_000
+    dlng = (b[1] - a[1]) * 111_000 * math.cos(math.radians(a[0]))
+    return int(math.hypot(dlat, dlng) * 1.3 / SPEED_MPS)
+
+
+class StubState:
+    """
+    Fault settings and request counts, shared by the handler threads.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, quota_qps: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_qps = quota_qps
+        self.stats = {}
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.lock = threading.Lock()
+
+    def outcome(self) -> str:
+        """
+        Decides how to answer the next request: "ok", "error" or "quota".
+        """
+        with self.lock:
+            if self.quota_qps > 0:
+                now = time.monotonic()
+                if now - self.window_start >= 1.0:
+                    self.window_start = now
+                    self.window_requests = 0
+                self.window_requests += 1
+                if self.window_requests > self.quota_qps:
+                    return "quota"
+        if random.random() < self.error_rate:
+            return "error"
+        return "ok"
+
+    def record(self, path: str, outcome: str):
+        with self.lock:
+            by_outcome = self.stats.setdefault(path, {})
+            by_outcome[outcome] = by_outcome.get(outcome, 0) + 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _rpc_error(self, status: int, name: str, message: str):
+        self._send_json(status, {"error": {"code": status, "status": name, "message": message}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            with self.state.lock:
+                return self._send_json(200, self.state.stats)
+        if url.path != GEOCODE_PATH:
+            return self._send_json(404, {"status": "NOT_FOUND"})
+
+        outcome = self.state.outcome()
+        time.sleep(self.state.latency)
+        self.state.record(url.path, outcome)
+        if outcome == "quota":
+            return self._send_json(200, {"status": "OVER_QUERY_LIMIT", "results": []})
+        if outcome == "error":
+            return self._send_json(503, {"status": "UNKNOWN_ERROR", "results": []})
+
+        address = parse_qs(url.query).get("address", [""])[0]
+        if not address.strip():
+            return self._send_json(200, {"status": "ZERO_RESULTS", "results": []})
+        lat, lng = address_point(address)
+        self._send_json(200, {
+            "status": "OK",
+            "results": [{"geometry": {"location": {"lat": lat, "lng": lng}}}],
+        })
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if url.path not in (MATRIX_PATH, ROUTES_PATH):
+            return self._rpc_error(404, "NOT_FOUND", f"No such method: {url.path}")
+
+        outcome = self.state.outcome()
+        time.sleep(self.state.latency)
+        self.state.record(url.path, outcome)
+        if outcome == "quota":
+            return self._rpc_error(429, "RESOURCE_EXHAUSTED", "Quota exceeded (stub)")
+        if outcome == "error":
+            return self._rpc_error(503, "UNAVAILABLE", "Service unavailable (stub)")
+
+        if url.path == MATRIX_PATH:
+            origins = [waypoint_point(o["waypoint"]) for o in request.get("origins", [])]
+            destinations = [waypoint_point(d["waypoint"]) for d in request.get("destinations", [])]
+            # The REST transport streams a JSON array of elements
+            return self._send_json(200, [
+                {
+                    "originIndex": i,
+                    "destinationIndex": j,
+                    "status": {},
+                    "duration": f"{travel_seconds(origin, destination)}s",
+                }
+                for i, origin in enumerate(origins)
+                for j, destination in enumerate(destinations)
+            ])
+
+        waypoints = [request["origin"], *request.get("intermediates", []), request["destination"]]
+        points = [waypoint_point(w) for w in waypoints]
+        legs = [
+            {"polyline": {"encodedPolyline": encode_polyline(points[i:i + 2])}}
+            for i in range(len(points) - 1)
+        ]
+        self._send_json(200, {"routes": [{"legs": legs}]})
+
+
+def start_stub(port: int = 0, **faults):
+    """
+    Starts the stub on a background thread. Returns (server, state); the
+    server's address is server.server_address, stop it with shutdown().
+    """
+    state = StubState(**faults)
+    handler = type("Handler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 503")
+    parser.add_argument("--quota-qps", type=float, default=0.0, help="requests per second before quota errors")
+    args = parser.parse_args()
+
+    server, _ = start_stub(
+        args.port, latency=args.latency, error_rate=args.error_rate, quota_qps=args.quota_qps,
+    )
+    print(f"Maps API stub listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
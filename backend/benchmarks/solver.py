@@ -0,0 +1,370 @@
+"""
+Benchmark: solver core on synthetic and recorded instances.
+
+Builds pickup-and-delivery instances offline and solves them the way a
+job's solve does (optimization.search_data_model: parallel searches,
+decomposition of large instances and all), without a database, Job rows or
+Maps API calls.
+
+Synthetic instances (--kinds, --shipments):
+
+    uniform    pickups and drops spread evenly over a 30 x 30 km area
+    clustered  pickups and drops around a handful of neighbourhoods
+    hub        every pickup at a hub near the depot, drops spread out
+
+Recorded instances (--replay FILE.npy ...) are square duration matrices in
+seconds, in the order depot, then (pickup, drop) pairs; e.g. the
+'distance_matrix' of a single-depot job's data model saved with np.save.
+--save DIR writes the synthetic matrices in that format. Recorded instances
+have no coordinates to cluster, so they are never decomposed.
+
+Each instance runs in a fresh process (with its search helpers started
+beforehand, like a solve worker's), so the reported peak memory (max RSS)
+is its own. Per instance: wall time, objective, time to first solution,
+solutions found, whether it was decomposed and peak memory. --output
+writes the results as JSON; --compare prints the change of every metric
+against an earlier results file and exits non-zero if an objective got
+worse by more than --tolerance, or the wall time, time to first solution
+or peak memory by more than --time-tolerance / --memory-tolerance.
+
+    python -m backend.benchmarks.solver --shipments 10 100 1000 --output results.json
+    python -m backend.benchmarks.solver --compare results.json
+"""
+
+import os
+
+# The backend modules read DATABASE_URL at import; nothing here uses it
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+
+import numpy as np
+
+from backend import distance, maps_client, optimization, schemas
+
+KINDS = ("uniform", "clustered", "hub")
+
+# Depot of the synthetic instances (midtown Manhattan) and area size
+CENTER = np.array([40.75, -73.99])
+AREA_DEGREES = 0.27  # about 30 km north-south
+
+# Synthetic shipments weigh 1-5 kg; vehicles carry up to VEHICLE_CAPACITY kg
+VEHICLE_CAPACITY = 40
+SHIPMENTS_PER_VEHICLE = 20
+
+
+#==============================================================================
+# Instances
+#==============================================================================
+
+def synthetic_points(kind: str, num_shipments: int, rng) -> np.ndarray:
+    """
+    Returns [lat, lng] of the depot, then of each (pickup, drop) pair.
+    """
+    def spread(count):
+        return CENTER + rng.uniform(-AREA_DEGREES / 2, AREA_DEGREES / 2, size=(count, 2))
+
+    if kind == "uniform":
+        stops = spread(2 * num_shipments)
+    elif kind == "clustered":
+        centers = spread(max(2, num_shipments // 50 + 2))
+        stops = centers[rng.integers(len(centers), size=2 * num_shipments)]
+        stops = stops + rng.normal(0, AREA_DEGREES / 40, size=stops.shape)
+    elif kind == "hub":
+        hub = CENTER + [0.01, 0.01]
+        stops = spread(2 * num_shipments)
+        stops[0::2] = hub + rng.normal(0, 0.0005, size=(num_shipments, 2))
+    else:
+        raise ValueError(f"Unknown instance kind {kind!r}")
+    return np.vstack([CENTER, stops])
+
+
+def synthetic_matrix(points: np.ndarray) -> np.ndarray:
+    """
+    Travel times between points, as the local distance provider computes them.
+    """
+    bands = distance.parse_speed_profile(distance.LOCAL_SPEED_PROFILE)
+    meters = distance.haversine_matrix(points, points) * distance.LOCAL_DETOUR_FACTOR
+    return np.rint(distance.travel_seconds(meters, bands)).astype(maps_client.MATRIX_DTYPE)
+
+
+def make_instance(
+    name: str, matrix: np.ndarray, seed: int,
+    num_vehicles: int | None = None, points: np.ndarray | None = None,
+):
+    """
+    Wraps a duration matrix (depot, then pickup/drop pairs) into a data
+    model, with random shipment weights and a capacitated fleet. With the
+    nodes' [lat, lng] 'points', the instance can be decomposed.
+    """
+    num_shipments = (len(matrix) - 1) // 2
+    if len(matrix) != 2 * num_shipments + 1:
+        raise ValueError(f"{name}: matrix must be depot + pickup/drop pairs, got {len(matrix)} nodes")
+    rng = np.random.default_rng(seed)
+    weights = rng.integers(1, 6, size=num_shipments)
+    num_vehicles = num_vehicles or max(1, math.ceil(num_shipments / SHIPMENTS_PER_VEHICLE))
+
+    demands = [0]
+    for weight in weights:
+        demands += [optimization.scale_weight(weight), -optimization.scale_weight(weight)]
+    data = {
+        'distance_matrix': np.asarray(matrix, dtype=maps_client.MATRIX_DTYPE),
+        'pickups_deliveries': [[2 * k + 1, 2 * k + 2] for k in range(num_shipments)],
+        'num_vehicles': num_vehicles,
+        'starts': [0] * num_vehicles,
+        'ends': [0] * num_vehicles,
+        'demands': demands,
+        'vehicle_capacities': [optimization.scale_weight(VEHICLE_CAPACITY)] * num_vehicles,
+        'time_windows': [None] * len(matrix),
+        'service_times': [0] * len(matrix),
+    }
+    if points is not None:
+        # What decomposition clusters on (see optimization._node_points)
+        data['locations_map'] = [str(node) for node in range(len(points))]
+        data['geocoded_locations'] = {
+            str(node): {"lat": lat, "lng": lng} for node, (lat, lng) in enumerate(points)
+        }
+    return {"name": name, "shipments": num_shipments, "vehicles": num_vehicles, "data": data}
+
+
+#==============================================================================
+# Running
+#==============================================================================
+
+class FirstSolutions:
+    """
+    Progress of a search (see optimization.watch_search): counts the
+    solutions found and when the first one came.
+    """
+
+    def __init__(self, started: float):
+        self.started = started
+        self.first = None
+        self.solutions = 0
+        self.stopped = False
+
+    def improved(self, objective, routes):
+        if self.first is None:
+            self.first = time.perf_counter() - self.started
+        self.solutions += 1
+
+    def should_stop(self) -> bool:
+        return False
+
+    def stop_requested(self) -> bool:
+        return False
+
+
+def run_instance(instance: dict, settings: dict) -> dict:
+    """
+    Solves one instance and measures it. Runs in its own process.
+    """
+    # Like a solve worker's, the helpers are up before the first solve
+    wait(optimization.start_search_pool())
+    data = instance["data"]
+    if "locations_map" not in data:
+        settings = dict(settings, decompose=False)
+
+    started = time.perf_counter()
+    progress = FirstSolutions(started)
+    manager, routing, solution = optimization.search_data_model(data, settings, progress=progress)
+    wall = time.perf_counter() - started
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return {
+        "instance": instance["name"],
+        "shipments": instance["shipments"],
+        "vehicles": instance["vehicles"],
+        "status": "solved" if solution else "no_solution",
+        "objective": solution.ObjectiveValue() if solution else None,
+        "wall_seconds": round(wall, 3),
+        "first_solution_seconds": round(progress.first, 3) if progress.first is not None else None,
+        "solutions": progress.solutions,
+        "decomposed": data['decomposed'],
+        "peak_rss_mb": round(peak_mb, 1),
+    }
+
+
+def run_isolated(instance: dict, settings: dict) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_instance, instance, settings).result()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#==============================================================================
+# Reporting
+#==============================================================================
+
+def print_results(results):
+    header = (
+        f"{'instance':<22} {'ships':>5} {'veh':>4} {'objective':>10} "
+        f"{'wall s':>7} {'first s':>7} {'sols':>5} {'dec':>3} {'rss MB':>7}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        objective = r["objective"] if r["objective"] is not None else "-"
+        first = r["first_solution_seconds"] if r["first_solution_seconds"] is not None else "-"
+        decomposed = "yes" if r.get("decomposed") else "no"
+        print(
+            f"{r['instance']:<22} {r['shipments']:>5} {r['vehicles']:>4} {objective:>10} "
+            f"{r['wall_seconds']:>7} {first:>7} {r['solutions']:>5} {decomposed:>3} {r['peak_rss_mb']:>7}"
+        )
+
+
+# Changes in time below this many seconds are noise, whatever the fraction
+TIME_NOISE_SECONDS = 0.1
+
+
+def _change(before, now, slack: float = 0.0) -> float | None:
+    """
+    Relative change from 'before' to 'now' (positive: worse), ignoring
+    differences up to 'slack'; None if either is missing.
+    """
+    if before is None or now is None:
+        return None
+    if abs(now - before) <= slack:
+        return 0.0
+    return (now - before) / max(before, 1e-9)
+
+
+def compare(results, baseline, tolerances: dict) -> bool:
+    """
+    Prints each instance's change against the baseline results. Returns
+    False if any metric got worse by more than its tolerance (a fraction,
+    keyed by "objective", "time" and "memory"), or an instance that was
+    solved before is no longer solved.
+    """
+    previous = {r["instance"]: r for r in baseline["results"]}
+    ok = True
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for r in results:
+        before = previous.get(r["instance"])
+        if before is None:
+            continue
+        if before["objective"] is not None and r["objective"] is None:
+            print(f"  {r['instance']:<22} REGRESSION: no longer solved")
+            ok = False
+            continue
+
+        metrics = [
+            ("objective", "objective", tolerances["objective"], 0.0),
+            ("wall", "wall_seconds", tolerances["time"], TIME_NOISE_SECONDS),
+            ("first solution", "first_solution_seconds", tolerances["time"], TIME_NOISE_SECONDS),
+            ("rss", "peak_rss_mb", tolerances["memory"], 0.0),
+        ]
+        parts = []
+        regressions = []
+        for label, key, tolerance, slack in metrics:
+            change = _change(before.get(key), r.get(key), slack)
+            if change is None:
+                continue
+            parts.append(f"{label} {before[key]} -> {r[key]} ({change:+.1%})")
+            if change > tolerance:
+                regressions.append(label)
+        if before.get("decomposed") != r.get("decomposed"):
+            parts.append(f"decomposed {before.get('decomposed')} -> {r.get('decomposed')}")
+        flag = ""
+        if regressions:
+            flag = f"  REGRESSION: {', '.join(regressions)}"
+            ok = False
+        print(f"  {r['instance']:<22} " + "   ".join(parts) + flag)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--shipments", type=int, nargs="+", default=[10, 100, 300])
+    parser.add_argument("--replay", nargs="*", default=[], help="recorded .npy matrices")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", choices=sorted(optimization.SOLVE_PROFILES), default="fast")
+    parser.add_argument("--time-limit", type=float, help="seconds per instance (default: the profile's)")
+    parser.add_argument("--save", metavar="DIR", help="write the synthetic matrices as .npy")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", metavar="JSON", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="allowed objective increase")
+    parser.add_argument(
+        "--time-tolerance", type=float, default=0.25,
+        help="allowed increase of wall time and time to first solution",
+    )
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="allowed peak memory increase")
+    args = parser.parse_args()
+
+    options = schemas.SolveOptions(profile=args.profile, time_limit_seconds=args.time_limit)
+    settings = optimization.resolve_solve_settings(options)
+
+    instances = []
+    for kind in args.kinds:
+        for num_shipments in args.shipments:
+            rng = np.random.default_rng(args.seed)
+            points = synthetic_points(kind, num_shipments, rng)
+            matrix = synthetic_matrix(points)
+            name = f"{kind}-{num_shipments}"
+            if args.save:
+                os.makedirs(args.save, exist_ok=True)
+                np.save(os.path.join(args.save, f"{name}.npy"), matrix)
+            instances.append(make_instance(name, matrix, args.seed, points=points))
+    for path in args.replay:
+        name = os.path.splitext(os.path.basename(path))[0]
+        instances.append(make_instance(name, np.load(path), args.seed))
+
+    results = []
+    for instance in instances:
+        print(f"Solving {instance['name']}...", file=sys.stderr)
+        results.append(run_isolated(instance, settings))
+    print_results(results)
+
+    if args.output:
+        import ortools
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "ortools": ortools.__version__,
+                "cpus": os.cpu_count(),
+                "settings": settings,
+                "seed": args.seed,
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        tolerances = {
+            "objective": args.tolerance,
+            "time": args.time_tolerance,
+            "memory": args.memory_tolerance,
+        }
+        if not compare(results, baseline, tolerances):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: API process startup.
+
+Measures, each in fresh interpreter processes so nothing is cached:
+
+    import    importing backend.main (what every API replica and worker pays)
+    first     importing backend.main, running startup and serving a first
+              GET /jobs/ on an empty SQLite database (a cold CRUD request)
+    deferred  what the lazy imports keep off that path: importing OR-Tools
+              and the Google clients, and building the clients
+
+Also reports which heavy modules are loaded after importing backend.main;
+none of them should be.
+
+Runs offline, without a database server or Maps API key:
+
+    python -m backend.benchmarks.startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HEAVY_MODULES = ["ortools", "grpc", "googlemaps", "google.maps.routing_v2"]
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import backend.main
+elapsed = time.perf_counter() - start
+loaded = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": loaded}}))
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import backend.main
+from fastapi.testclient import TestClient
+with TestClient(backend.main.app) as client:
+    response = client.get("/jobs/")
+    assert response.status_code == 200, response.text
+    elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed}))
+"""
+
+DEFERRED_SNIPPET = """
+import json, time
+start = time.perf_counter()
+from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+ortools = time.perf_counter() - start
+
+start = time.perf_counter()
+from backend import maps_client
+maps_client.get_routes_client()
+maps_client.get_geocoding_client()
+clients = time.perf_counter() - start
+print(json.dumps({"ortools": ortools, "clients": clients}))
+"""
+
+
+def run_snippet(code: str, env: dict) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    return f"median {statistics.median(values) * 1000:7.1f} ms   min {min(values) * 1000:7.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+            # Any well-formed key: the clients are built but never called
+            "GOOGLE_MAPS_API_KEY": os.environ.get("GOOGLE_MAPS_API_KEY") or "AIza" + "0" * 35,
+            "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])),
+        }
+        env.pop("ASYNC_DATABASE_URL", None)
+
+        imports = [run_snippet(IMPORT_SNIPPET.format(heavy=HEAVY_MODULES), env) for _ in range(args.runs)]
+        firsts = [run_snippet(FIRST_REQUEST_SNIPPET, env) for _ in range(args.runs)]
+        deferred = [run_snippet(DEFERRED_SNIPPET, env) for _ in range(args.runs)]
+
+    print(f"{'import backend.main':<26} {summarize([r['seconds'] for r in imports])}")
+    print(f"{'first GET /jobs/':<26} {summarize([r['seconds'] for r in firsts])}")
+    print(f"{'deferred: ortools':<26} {summarize([r['ortools'] for r in deferred])}")
+    print(f"{'deferred: maps clients':<26} {summarize([r['clients'] for r in deferred])}")
+    loaded = sorted({m for r in imports for m in r["loaded"]})
+    print(f"heavy modules loaded at import: {', '.join(loaded) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark: Python transit callback vs. native transit matrix.
+
+Builds random single-vehicle pickup-and-delivery instances and runs the same
+time-limited guided local search twice: once with the old Python
+'distance_callback' closure and once with the matrix registered through
+RoutingModel.RegisterTransitMatrix (what optimization.build_routing_model
+does). Reports search throughput for each.
+
+Runs offline, without a database or Maps API key:
+
+    python -m backend.benchmarks.transit_evaluator --nodes 101 201 401
+"""
+
+import argparse
+import time
+
+import numpy as np
+from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+
+def random_instance(num_nodes: int, seed: int):
+    """
+    Returns (matrix, pickups_deliveries) for 'num_nodes' random points:
+    node 0 is the depot, then (pickup, drop) pairs.
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 20_000, size=(num_nodes, 2))
+    deltas = points[:, None, :] - points[None, :, :]
+    matrix = np.rint(np.hypot(deltas[..., 0], deltas[..., 1])).astype(np.int64)
+    pairs = [[2 * k + 1, 2 * k + 2] for k in range((num_nodes - 1) // 2)]
+    return matrix, pairs
+
+
+def run(matrix, pairs, use_python_callback: bool, time_limit: float):
+    manager = pywrapcp.RoutingIndexManager(len(matrix), 1, 0)
+    routing = pywrapcp.RoutingModel(manager)
+
+    if use_python_callback:
+        rows = matrix.tolist()
+
+        def distance_callback(from_index, to_index):
+            from_node = manager.IndexToNode(from_index)
+            to_node = manager.IndexToNode(to_index)
+            return rows[from_node][to_node]
+
+        transit = routing.RegisterTransitCallback(distance_callback)
+    else:
+        transit = routing.RegisterTransitMatrix(matrix.tolist())
+    routing.SetArcCostEvaluatorOfAllVehicles(transit)
+
+    for pickup, drop in pairs:
+        pickup_index = manager.NodeToIndex(pickup)
+        drop_index = manager.NodeToIndex(drop)
+        routing.AddPickupAndDelivery(pickup_index, drop_index)
+        routing.solver().Add(routing.VehicleVar(pickup_index) == routing.VehicleVar(drop_index))
+
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    params.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    )
+    params.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+    start = time.perf_counter()
+    solution = routing.SolveWithParameters(params)
+    wall = time.perf_counter() - start
+
+    solver = routing.solver()
+    return {
+        "wall_s": wall,
+        "objective": solution.ObjectiveValue() if solution else None,
+        "iterations_per_s": solver.AcceptedNeighbors() / wall,
+        "branches_per_s": solver.Branches() / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[101, 201, 401])
+    parser.add_argument("--time-limit", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    header = f"{'nodes':>6} {'evaluator':>9} {'objective':>10} {'iter/s':>9} {'branch/s':>9}"
+    print(header)
+    print("-" * len(header))
+    for num_nodes in args.nodes:
+        matrix, pairs = random_instance(num_nodes, args.seed)
+        results = {}
+        for name, use_callback in (("callback", True), ("matrix", False)):
+            results[name] = result = run(matrix, pairs, use_callback, args.time_limit)
+            print(
+                f"{num_nodes:>6} {name:>9} {result['objective']:>10} "
+                f"{result['iterations_per_s']:>9.1f} {result['branches_per_s']:>9.1f}"
+            )
+        speedup = results["matrix"]["iterations_per_s"] / max(results["callback"]["iterations_per_s"], 1e-9)
+        print(f"{num_nodes:>6} {'speedup':>9} {'':>10} {speedup:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
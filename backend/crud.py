@@ -4,9 +4,15 @@ This module provides functions to create and read jobs and shipments
 from the database using SQLAlchemy ORM.
 """
 
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 from . import models, schemas
 
+# Rows per INSERT statement of a bulk upload (see insert_shipments_for_job)
+BULK_INSERT_BATCH_SIZE = 1000
+
 # --- READ Operations ---
 
 def get_job(db: Session, job_id: int):
@@ -15,12 +21,86 @@ def get_job(db: Session, job_id: int):
     # .first(): Get the first result (or None if not found).
     return db.query(models.Job).filter(models.Job.id == job_id).first()
 
-def get_jobs(db: Session, skip: int = 0, limit: int = 100):
-    # .offset(skip): Skip the first 'skip' results.
-    # .limit(limit): Only return a maximum of 'limit' results.
-    # .all(): Get all results that match.
-    # This is how you do "pagination" (e.g., "show me page 2 of the results").
-    return db.query(models.Job).offset(skip).limit(limit).all()
+def _jobs_page(statement, cursor: int | None, status: str | None, limit: int):
+    # Keyset ("cursor") pagination: instead of OFFSET, which scans and
+    # discards every skipped row, continue right after the last job of the
+    # previous page in (created_at, id) order. The cursor is that job's id.
+    if status is not None:
+        statement = statement.where(models.Job.status == status)
+    if cursor is not None:
+        anchor = (
+            select(models.Job.created_at)
+            .where(models.Job.id == cursor)
+            .scalar_subquery()
+        )
+        statement = statement.where(or_(
+            models.Job.created_at > anchor,
+            and_(models.Job.created_at == anchor, models.Job.id > cursor),
+        ))
+    return statement.order_by(models.Job.created_at, models.Job.id).limit(limit)
+
+def _jobs_statement(limit: int, cursor: int | None, status: str | None):
+    # selectinload fetches the shipments of every job on the page in one
+    # extra query, instead of one lazy query per job during serialization.
+    statement = select(models.Job).options(selectinload(models.Job.shipments))
+    return _jobs_page(statement, cursor, status, limit)
+
+def _job_summaries_statement(limit: int, cursor: int | None, status: str | None):
+    # Same page as get_jobs, but with aggregated shipment counts and weights
+    # instead of the shipments themselves.
+    statement = (
+        select(
+            models.Job,
+            func.count(models.Shipment.id),
+            func.coalesce(func.sum(models.Shipment.weight), 0.0),
+        )
+        .outerjoin(models.Shipment, models.Shipment.job_id == models.Job.id)
+        .group_by(models.Job.id)
+    )
+    return _jobs_page(statement, cursor, status, limit)
+
+def _job_summaries(rows):
+    return [
+        schemas.JobSummary.model_validate(job).model_copy(update={
+            "shipment_count": shipment_count,
+            "total_weight": total_weight,
+        })
+        for job, shipment_count, total_weight in rows
+    ]
+
+def get_jobs(db: Session, limit: int = 100, cursor: int | None = None, status: str | None = None):
+    return db.execute(_jobs_statement(limit, cursor, status)).scalars().all()
+
+def get_job_summaries(db: Session, limit: int = 100, cursor: int | None = None, status: str | None = None):
+    return _job_summaries(db.execute(_job_summaries_statement(limit, cursor, status)).all())
+
+# --- Async READ Operations ---
+# Used by the read endpoints. They take an AsyncSession when an async driver
+# is configured (see database.get_read_db); given a regular Session, they
+# fall back to the sync functions above in the threadpool.
+
+async def get_job_async(db: AsyncSession | Session, job_id: int, with_shipments: bool = True):
+    statement = select(models.Job).where(models.Job.id == job_id)
+    if with_shipments:
+        # Load the shipments up front: async sessions cannot lazy-load, and
+        # a lazy load during serialization would block the event loop
+        statement = statement.options(selectinload(models.Job.shipments))
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(lambda: db.execute(statement).scalar_one_or_none())
+    result = await db.execute(statement)
+    return result.scalar_one_or_none()
+
+async def get_jobs_async(db: AsyncSession | Session, limit: int = 100, cursor: int | None = None, status: str | None = None):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(get_jobs, db, limit=limit, cursor=cursor, status=status)
+    result = await db.execute(_jobs_statement(limit, cursor, status))
+    return result.scalars().all()
+
+async def get_job_summaries_async(db: AsyncSession | Session, limit: int = 100, cursor: int | None = None, status: str | None = None):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(get_job_summaries, db, limit=limit, cursor=cursor, status=status)
+    result = await db.execute(_job_summaries_statement(limit, cursor, status))
+    return _job_summaries(result.all())
 
 # --- CREATE Operations ---
 
@@ -52,17 +132,104 @@ def create_shipment_for_job(db: Session, shipment: schemas.ShipmentCreate, job_i
     db.refresh(db_shipment)
     return db_shipment
 
+def insert_shipments_for_job(db: Session, shipments: list[schemas.ShipmentCreate], job_id: int):
+    """
+    Inserts a batch of shipments for a job with one multi-row INSERT instead
+    of one ORM round trip per shipment. Unlike the other functions here it
+    does not commit: a bulk upload inserts batch after batch as it streams
+    in, and commits (or rolls back) once at the end.
+
+    Returns:
+        The ids of the new shipments.
+    """
+    statement = insert(models.Shipment).returning(models.Shipment.id)
+    rows = [{**shipment.dict(), "job_id": job_id} for shipment in shipments]
+    return db.scalars(statement, rows).all()
+
 #==============================================================================
 # UPDATE Operations
 #==============================================================================
 
-def update_job_status(db: Session, job_id: int, status: str):
+def update_job_status(db: Session, job_id: int, status: str, error: str | None = None):
     """
     Updates the status of a specific job.
     """
     db_job = get_job(db, job_id=job_id)
     if db_job:
         db_job.status = status
+        db_job.error = error
         db.commit()
         db.refresh(db_job)
-    return db_job
\ No newline at end of file
+    return db_job
+
+def queue_job(db: Session, job_id: int, stale_status: str | None = None) -> bool:
+    """
+    Marks a job "queued" for a new solve, clearing the error, progress and
+    stop request of the last one, unless the job is already queued or being
+    solved; a job stuck in 'stale_status' (its solve died) is queued anyway.
+    Check and update are a single statement, so of concurrent requests to
+    solve a job only one queues it. Returns whether this call queued it.
+    """
+    available = models.Job.status.not_in(models.ACTIVE_STATUSES)
+    if stale_status is not None:
+        available = or_(available, models.Job.status == stale_status)
+    result = db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, available)
+        .values(status=models.QUEUED_STATUS, error=None, progress=None, stop_requested=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def fail_interrupted_jobs(db: Session) -> int:
+    """
+    Marks every job that is queued or being solved as failed. Called on
+    startup: solves run in the API process's worker pool, so none of them
+    survived the restart. Returns the number of jobs marked.
+    """
+    result = db.execute(
+        update(models.Job)
+        .where(models.Job.status.in_(models.ACTIVE_STATUSES))
+        .values(status="failed", error="Interrupted by a server restart; solve the job again")
+    )
+    db.commit()
+    return result.rowcount
+
+def save_job_solution(db: Session, job_id: int, solution: schemas.Solution, fingerprint: str):
+    """
+    Stores a job's solution, along with the fingerprint of the inputs it was
+    computed from, and marks the job as completed.
+    """
+    db_job = get_job(db, job_id=job_id)
+    if db_job:
+        db_job.solution = solution.model_dump_json()
+        db_job.solution_fingerprint = fingerprint
+        db_job.status = "completed"
+        db_job.error = None
+        db.commit()
+        db.refresh(db_job)
+    return db_job
+
+def save_job_progress(db: Session, job_id: int, progress: schemas.SolveProgress):
+    """
+    Stores the progress of a job's running search. Returns the refreshed
+    job, so the solve worker also picks up stop requests.
+    """
+    db_job = get_job(db, job_id=job_id)
+    if db_job:
+        db_job.progress = progress.model_dump_json()
+        db.commit()
+        db.refresh(db_job)
+    return db_job
+
+def request_job_stop(db: Session, job_id: int):
+    """
+    Asks the solve worker to end a job's search early and keep the best
+    solution found so far.
+    """
+    db_job = get_job(db, job_id=job_id)
+    if db_job:
+        db_job.stop_requested = True
+        db.commit()
+        db.refresh(db_job)
+    return db_job
@@ -2,10 +2,16 @@
 Database setup and session management using SQLAlchemy.
 This module defines the database connection, session factory,
 and base class for models.
+
+There are no migration scripts: on startup, create_db_and_tables creates
+missing tables and upgrade_schema adds the columns and indexes that newer
+models define to tables created by an older version.
 """
 
 import os
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -16,24 +22,128 @@ load_dotenv()
 # Get the database connection URL from environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Optional async driver URL (e.g. postgresql+asyncpg://... or
+# sqlite+aiosqlite:///...). When set, the read endpoints use AsyncSession.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# Connection pool tuning
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Server-side statement timeout in milliseconds, PostgreSQL only (0 = none)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+
+# Keep IN (...) clauses well below database parameter limits
+QUERY_CHUNK_SIZE = 500
+
+
+def _engine_options(url: str) -> dict:
+    """
+    Returns the create_engine keyword arguments for the given URL.
+    SQLite (local development) keeps SQLAlchemy's default pooling.
+    """
+    if url.startswith("sqlite"):
+        return {}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS > 0 and url.startswith("postgresql"):
+        if "+asyncpg" in url:
+            options["connect_args"] = {
+                "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+            }
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
 # The engine is the central source of database connectivity.
 # It manages a pool of connections.
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 
 # SessionLocal is a "factory" for creating new database sessions.
 # Each session will be a short-lived "conversation" with the database.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async counterparts, only when ASYNC_DATABASE_URL is configured.
+# expire_on_commit=False: async sessions cannot lazily reload attributes.
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DATABASE_URL:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Base is a declarative base class that our models will inherit from.
 # SQLAlchemy uses this to map our models (like Job, Shipment) to database tables.
 Base = declarative_base()
 
 def create_db_and_tables():
     """
-    Creates all database tables defined by models that inherit from Base.
-    This function is called once on application startup.
+    Creates all database tables defined by models that inherit from Base,
+    and brings tables created by an older version up to date (see
+    upgrade_schema). This function is called once on application startup.
     """
     Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+def upgrade_schema(bind):
+    """
+    create_all only creates missing tables, so columns and indexes added to
+    a model never reach an existing database on their own. This adds them:
+
+    - missing columns are added with ALTER TABLE (columns are only ever
+      added nullable); existing rows get the column's default, if it has a
+      plain one, and NULL otherwise;
+    - missing indexes are created;
+    - cache tables (info={"cache": True}) whose columns or key changed are
+      dropped and recreated empty, since their rows can be fetched again.
+
+    Raises RuntimeError if a table can't be brought up to date this way;
+    the message names the table, so it can be migrated by hand.
+    """
+    inspector = inspect(bind)
+    quote = bind.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        primary_key = inspector.get_pk_constraint(table.name)["constrained_columns"]
+
+        if table.info.get("cache") and (
+            existing != set(table.columns.keys())
+            or set(primary_key) != set(table.primary_key.columns.keys())
+        ):
+            print(f"Schema of cache table '{table.name}' changed; recreating it empty.")
+            table.drop(bind)
+            table.create(bind)
+            continue
+
+        missing = [column for column in table.columns if column.name not in existing]
+        for column in missing:
+            if column.primary_key or not column.nullable:
+                raise RuntimeError(
+                    f"Table '{table.name}' lacks column '{column.name}', which can't be "
+                    f"added automatically; migrate it by hand."
+                )
+        with bind.begin() as connection:
+            for column in missing:
+                column_type = column.type.compile(dialect=bind.dialect)
+                connection.execute(text(
+                    f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"
+                ))
+                if column.default is not None and column.default.is_scalar:
+                    connection.execute(table.update().values({column.name: column.default.arg}))
+                print(f"Added column '{table.name}.{column.name}'.")
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind)
+                print(f"Created index '{index.name}'.")
 
 # ... (all your existing code: DATABASE_URL, engine, SessionLocal, Base, create_db_and_tables) ...
 
@@ -46,4 +156,28 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@asynccontextmanager
+async def read_session():
+    """
+    Opens a session for reads: an AsyncSession when ASYNC_DATABASE_URL is
+    configured, otherwise a regular Session (the async crud functions then
+    run their queries in the threadpool).
+    """
+    if AsyncSessionLocal is None:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    """
+    A dependency for read-only endpoints, see read_session.
+    """
+    async with read_session() as db:
+        yield db
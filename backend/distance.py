@@ -0,0 +1,239 @@
+"""
+Pluggable distance providers: geocoding, travel-time matrices and route
+geometry.
+
+    google  Geocoding API + Routes API, through the geocode store and the
+            travel-time cache (geocoding.py, matrix_cache.py).
+    local   Offline. Coordinates come from stored geocodes or literal
+            "lat,lng" addresses; travel times from great-circle distances
+            and a speed profile, or from shortest paths over a road graph
+            file when LOCAL_ROAD_GRAPH is set. Route geometry follows the
+            road graph, or is drawn as straight lines without one.
+
+A job picks its provider with Job.distance_provider; jobs without one use
+DISTANCE_PROVIDER (default: google).
+"""
+
+import os
+
+import numpy as np
+
+from . import geocoding, maps_client, matrix_cache
+
+DISTANCE_PROVIDER = os.getenv("DISTANCE_PROVIDER", "google")
+
+# Piecewise speed profile of the local provider: "up_to_km:kmh" bands,
+# applied cumulatively, so the first 5 km of a trip run at 25 km/h, the
+# next 25 km at 45 km/h and the rest at 80 km/h.
+LOCAL_SPEED_PROFILE = os.getenv("LOCAL_SPEED_PROFILE", "5:25,30:45,*:80")
+
+# Roads are longer than the great-circle distance between their ends
+LOCAL_DETOUR_FACTOR = float(os.getenv("LOCAL_DETOUR_FACTOR", 1.3))
+
+# Optional road graph (.npz) for the local provider, see load_road_graph()
+LOCAL_ROAD_GRAPH = os.getenv("LOCAL_ROAD_GRAPH")
+
+EARTH_RADIUS_M = 6_371_000.0
+
+
+def parse_speed_profile(profile: str):
+    """
+    Parses "5:25,30:45,*:80" into [(5000.0, 6.94), (30000.0, 12.5), (inf, 22.2)],
+    i.e. (band upper bound in meters, speed in m/s), sorted by bound.
+    """
+    bands = []
+    for band in profile.split(","):
+        up_to, kmh = band.split(":")
+        bound = np.inf if up_to.strip() == "*" else float(up_to) * 1000
+        bands.append((bound, float(kmh) / 3.6))
+    bands.sort()
+    if bands[-1][0] != np.inf:
+        raise ValueError(f"Speed profile {profile!r} needs a final '*' band")
+    return bands
+
+
+def haversine_matrix(origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distances in meters between (n, 2) and (m, 2) arrays of
+    [lat, lng] degrees, as an (n, m) float array.
+    """
+    origins = np.radians(origins)
+    destinations = np.radians(destinations)
+    dlat = destinations[None, :, 0] - origins[:, None, 0]
+    dlng = destinations[None, :, 1] - origins[:, None, 1]
+    a = (
+        np.sin(dlat / 2) ** 2
+        + np.cos(origins[:, None, 0]) * np.cos(destinations[None, :, 0]) * np.sin(dlng / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def travel_seconds(meters: np.ndarray, bands) -> np.ndarray:
+    """
+    Travel time in seconds over road distances in meters, driving each
+    stretch of the trip at the speed of its band.
+    """
+    seconds = np.zeros_like(meters, dtype=np.float64)
+    lower = 0.0
+    for upper, speed in bands:
+        seconds += np.clip(meters - lower, 0.0, upper - lower) / speed
+        lower = upper
+    return seconds
+
+
+def encode_polyline(points) -> str:
+    """
+    Encodes [(lat, lng), ...] with Google's encoded polyline algorithm
+    (5 decimal places), the format the Routes API returns.
+    """
+    chunks = []
+    previous = (0, 0)
+    for lat, lng in points:
+        current = (int(round(lat * 1e5)), int(round(lng * 1e5)))
+        for value, last in zip(current, previous):
+            delta = value - last
+            delta = ~(delta << 1) if delta < 0 else delta << 1
+            while delta >= 0x20:
+                chunks.append(chr((0x20 | (delta & 0x1F)) + 63))
+                delta >>= 5
+            chunks.append(chr(delta + 63))
+        previous = current
+    return "".join(chunks)
+
+
+def load_road_graph(path: str):
+    """
+    Loads a road graph from an .npz file with the arrays:
+
+        nodes      (N, 2) float, [lat, lng] of every intersection
+        edges      (M, 2) int, directed (from, to) node indices; list
+                   both directions for two-way roads
+        durations  (M,) float, travel time of each edge in seconds
+
+    Returns (nodes, sparse adjacency matrix). Requires scipy.
+    """
+    from scipy.sparse import csr_matrix
+
+    with np.load(path) as archive:
+        nodes = np.asarray(archive["nodes"], dtype=np.float64)
+        edges = np.asarray(archive["edges"], dtype=np.int64)
+        durations = np.asarray(archive["durations"], dtype=np.float64)
+    graph = csr_matrix(
+        (durations, (edges[:, 0], edges[:, 1])),
+        shape=(len(nodes), len(nodes)),
+    )
+    return nodes, graph
+
+
+#==============================================================================
+# Providers
+#==============================================================================
+
+class GoogleProvider:
+    """
+    Google Maps Platform: Geocoding API and Routes API.
+    """
+    name = "google"
+    # Whether geocode() may call out to a remote service
+    online = True
+
+    def geocode(self, addresses: list[str]):
+        return geocoding.geocode_addresses(addresses)
+
+    def matrix(self, locations: list[str], coordinates: list[dict]):
+        return matrix_cache.get_distance_matrix(locations)
+
+    def route_polylines(self, coordinates: list[dict]):
+        return maps_client.get_route_polylines(coordinates)
+
+
+class LocalProvider:
+    """
+    Offline travel times computed from coordinates.
+    """
+    name = "local"
+    online = False
+
+    def __init__(self, road_graph_path: str | None = LOCAL_ROAD_GRAPH):
+        self.bands = parse_speed_profile(LOCAL_SPEED_PROFILE)
+        self.road_graph = None
+        if road_graph_path:
+            self.road_graph = load_road_graph(road_graph_path)
+
+    def geocode(self, addresses: list[str]):
+        # Stored geocodes and "lat,lng" literals only; never calls the API
+        return geocoding.geocode_addresses(addresses, fetch_missing=False)
+
+    def matrix(self, locations: list[str], coordinates: list[dict]):
+        points = np.array([[c["lat"], c["lng"]] for c in coordinates], dtype=np.float64)
+        if self.road_graph is not None:
+            seconds = self._road_seconds(points)
+        else:
+            seconds = travel_seconds(haversine_matrix(points, points) * LOCAL_DETOUR_FACTOR, self.bands)
+        matrix = np.full(seconds.shape, maps_client.UNREACHABLE, dtype=maps_client.MATRIX_DTYPE)
+        finite = np.isfinite(seconds)
+        matrix[finite] = np.rint(np.minimum(seconds[finite], maps_client.UNREACHABLE))
+        np.fill_diagonal(matrix, 0)
+        return matrix
+
+    def route_polylines(self, coordinates: list[dict]):
+        points = np.array([[c["lat"], c["lng"]] for c in coordinates], dtype=np.float64)
+        if self.road_graph is None:
+            return [encode_polyline(points[i:i + 2]) for i in range(len(points) - 1)]
+        return [encode_polyline(path) for path in self._road_paths(points)]
+
+    def _road_paths(self, points: np.ndarray):
+        """
+        Yields the road geometry of each leg between consecutive points:
+        the point, the graph nodes of the shortest path between their
+        snapped nodes, then the next point.
+        """
+        from scipy.sparse.csgraph import dijkstra
+
+        nodes, graph = self.road_graph
+        snapped = haversine_matrix(points, nodes).argmin(axis=1)
+        sources, source_rows = np.unique(snapped[:-1], return_inverse=True)
+        _, predecessors = dijkstra(graph, directed=True, indices=sources, return_predecessors=True)
+        for leg, row in enumerate(source_rows):
+            path = [snapped[leg + 1]]
+            while path[-1] != snapped[leg] and predecessors[row, path[-1]] >= 0:
+                path.append(predecessors[row, path[-1]])
+            if path[-1] != snapped[leg]:
+                path = []  # unreachable over the graph: draw the leg straight
+            yield [points[leg], *nodes[path[::-1]], points[leg + 1]]
+
+    def _road_seconds(self, points: np.ndarray) -> np.ndarray:
+        """
+        Shortest-path travel times over the road graph. Each point is
+        snapped to its nearest graph node and the straight stretch to it is
+        driven at the speed of the first profile band.
+        """
+        from scipy.sparse.csgraph import dijkstra
+
+        nodes, graph = self.road_graph
+        access = haversine_matrix(points, nodes)
+        snapped = access.argmin(axis=1)
+        access_seconds = access[np.arange(len(points)), snapped] * LOCAL_DETOUR_FACTOR / self.bands[0][1]
+
+        # One Dijkstra per distinct snapped node
+        sources, source_rows = np.unique(snapped, return_inverse=True)
+        paths = dijkstra(graph, directed=True, indices=sources)
+        road = paths[source_rows][:, snapped]
+        return access_seconds[:, None] + road + access_seconds[None, :]
+
+
+PROVIDERS = {"google": GoogleProvider, "local": LocalProvider}
+_instances = {}
+
+
+def get_provider(name: str | None = None):
+    """
+    Returns the provider called 'name' (default: DISTANCE_PROVIDER).
+    Providers are created once per process.
+    """
+    name = name or DISTANCE_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown distance provider {name!r}")
+    if name not in _instances:
+        _instances[name] = PROVIDERS[name]()
+    return _instances[name]
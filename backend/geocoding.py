@@ -0,0 +1,157 @@
+"""
+Persistent geocoding on top of maps_client.
+
+Every distinct address is geocoded once and stored in the
+'geocoded_addresses' table. Shipments additionally keep their own
+coordinates, filled in right after they are created, so a solve normally
+doesn't need to geocode anything at all.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from . import maps_client, models
+from .database import QUERY_CHUNK_SIZE, SessionLocal
+
+
+def parse_coordinates(address: str):
+    """
+    Returns {lat, lng} if 'address' is a literal "lat,lng" pair
+    (e.g. "40.7505,-73.9934"), otherwise None.
+    """
+    parts = address.split(",")
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lng = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return {"lat": lat, "lng": lng}
+
+
+def geocode_addresses(addresses: list[str], fetch_missing: bool = True):
+    """
+    Geocodes a list of addresses, using stored results where possible.
+    Addresses that are not stored yet are geocoded concurrently and saved,
+    unless 'fetch_missing' is False (offline use: they map to None).
+    Literal "lat,lng" addresses are never sent to the geocoder.
+
+    Returns:
+        A dictionary mapping each address string to its {lat, lng},
+        or None if it could not be geocoded.
+
+    Raises:
+        maps_client.MapsAPIError if the Geocoding API could not be reached
+        (the addresses that were geocoded are stored all the same).
+    """
+    keys = {address: maps_client.normalize_address(address) for address in addresses}
+    stored = {}
+    for key in set(keys.values()):
+        coords = parse_coordinates(key)
+        if coords is not None:
+            stored[key] = coords
+    unique_keys = [key for key in set(keys.values()) if key not in stored]
+
+    with SessionLocal() as db:
+        for start in range(0, len(unique_keys), QUERY_CHUNK_SIZE):
+            chunk = unique_keys[start:start + QUERY_CHUNK_SIZE]
+            rows = db.execute(
+                select(models.GeocodedAddress)
+                .where(models.GeocodedAddress.address_key.in_(chunk))
+            ).scalars()
+            for row in rows:
+                stored[row.address_key] = {"lat": row.lat, "lng": row.lng}
+
+        # One representative spelling per missing key
+        missing = {}
+        for address, key in keys.items():
+            if key not in stored:
+                missing.setdefault(key, address)
+
+        if missing and not fetch_missing:
+            stored.update(dict.fromkeys(missing))
+        elif missing:
+            print(f"Geocoding {len(missing)} new address(es)...")
+            error = None
+            try:
+                results = maps_client.geocode_locations(list(missing.values()))
+            except maps_client.MapsAPIError as e:
+                # Keep what was geocoded before raising
+                error = e
+                results = getattr(e, "results", {})
+            for key, address in missing.items():
+                coords = results.get(address)
+                stored[key] = coords
+                if coords is not None:
+                    db.merge(models.GeocodedAddress(
+                        address_key=key, address=address,
+                        lat=coords["lat"], lng=coords["lng"],
+                    ))
+            try:
+                db.commit()
+            except IntegrityError:
+                # A concurrent solve stored the same address first
+                db.rollback()
+            if error is not None:
+                raise error
+
+    return {address: stored[key] for address, key in keys.items()}
+
+
+def shipment_coordinates(shipment):
+    """
+    Returns the stored (origin, destination) coordinates of a shipment,
+    each as a {lat, lng} dictionary or None if not geocoded yet.
+    """
+    origin = None
+    destination = None
+    if shipment.origin_lat is not None and shipment.origin_lng is not None:
+        origin = {"lat": shipment.origin_lat, "lng": shipment.origin_lng}
+    if shipment.destination_lat is not None and shipment.destination_lng is not None:
+        destination = {"lat": shipment.destination_lat, "lng": shipment.destination_lng}
+    return origin, destination
+
+
+def fill_shipment_coordinates(shipment_ids: list[int], fetch_missing: bool = True):
+    """
+    Geocodes and stores the origin/destination coordinates of the given
+    shipments, QUERY_CHUNK_SIZE shipments at a time. Runs as a background
+    task after shipments are created.
+    With 'fetch_missing' False, only already known coordinates are filled in.
+    """
+    with SessionLocal() as db:
+        for start in range(0, len(shipment_ids), QUERY_CHUNK_SIZE):
+            chunk = shipment_ids[start:start + QUERY_CHUNK_SIZE]
+            shipments = db.execute(
+                select(models.Shipment).where(models.Shipment.id.in_(chunk))
+            ).scalars().all()
+
+            addresses = []
+            for shipment in shipments:
+                origin, destination = shipment_coordinates(shipment)
+                if origin is None:
+                    addresses.append(shipment.origin)
+                if destination is None:
+                    addresses.append(shipment.destination)
+            if not addresses:
+                continue
+
+            try:
+                coords = geocode_addresses(addresses, fetch_missing=fetch_missing)
+            except maps_client.MapsAPIError as e:
+                # The solve geocodes whatever is still missing
+                print(f"Could not geocode {len(shipment_ids) - start} shipments: {e}")
+                return
+            for shipment in shipments:
+                origin = coords.get(shipment.origin)
+                if shipment.origin_lat is None and origin is not None:
+                    shipment.origin_lat, shipment.origin_lng = origin["lat"], origin["lng"]
+                destination = coords.get(shipment.destination)
+                if shipment.destination_lat is None and destination is not None:
+                    shipment.destination_lat = destination["lat"]
+                    shipment.destination_lng = destination["lng"]
+            db.commit()
+            # The chunk's shipments aren't needed any more
+            db.expunge_all()
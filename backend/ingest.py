@@ -0,0 +1,111 @@
+"""
+Parsing for bulk shipment uploads (POST /jobs/{job_id}/shipments:bulk).
+
+Accepts a JSON array, CSV (one row per line, with a header row) or NDJSON
+request body. CSV and NDJSON bodies are parsed line by line as they stream
+in, and every row is validated against schemas.ShipmentCreate on the way,
+so a bad row is reported by number instead of failing the whole upload.
+"""
+
+import csv
+import json
+
+from pydantic import ValidationError
+
+from . import schemas
+
+CSV_TYPES = {"text/csv", "application/csv"}
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+JSON_TYPES = {"application/json"}
+SUPPORTED_TYPES = CSV_TYPES | NDJSON_TYPES | JSON_TYPES
+
+
+def media_type(content_type: str | None) -> str:
+    """
+    Returns the bare media type of a Content-Type header ("text/csv; charset=utf-8" -> "text/csv").
+    """
+    return (content_type or "application/json").split(";")[0].strip().lower()
+
+
+async def _iter_lines(stream):
+    """
+    Yields decoded lines from an async stream of byte chunks.
+    """
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8").rstrip("\r")
+
+
+def _validate(row_number: int, raw):
+    """
+    Validates one raw row. Returns (row_number, ShipmentCreate, None) or
+    (row_number, None, error message).
+    """
+    if not isinstance(raw, dict):
+        return row_number, None, "Expected an object with origin, destination and weight"
+    try:
+        return row_number, schemas.ShipmentCreate(**raw), None
+    except ValidationError as e:
+        errors = "; ".join(
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()
+        )
+        return row_number, None, errors
+
+
+async def iter_shipment_rows(content_type: str | None, stream):
+    """
+    Parses a bulk upload body and yields one (row_number, shipment, error)
+    triple per data row, numbered from 1. Exactly one of 'shipment' (a
+    validated ShipmentCreate) and 'error' (a message) is set.
+    """
+    kind = media_type(content_type)
+
+    if kind in CSV_TYPES:
+        header = None
+        row_number = 0
+        async for line in _iter_lines(stream):
+            if not line.strip():
+                continue
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            row_number += 1
+            if len(values) != len(header):
+                yield row_number, None, f"Expected {len(header)} columns, got {len(values)}"
+                continue
+            # Empty cells of optional columns (e.g. time windows) mean "not set"
+            yield _validate(row_number, {
+                name: value for name, value in zip(header, values) if value.strip()
+            })
+
+    elif kind in NDJSON_TYPES:
+        row_number = 0
+        async for line in _iter_lines(stream):
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                raw = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, None, f"Invalid JSON: {e.msg}"
+                continue
+            yield _validate(row_number, raw)
+
+    else:
+        body = b""
+        async for chunk in stream:
+            body += chunk
+        try:
+            rows = json.loads(body or b"[]")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON body: {e.msg}")
+        if not isinstance(rows, list):
+            raise ValueError("Expected a JSON array of shipments")
+        for row_number, raw in enumerate(rows, start=1):
+            yield _validate(row_number, raw)
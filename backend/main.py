@@ -2,15 +2,27 @@
 Main application file for the LogiOpt backend API.
 Defines FastAPI app, startup events, and API endpoints for managing jobs and shipments.
 """
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import re
+import time
+
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Literal, Optional, Union
 
 # NEW: Import the CORS middleware
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
 
-from . import crud, models, schemas, optimization
-from .database import create_db_and_tables, get_db
+from . import crud, database, distance, matrix_cache, models, schemas, geocoding, ingest, optimization, telemetry, worker
+from .database import create_db_and_tables, get_db, get_read_db, read_session
 
 app = FastAPI(
     title="LogiOpt API",
@@ -33,17 +45,61 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], # Allow all methods (GET, POST, etc.)
     allow_headers=["*"], # Allow all headers
+    expose_headers=["X-Next-Cursor"], # Let the frontend read the pagination cursor
 )
 # --- End of CORS Configuration ---
 
+# --- Response compression ---
+# Brotli (falling back to gzip for clients without it) when brotli-asgi is
+# installed, gzip otherwise. Event streams are sent uncompressed: the
+# compressors buffer their output, which would hold events back.
+UNCOMPRESSED_PATHS = r"/events$"
+COMPRESSION_MIN_BYTES = 1000
+
+class StreamingAwareGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and re.search(UNCOMPRESSED_PATHS, scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+if BrotliMiddleware is not None:
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=COMPRESSION_MIN_BYTES,
+        excluded_handlers=[UNCOMPRESSED_PATHS],
+    )
+else:
+    app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=COMPRESSION_MIN_BYTES)
+# --- End of compression ---
+
+# Request spans, if OpenTelemetry instrumentation is installed
+telemetry.instrument_app(app)
+
 
 @app.on_event("startup")
 def on_startup():
     """
     Event handler for application startup.
-    Creates database tables if they don't exist.
+    Creates database tables if they don't exist, and fails the solves the
+    last run of the API left unfinished (and deletes their matrix files).
     """
     create_db_and_tables()
+    with database.SessionLocal() as db:
+        interrupted = crud.fail_interrupted_jobs(db)
+    if interrupted:
+        print(f"Marked {interrupted} jobs interrupted by the restart as failed.")
+    matrix_cache.clear_shared_matrices()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """
+    Event handler for application shutdown.
+    Stops the solve worker pool and closes the async connection pool.
+    """
+    worker.shutdown()
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
 
 #==============================================================================
 # Job Endpoints
@@ -53,14 +109,33 @@ def on_startup():
 def create_job_endpoint(job: schemas.JobCreate, db: Session = Depends(get_db)):
     return crud.create_job(db=db, job=job)
 
-@app.get("/jobs/", response_model=List[schemas.Job], tags=["Jobs"])
-def read_jobs_endpoint(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    jobs = crud.get_jobs(db, skip=skip, limit=limit)
+@app.get(
+    "/jobs/",
+    response_model=Union[List[schemas.Job], List[schemas.JobSummary]],
+    tags=["Jobs"],
+)
+async def read_jobs_endpoint(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[int] = None,
+    status: Optional[str] = None,
+    summary: bool = False,
+    db = Depends(get_read_db),
+):
+    # Jobs are listed oldest first. When the page is full, the X-Next-Cursor
+    # header holds the cursor of the next page; pass it back as ?cursor=.
+    # With ?summary=true, shipments are replaced by their count and total weight.
+    if summary:
+        jobs = await crud.get_job_summaries_async(db, limit=limit, cursor=cursor, status=status)
+    else:
+        jobs = await crud.get_jobs_async(db, limit=limit, cursor=cursor, status=status)
+    if len(jobs) == limit:
+        response.headers["X-Next-Cursor"] = str(jobs[-1].id)
     return jobs
 
 @app.get("/jobs/{job_id}", response_model=schemas.Job, tags=["Jobs"])
-def read_job_endpoint(job_id: int, db: Session = Depends(get_db)):
-    db_job = crud.get_job(db, job_id=job_id)
+async def read_job_endpoint(job_id: int, db = Depends(get_read_db)):
+    db_job = await crud.get_job_async(db, job_id=job_id)
     if db_job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     return db_job
@@ -71,29 +146,323 @@ def read_job_endpoint(job_id: int, db: Session = Depends(get_db)):
 
 @app.post("/jobs/{job_id}/shipments/", response_model=schemas.Shipment, tags=["Shipments"])
 def create_shipment_for_job_endpoint(
-    job_id: int, shipment: schemas.ShipmentCreate, db: Session = Depends(get_db)
+    job_id: int,
+    shipment: schemas.ShipmentCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
 ):
     db_job = crud.get_job(db, job_id=job_id)
     if db_job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return crud.create_shipment_for_job(db=db, shipment=shipment, job_id=job_id)
+    db_shipment = crud.create_shipment_for_job(db=db, shipment=shipment, job_id=job_id)
+
+    # Geocode the new addresses after responding, so solving doesn't have to
+    provider = distance.get_provider(db_job.distance_provider)
+    background_tasks.add_task(
+        geocoding.fill_shipment_coordinates, [db_shipment.id], fetch_missing=provider.online
+    )
+    return db_shipment
+
+@app.post("/jobs/{job_id}/shipments:bulk", response_model=schemas.BulkShipmentResult, tags=["Shipments"])
+async def bulk_create_shipments_endpoint(
+    job_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    all_or_nothing: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Adds many shipments to a job at once.
+
+    The body is a JSON array, CSV (Content-Type: text/csv, one shipment per
+    line under an origin,destination,weight header, plus any optional
+    time window/service columns; empty cells mean "not set") or NDJSON
+    (Content-Type: application/x-ndjson). Rows are validated as the body
+    streams in, valid rows are inserted 1000 at a time as they arrive, all
+    in a single transaction, and invalid rows are reported by row number.
+    With all_or_nothing=true, nothing is inserted if any row is invalid.
+    """
+    db_job = await run_in_threadpool(crud.get_job, db, job_id=job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    content_type = request.headers.get("content-type")
+    if ingest.media_type(content_type) not in ingest.SUPPORTED_TYPES:
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+
+    batch = []
+    shipment_ids = []
+    errors = []
+    try:
+        async for row_number, shipment, error in ingest.iter_shipment_rows(content_type, request.stream()):
+            if error is not None:
+                errors.append(schemas.BulkRowError(row=row_number, error=error))
+            elif not (errors and all_or_nothing):
+                batch.append(shipment)
+                if len(batch) == crud.BULK_INSERT_BATCH_SIZE:
+                    shipment_ids += await run_in_threadpool(crud.insert_shipments_for_job, db, batch, job_id)
+                    batch = []
+        if batch and not (errors and all_or_nothing):
+            shipment_ids += await run_in_threadpool(crud.insert_shipments_for_job, db, batch, job_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if errors and all_or_nothing:
+        await run_in_threadpool(db.rollback)
+        return schemas.BulkShipmentResult(inserted=0, errors=errors)
+
+    await run_in_threadpool(db.commit)
+    if shipment_ids:
+        provider = distance.get_provider(db_job.distance_provider)
+        background_tasks.add_task(
+            geocoding.fill_shipment_coordinates, shipment_ids, fetch_missing=provider.online
+        )
+
+    return schemas.BulkShipmentResult(inserted=len(shipment_ids), errors=errors)
 
 #==============================================================================
 # Optimization Endpoint
 #==============================================================================
 
-@app.post("/jobs/{job_id}/solve", response_model=schemas.Solution, tags=["Optimization"])
-def solve_job_endpoint(job_id: int, db: Session = Depends(get_db)):
+@app.post("/jobs/{job_id}/solve", response_model=schemas.Job, status_code=202, tags=["Optimization"])
+def solve_job_endpoint(
+    job_id: int,
+    response: Response,
+    options: Optional[schemas.SolveOptions] = None,
+    force: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Queues a job for optimization and returns immediately.
+    Poll GET /jobs/{job_id} for progress and GET /jobs/{job_id}/solution
+    for the result once the job is "completed".
+
+    The optional body selects a search profile ("fast", "balanced",
+    "thorough") and/or explicit search settings.
+
+    If the job is completed and neither its shipments nor the settings have
+    changed since its solution was computed, nothing is queued and the job
+    is returned with 200. Pass force=true to re-solve anyway.
+
+    Otherwise a job with a stored solution is re-solved incrementally,
+    starting from its previous routes; force=true also disables that and
+    runs a full solve.
+
+    A job that is already queued or being solved is rejected with 409,
+    unless force=true and it has shown no progress for STALE_JOB_SECONDS
+    (its solve died).
+    """
     db_job = crud.get_job(db, job_id=job_id)
     if db_job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     if not db_job.shipments:
         raise HTTPException(status_code=400, detail="Job has no shipments to optimize")
+    stale_status = None
+    if db_job.status in models.ACTIVE_STATUSES:
+        if not (force and worker.is_stale(db_job)):
+            raise HTTPException(status_code=409, detail=f"Job is already being solved ({db_job.status})")
+        stale_status = db_job.status
 
-    solution = optimization.solve_vrp(db_job)
+    settings = optimization.resolve_solve_settings(options)
+    if (
+        not force
+        and db_job.status == "completed"
+        and db_job.solution is not None
+        and db_job.solution_fingerprint == optimization.job_fingerprint(db_job, settings)
+    ):
+        response.status_code = 200
+        return db_job
 
-    if not solution:
-        raise HTTPException(status_code=500, detail="Optimization failed to find a solution")
+    if not crud.queue_job(db, job_id=job_id, stale_status=stale_status):
+        raise HTTPException(status_code=409, detail="Job is already being solved")
+    worker.enqueue_solve(job_id, settings, incremental=not force)
+    return crud.get_job(db, job_id=job_id)
 
-    crud.update_job_status(db, job_id=job_id, status="completed")
-    return solution
\ No newline at end of file
+@app.post("/jobs/solve:batch", response_model=schemas.BatchSolveResult, status_code=202, tags=["Optimization"])
+def solve_jobs_batch_endpoint(
+    batch: schemas.BatchSolveRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    Queues many jobs for optimization at once and returns each job's status.
+
+    Jobs are checked like in POST /jobs/{job_id}/solve: unknown jobs, jobs
+    without shipments and jobs already being solved are reported and skipped,
+    and completed jobs whose solution is still current are left as they are.
+    The rest are queued together: a worker geocodes their addresses once and
+    fetches their travel times together, then the jobs are solved
+    concurrently on the worker pool. Poll each job for its result.
+    """
+    settings = optimization.resolve_solve_settings(batch.options)
+    results = []
+    queued = []
+    for job_id in dict.fromkeys(batch.job_ids):
+        db_job = crud.get_job(db, job_id=job_id)
+        if db_job is None:
+            results.append(schemas.BatchSolveJob(job_id=job_id, status="not_found"))
+            continue
+        if not db_job.shipments:
+            results.append(schemas.BatchSolveJob(
+                job_id=job_id, status=db_job.status, detail="Job has no shipments to optimize",
+            ))
+            continue
+        stale_status = None
+        if db_job.status in models.ACTIVE_STATUSES:
+            if not (batch.force and worker.is_stale(db_job)):
+                results.append(schemas.BatchSolveJob(
+                    job_id=job_id, status=db_job.status, detail="Job is already being solved",
+                ))
+                continue
+            stale_status = db_job.status
+        if (
+            not batch.force
+            and db_job.status == "completed"
+            and db_job.solution is not None
+            and db_job.solution_fingerprint == optimization.job_fingerprint(db_job, settings)
+        ):
+            results.append(schemas.BatchSolveJob(
+                job_id=job_id, status=db_job.status, detail="Stored solution is current",
+            ))
+            continue
+
+        if not crud.queue_job(db, job_id=job_id, stale_status=stale_status):
+            results.append(schemas.BatchSolveJob(
+                job_id=job_id, status=db_job.status, detail="Job is already being solved",
+            ))
+            continue
+        results.append(schemas.BatchSolveJob(job_id=job_id, status=models.QUEUED_STATUS))
+        queued.append(job_id)
+
+    if queued:
+        worker.enqueue_batch(queued, settings, incremental=not batch.force)
+    return schemas.BatchSolveResult(jobs=results)
+
+@app.post("/jobs/{job_id}/stop", response_model=schemas.Job, status_code=202, tags=["Optimization"])
+def stop_job_endpoint(job_id: int, db: Session = Depends(get_db)):
+    """
+    Asks the running (or queued) solve of a job to stop early. The search
+    ends at its next progress check once it has found a solution, and the
+    best solution so far is stored as usual, with "stopped": true; the
+    extra searches of a parallel search or decomposition end with it.
+    A job stopped before its search started (geocoding, matrix) fails with
+    no solution.
+    """
+    db_job = crud.get_job(db, job_id=job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if db_job.status not in models.ACTIVE_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job is not being solved ({db_job.status})")
+    return crud.request_job_stop(db, job_id=job_id)
+
+# Seconds between keep-alive comments on an idle event stream, so proxies
+# do not time out the connection
+EVENTS_KEEPALIVE_SECONDS = 15
+
+async def _job_events(job_id: int, request: Request):
+    """
+    Yields server-sent events for a job: a "progress" event whenever its
+    status or search progress changes, then a final "completed" or
+    "failed" event, after which the stream ends. A job that is neither
+    queued nor being solved won't change, so its stream ends right away
+    with an "idle" event.
+    """
+    last_event = None
+    last_sent = time.monotonic()
+    while True:
+        async with read_session() as db:
+            db_job = await crud.get_job_async(db, job_id=job_id, with_shipments=False)
+        if db_job is None:
+            return
+
+        event = schemas.JobProgress(
+            job_id=job_id,
+            status=db_job.status,
+            error=db_job.error,
+            stop_requested=bool(db_job.stop_requested),
+            progress=(
+                schemas.SolveProgress.model_validate_json(db_job.progress)
+                if db_job.progress else None
+            ),
+        ).model_dump_json()
+        if db_job.status in ("completed", "failed"):
+            kind = db_job.status
+        elif db_job.status in models.ACTIVE_STATUSES:
+            kind = "progress"
+        else:
+            kind = "idle"
+
+        if event != last_event:
+            yield f"event: {kind}\ndata: {event}\n\n"
+            last_event = event
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= EVENTS_KEEPALIVE_SECONDS:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+
+        if kind != "progress" or await request.is_disconnected():
+            return
+        await asyncio.sleep(worker.PROGRESS_POLL_SECONDS)
+
+@app.get("/jobs/{job_id}/events", tags=["Optimization"])
+async def job_events_endpoint(job_id: int, request: Request):
+    """
+    Streams a job's solve as server-sent events (text/event-stream): its
+    phase, and while the search runs, the best objective and routes found
+    so far (see schemas.JobProgress). Open it after POST /jobs/{job_id}/solve;
+    the stream ends once the job is "completed" or "failed", or with an
+    "idle" event if the job isn't queued or being solved.
+    """
+    async with read_session() as db:
+        db_job = await crud.get_job_async(db, job_id=job_id, with_shipments=False)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        _job_events(job_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get(
+    "/jobs/{job_id}/solution",
+    response_model=Union[schemas.Solution, schemas.CompactSolution],
+    tags=["Optimization"],
+)
+async def read_job_solution_endpoint(
+    job_id: int,
+    format: Literal["full", "compact"] = "full",
+    geometry: bool = True,
+    db = Depends(get_read_db),
+):
+    # ?format=compact returns the routes in columnar form (see
+    # schemas.CompactSolution); ?geometry=false leaves out the leg polylines.
+    db_job = await crud.get_job_async(db, job_id=job_id, with_shipments=False)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if db_job.solution is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No solution available (job status: {db_job.status})",
+        )
+    solution = schemas.Solution.model_validate_json(db_job.solution)
+    if not geometry:
+        for route in solution.routes:
+            route.polylines = []
+    if format == "compact":
+        return optimization.compact_solution(solution)
+    return solution
+
+#==============================================================================
+# Metrics Endpoint
+#==============================================================================
+
+@app.get("/metrics", tags=["Monitoring"], include_in_schema=False)
+def metrics_endpoint():
+    """
+    Prometheus metrics of the solve path (see telemetry.py).
+    """
+    metrics = telemetry.metrics_response()
+    if metrics is None:
+        raise HTTPException(status_code=501, detail="prometheus_client is not installed")
+    body, content_type = metrics
+    return Response(content=body, media_type=content_type)
@@ -1,102 +1,362 @@
+import math
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from datetime import datetime
 
-import googlemaps
+import numpy as np
 
-# 2. Import the MODERN routes client and its types
-from google.maps.routing_v2 import RoutesClient, ComputeRouteMatrixRequest
-from google.maps.routing_v2.types import (
-    RouteMatrixOrigin, RouteMatrixDestination, Waypoint, 
-    RouteTravelMode, RoutingPreference
-)
-import googlemaps
+from . import resilience, telemetry
 
 # Load .env file
 load_dotenv()
-API_KEY = os.getenv("GOOGLE_MAPS_API_KEY") 
 
-# 3. Initialize BOTH clients
-routes_client = RoutesClient(client_options={"api_key": API_KEY})
-# The legacy client takes the key directly
-geocoding_client = googlemaps.Client(key=API_KEY) 
+# Raised when a Maps API call fails for good (see resilience.py)
+MapsAPIError = resilience.ServiceError
+
+# Base URL of a Maps API stand-in (e.g. http://127.0.0.1:8700 for
+# backend/benchmarks/maps_stub.py); unset, the clients talk to Google
+MAPS_API_ENDPOINT = os.getenv("MAPS_API_ENDPOINT")
+
+# The Google clients (a gRPC channel for the Routes API, an HTTP session for
+# geocoding) are slow to import and build, and fail without credentials.
+# They are created on first use, so processes that never call the Maps
+# APIs (CRUD-only API replicas, local-provider solves) don't pay for them.
+_routes_client = None
+_geocoding_client = None
+_clients_lock = threading.Lock()
 
 
-def get_distance_matrix(locations: list[str]):
+def get_routes_client():
     """
-    Fetches a real-world duration matrix from the Google "Routes API".
-    (This function is unchanged and works)
+    Returns the shared Routes API client, creating it on first use.
     """
-    
-    matrix_origins = [
-        RouteMatrixOrigin(waypoint=Waypoint(address=loc))
-        for loc in locations
+    global _routes_client
+    if _routes_client is None:
+        with _clients_lock:
+            if _routes_client is None:
+                from google.maps.routing_v2 import RoutesClient
+
+                client_options = {"api_key": os.getenv("GOOGLE_MAPS_API_KEY")}
+                if MAPS_API_ENDPOINT:
+                    # Stand-ins speak REST over plain HTTP, not gRPC
+                    client_options["api_endpoint"] = MAPS_API_ENDPOINT
+                    _routes_client = RoutesClient(client_options=client_options, transport="rest")
+                else:
+                    _routes_client = RoutesClient(client_options=client_options)
+    return _routes_client
+
+
+def get_geocoding_client():
+    """
+    Returns the shared (legacy) Geocoding API client, creating it on first use.
+    """
+    global _geocoding_client
+    if _geocoding_client is None:
+        with _clients_lock:
+            if _geocoding_client is None:
+                import googlemaps
+
+                # The legacy client takes the key directly. Its own retries
+                # are turned off, calls are retried by geocoding_guard: with
+                # a near-zero retry_timeout, a 5xx raises Timeout at once.
+                options = {"retry_over_query_limit": False, "retry_timeout": 0.001}
+                if MAPS_API_ENDPOINT:
+                    options["base_url"] = MAPS_API_ENDPOINT
+                _geocoding_client = googlemaps.Client(key=os.getenv("GOOGLE_MAPS_API_KEY"), **options)
+    return _geocoding_client
+
+# Concurrency of batch geocoding
+GEOCODE_MAX_WORKERS = int(os.getenv("GEOCODE_MAX_WORKERS", 8))
+
+# Quotas of the Google Cloud project (the APIs' defaults; raise them to
+# match yours). They are shared by every process calling the Maps APIs: the
+# API process (geocoding new shipments, batch matrices) and each solve
+# worker. Every process keeps to its share, so with several API replicas
+# set MAPS_PROCESSES to the total.
+GEOCODE_QPS = float(os.getenv("GEOCODE_QPS", 50))
+ROUTE_MATRIX_EPM = float(os.getenv("ROUTE_MATRIX_EPM", 3000))
+ROUTES_QPM = float(os.getenv("ROUTES_QPM", 3000))
+MAPS_PROCESSES = int(os.getenv("MAPS_PROCESSES", int(os.getenv("SOLVE_WORKERS", os.cpu_count() or 1)) + 1))
+
+# One guard per API method: rate limits in requests (geocoding, routes) or
+# matrix elements per second, with bursts of up to a second (geocoding) or
+# a minute (routes) of this process's share
+geocoding_guard = resilience.Guard(
+    "Geocoding API", rate=GEOCODE_QPS / MAPS_PROCESSES, burst=GEOCODE_QPS / MAPS_PROCESSES,
+)
+route_matrix_guard = resilience.Guard(
+    "Routes API (computeRouteMatrix)",
+    rate=ROUTE_MATRIX_EPM / 60 / MAPS_PROCESSES, burst=ROUTE_MATRIX_EPM / MAPS_PROCESSES,
+)
+routes_guard = resilience.Guard(
+    "Routes API (computeRoutes)",
+    rate=ROUTES_QPM / 60 / MAPS_PROCESSES, burst=ROUTES_QPM / MAPS_PROCESSES,
+)
+
+
+def normalize_address(address: str) -> str:
+    """
+    Normalizes an address string so trivially different spellings
+    ("450 W 33rd St" vs " 450 w 33rd st ") are treated as the same place.
+    """
+    return " ".join(address.lower().split())
+
+
+# Travel-time matrices are int32 seconds (68 years of range); pairs that
+# cannot be routed hold UNREACHABLE. Sums of matrix cells must be taken in
+# int64 (see optimization._insert_cheapest), as UNREACHABLE + 1 overflows.
+MATRIX_DTYPE = np.int32
+UNREACHABLE = int(np.iinfo(MATRIX_DTYPE).max)
+
+# Largest tile of origins x destinations sent in one computeRouteMatrix call.
+# Address waypoints are limited to 50 origins + destinations per request and
+# TRAFFIC_AWARE routing to 625 elements, so 25 x 25 is the largest square.
+MATRIX_TILE_SIZE = int(os.getenv("MATRIX_TILE_SIZE", 25))
+# Tiles fetched concurrently
+MATRIX_MAX_CONCURRENCY = int(os.getenv("MATRIX_MAX_CONCURRENCY", 4))
+
+
+def _matrix_tile_size() -> int:
+    """
+    Side of the square tiles a matrix is fetched in: MATRIX_TILE_SIZE, or
+    less if that many elements don't fit in this process's burst of
+    route_matrix_guard (such a tile would wait for a full bucket and leave
+    it in debt).
+    """
+    bucket = route_matrix_guard.bucket
+    if bucket.rate <= 0:
+        return MATRIX_TILE_SIZE
+    return max(1, min(MATRIX_TILE_SIZE, math.isqrt(int(bucket.capacity))))
+
+
+def _request_matrix_tile(locations, destinations):
+    """
+    Calls computeRouteMatrix once; returns the tile's durations as an int32
+    array (UNREACHABLE for pairs that cannot be routed).
+    """
+    from google.maps.routing_v2 import ComputeRouteMatrixRequest
+    from google.maps.routing_v2.types import (
+        RouteMatrixOrigin, RouteMatrixDestination, Waypoint,
+        RouteTravelMode, RoutingPreference
+    )
+
+    request = ComputeRouteMatrixRequest(
+        origins=[RouteMatrixOrigin(waypoint=Waypoint(address=loc)) for loc in locations],
+        destinations=[
+            RouteMatrixDestination(waypoint=Waypoint(address=loc)) for loc in destinations
+        ],
+        travel_mode=RouteTravelMode.DRIVE,
+        routing_preference=RoutingPreference.TRAFFIC_AWARE,
+    )
+    metadata = [
+        ('x-goog-fieldmask', 'status,duration,origin_index,destination_index')
     ]
-    
-    matrix_destinations = [
-        RouteMatrixDestination(waypoint=Waypoint(address=loc))
-        for loc in locations
+
+    tile = np.full((len(locations), len(destinations)), UNREACHABLE, dtype=MATRIX_DTYPE)
+    response_stream = get_routes_client().compute_route_matrix(request, metadata=metadata)
+    for element in response_stream:
+        if element.status.code == 0: # 0 = 'OK'
+            tile[element.origin_index, element.destination_index] = element.duration.seconds
+    return tile
+
+
+def _fetch_matrix_tile(locations, destinations):
+    """
+    Fetches one tile of the matrix through route_matrix_guard: identical
+    tiles requested concurrently are fetched once, and transient errors
+    are retried.
+    """
+    return route_matrix_guard.call(
+        lambda: _request_matrix_tile(locations, destinations),
+        key=(tuple(locations), tuple(destinations)),
+        cost=len(locations) * len(destinations),
+    )
+
+
+def get_distance_matrix(locations: list[str], destinations: list[str] | None = None):
+    """
+    Fetches a real-world duration matrix from the Google "Routes API".
+
+    When 'destinations' is given, the matrix is rectangular
+    (len(locations) x len(destinations)); otherwise it is the square
+    matrix of 'locations' against themselves.
+
+    The matrix is split into tiles that fit the API's per-request limits,
+    fetched concurrently, and written into one preallocated array.
+
+    Returns:
+        An int32 NumPy array of durations in seconds (UNREACHABLE for pairs
+        that cannot be routed).
+
+    Raises:
+        MapsAPIError if a tile could not be fetched.
+    """
+    if destinations is None:
+        destinations = locations
+    telemetry.count("matrix_elements_requested", len(locations) * len(destinations))
+
+    duration_matrix = np.zeros((len(locations), len(destinations)), dtype=MATRIX_DTYPE)
+    tile_size = _matrix_tile_size()
+    tiles = [
+        (row, col)
+        for row in range(0, len(locations), tile_size)
+        for col in range(0, len(destinations), tile_size)
     ]
 
-    try:
-        request = ComputeRouteMatrixRequest(
-            origins=matrix_origins,
-            destinations=matrix_destinations,
-            travel_mode=RouteTravelMode.DRIVE,
-            routing_preference=RoutingPreference.TRAFFIC_AWARE,
-        )
-        metadata = [
-            ('x-goog-fieldmask', 'status,duration,origin_index,destination_index')
-        ]
-        
-        response_stream = routes_client.compute_route_matrix(
-            request, 
-            metadata=metadata
-        )
+    with ThreadPoolExecutor(max_workers=min(MATRIX_MAX_CONCURRENCY, len(tiles) or 1)) as executor:
+        futures = {
+            executor.submit(
+                _fetch_matrix_tile,
+                locations[row:row + tile_size],
+                destinations[col:col + tile_size],
+            ): (row, col)
+            for row, col in tiles
+        }
+        try:
+            for future, (row, col) in futures.items():
+                tile = future.result()
+                duration_matrix[row:row + tile.shape[0], col:col + tile.shape[1]] = tile
+        except Exception as e:
+            # One tile failed for good; don't start the ones still queued
+            for future in futures:
+                future.cancel()
+            if isinstance(e, MapsAPIError):
+                raise
+            raise MapsAPIError(f"Routes API matrix request failed: {e}") from e
+
+    return duration_matrix
+
+
+# Waypoints per computeRoutes call: origin, destination and up to 25
+# intermediates. Longer routes are requested in overlapping pieces.
+ROUTE_MAX_WAYPOINTS = 27
 
-        num_locations = len(locations)
-        duration_matrix = [[0] * num_locations for _ in range(num_locations)]
 
-        for element in response_stream:
-            if element.status.code == 0: # 0 = 'OK'
-                duration = element.duration.seconds
-                if duration:
-                    duration_matrix[element.origin_index][element.destination_index] = duration
-            else:
-                duration_matrix[element.origin_index][element.destination_index] = 99999999 
+def _fetch_route_legs(coordinates: list[dict]) -> list[str]:
+    """
+    Fetches the encoded polyline of each leg of one computeRoutes call.
+    """
+    from google.maps.routing_v2 import ComputeRoutesRequest
+    from google.maps.routing_v2.types import (
+        Location, PolylineEncoding, RouteTravelMode, RoutingPreference, Waypoint
+    )
+    from google.type import latlng_pb2
+
+    waypoints = [
+        Waypoint(location=Location(lat_lng=latlng_pb2.LatLng(latitude=c["lat"], longitude=c["lng"])))
+        for c in coordinates
+    ]
+    request = ComputeRoutesRequest(
+        origin=waypoints[0],
+        destination=waypoints[-1],
+        intermediates=waypoints[1:-1],
+        travel_mode=RouteTravelMode.DRIVE,
+        # Geometry only: the traffic-unaware route is cheaper and good enough
+        routing_preference=RoutingPreference.TRAFFIC_UNAWARE,
+        polyline_encoding=PolylineEncoding.ENCODED_POLYLINE,
+    )
+    metadata = [('x-goog-fieldmask', 'routes.legs.polyline.encodedPolyline')]
+    telemetry.count("route_requests")
+    response = routes_guard.call(
+        lambda: get_routes_client().compute_routes(request, metadata=metadata),
+        key=tuple((c["lat"], c["lng"]) for c in coordinates),
+    )
+    return [leg.polyline.encoded_polyline for leg in response.routes[0].legs]
+
 
-        return duration_matrix
+def get_route_polylines(coordinates: list[dict]):
+    """
+    Fetches the road geometry of a route through 'coordinates' ([{lat, lng}]
+    in visiting order) from the Google "Routes API".
 
+    Returns:
+        One encoded polyline per leg (len(coordinates) - 1 of them), or
+        None on failure.
+    """
+    step = ROUTE_MAX_WAYPOINTS - 1
+    pieces = [
+        coordinates[start:start + ROUTE_MAX_WAYPOINTS]
+        for start in range(0, len(coordinates) - 1, step)
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=min(MATRIX_MAX_CONCURRENCY, len(pieces) or 1)) as executor:
+            legs = [leg for piece in executor.map(_fetch_route_legs, pieces) for leg in piece]
     except Exception as e:
-        print(f"Error calling Google Routes API: {e}")
+        # Geometry is optional: routes are drawn as straight lines without it
+        print(f"Error fetching route geometry from Google Routes API: {e}")
         return None
+    if len(legs) != len(coordinates) - 1:
+        print(f"Routes API returned {len(legs)} legs for {len(coordinates) - 1}; ignoring geometry.")
+        return None
+    return legs
+
+def _request_geocode(location_str: str):
+    telemetry.count("geocode_requests")
+    response = get_geocoding_client().geocode(location_str)
+    if response:
+        # The response structure is a list
+        geo_loc = response[0]['geometry']['location']
+        return {"lat": geo_loc['lat'], "lng": geo_loc['lng']}
+    return None
+
+
+def geocode_location(location_str: str):
+    """
+    Geocodes a single location string using the legacy (but still
+    supported) Geocoding API, through geocoding_guard: concurrent lookups
+    of the same address share one request.
+
+    Returns:
+        A {lat, lng} dictionary, or None if the address was not found.
+
+    Raises:
+        MapsAPIError if the API could not be reached.
+    """
+    coords = geocoding_guard.call(
+        lambda: _request_geocode(location_str),
+        key=normalize_address(location_str),
+    )
+    if coords is None:
+        print(f"Geocoding failed for: {location_str}")
+    return coords
+
 
-# --- NEW FUNCTION (Rewritten to use the legacy client) ---
 def geocode_locations(locations: list[str]):
     """
-    Geocodes a list of location strings (addresses) using the
-    legacy (but still supported) Geocoding API.
-    
+    Geocodes a list of location strings (addresses) concurrently.
+    Duplicate addresses are only geocoded once. Requests run on a bounded
+    thread pool (GEOCODE_MAX_WORKERS) and are rate limited to this
+    process's share of GEOCODE_QPS.
+
     Returns:
-        A dictionary mapping the location string to its {lat, lng}.
+        A dictionary mapping the location string to its {lat, lng}, or
+        None if it was not found.
+
+    Raises:
+        MapsAPIError if some addresses could not be geocoded because of
+        API errors. Its 'results' holds those that were.
     """
-    geocoded_data = {}
-    for location_str in locations:
+    unique_locations = list(dict.fromkeys(locations))
+    if not unique_locations:
+        return {}
+
+    workers = min(GEOCODE_MAX_WORKERS, len(unique_locations))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {loc: executor.submit(geocode_location, loc) for loc in unique_locations}
+
+    results = {}
+    errors = []
+    for loc, future in futures.items():
         try:
-            # Use the legacy client's geocode method
-            response = geocoding_client.geocode(location_str)
-            
-            if response:
-                # The response structure is a list
-                geo_loc = response[0]['geometry']['location']
-                geocoded_data[location_str] = {"lat": geo_loc['lat'], "lng": geo_loc['lng']}
-            else:
-                print(f"Geocoding failed for: {location_str}")
-                geocoded_data[location_str] = None
-        
+            results[loc] = future.result()
         except Exception as e:
-            print(f"Error calling Geocoding API for {location_str}: {e}")
-            geocoded_data[location_str] = None
-            
-    return geocoded_data
-# --- END OF REWRITE ---
\ No newline at end of file
+            errors.append(e)
+    if errors:
+        error = MapsAPIError(
+            f"{len(errors)} of {len(unique_locations)} address(es) could not be geocoded: {errors[0]}"
+        )
+        error.results = results
+        raise error from errors[0]
+    return results
@@ -0,0 +1,384 @@
+"""
+Persistent, content-addressed cache in front of maps_client.get_distance_matrix.
+
+Each cell of a travel-time matrix is stored on its own, keyed by hashes of
+the normalized origin and destination, the travel mode and the time-of-day
+bucket. When a job is solved, every cell we already know is read from the
+cache and only the missing cells are requested from the Routes API.
+
+Lookups are cheap enough to run on every solve: each address is hashed
+once (not each cell), a whole block of cells is read per query, and a warm
+lookup writes nothing unless its cells haven't been touched for a day.
+
+The cache lives in the 'travel_times' table by default. Setting
+MATRIX_CACHE_URL to a redis:// URL stores it in a Redis-compatible server
+instead; there, TTL is handled by key expiry and LRU eviction by the server's
+'maxmemory-policy allkeys-lru' setting.
+
+Large matrices can also be written to MATRIX_MMAP_DIR and memory-mapped
+(see share_matrix), so the processes solving a job read one copy through
+the page cache instead of each receiving its own.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import delete, func, select, tuple_, update
+
+from . import maps_client, models, telemetry
+from .database import QUERY_CHUNK_SIZE, SessionLocal
+
+TRAVEL_MODE = "DRIVE"
+
+# How long a cached duration stays valid, in seconds (default: 7 days)
+CACHE_TTL_SECONDS = int(os.getenv("MATRIX_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+# Upper bound on cached cells; least recently used cells are evicted past it
+CACHE_MAX_ENTRIES = int(os.getenv("MATRIX_CACHE_MAX_ENTRIES", 1_000_000))
+
+# A hit only refreshes a cell's LRU timestamp once it is this old, in seconds,
+# so warm lookups don't write
+CACHE_TOUCH_SECONDS = int(os.getenv("MATRIX_CACHE_TOUCH_SECONDS", 24 * 3600))
+
+# How often each process enforces the TTL and CACHE_MAX_ENTRIES, in seconds
+CACHE_EVICT_INTERVAL_SECONDS = int(os.getenv("MATRIX_CACHE_EVICT_INTERVAL_SECONDS", 3600))
+
+# Width of the time-of-day bucket, in minutes. Traffic-aware durations are
+# only reused within the same bucket.
+TIME_BUCKET_MINUTES = int(os.getenv("MATRIX_CACHE_BUCKET_MINUTES", 60))
+
+MATRIX_CACHE_URL = os.getenv("MATRIX_CACHE_URL")
+
+# Directory for memory-mapped matrix files (unset: matrices stay in memory),
+# and the smallest matrix, in rows, worth writing there
+MATRIX_MMAP_DIR = os.getenv("MATRIX_MMAP_DIR")
+MATRIX_MMAP_MIN_NODES = int(os.getenv("MATRIX_MMAP_MIN_NODES", 500))
+
+
+def time_bucket(when: datetime | None = None) -> int:
+    """
+    Returns the time-of-day bucket for 'when' (default: now).
+    """
+    when = when or datetime.now()
+    return (when.hour * 60 + when.minute) // TIME_BUCKET_MINUTES
+
+
+def location_hash(address_key: str) -> int:
+    """
+    Returns the cache's key for a normalized address: the first 64 bits of
+    its SHA-256, as a signed integer.
+    """
+    digest = hashlib.sha256(address_key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+def _chunks(items, size=QUERY_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+#==============================================================================
+# Storage backends
+#==============================================================================
+
+class DatabaseStore:
+    """
+    Stores cached cells in the 'travel_times' table.
+    """
+
+    def __init__(self):
+        self.next_eviction = 0.0
+
+    def get_many(self, origins: list[int], destinations: list[int], travel_mode: str, bucket: int):
+        """
+        Returns the valid cached cells from any of 'origins' to any of
+        'destinations', as an array of (origin hash, destination hash,
+        duration) rows.
+        """
+        now = time.time()
+        touch_before = now - CACHE_TOUCH_SECONDS
+        found = []
+        table = models.TravelTime
+        with SessionLocal() as db:
+            # Core rows rather than ORM entities: a warm lookup reads a row per cell
+            connection = db.connection()
+            # Both lists go into one query, so each gets half the chunk
+            for origin_chunk in _chunks(origins, QUERY_CHUNK_SIZE // 2):
+                for destination_chunk in _chunks(destinations, QUERY_CHUNK_SIZE // 2):
+                    block = (
+                        table.origin_hash.in_(origin_chunk),
+                        table.destination_hash.in_(destination_chunk),
+                        table.travel_mode == travel_mode,
+                        table.time_bucket == bucket,
+                        table.expires_at > now,
+                    )
+                    rows = connection.execute(
+                        select(table.origin_hash, table.destination_hash, table.duration, table.last_used_at)
+                        .where(*block)
+                    ).all()
+                    if not rows:
+                        continue
+                    origin_col, destination_col, duration_col, last_used_col = zip(*rows)
+                    found.append(np.column_stack([
+                        np.array(origin_col, dtype=np.int64),
+                        np.array(destination_col, dtype=np.int64),
+                        np.array(duration_col, dtype=np.int64),
+                    ]))
+
+                    # Touch the hits so LRU eviction keeps hot pairs around,
+                    # but only the ones not touched for CACHE_TOUCH_SECONDS
+                    if min(last_used_col) < touch_before:
+                        connection.execute(
+                            update(table)
+                            .where(*block, table.last_used_at < touch_before)
+                            .values(last_used_at=now)
+                        )
+            db.commit()
+        return np.concatenate(found) if found else np.empty((0, 3), dtype=np.int64)
+
+    def set_many(self, cells: list[tuple[int, int, int]], travel_mode: str, bucket: int):
+        now = time.time()
+        rows = [
+            {
+                "origin_hash": origin,
+                "destination_hash": destination,
+                "travel_mode": travel_mode,
+                "time_bucket": bucket,
+                "duration": duration,
+                "expires_at": now + CACHE_TTL_SECONDS,
+                "last_used_at": now,
+            }
+            for origin, destination, duration in cells
+        ]
+        with SessionLocal() as db:
+            for chunk in _chunks(rows):
+                self._upsert(db, chunk)
+            db.commit()
+            if now >= self.next_eviction:
+                self.next_eviction = now + CACHE_EVICT_INTERVAL_SECONDS
+                self._evict(db, now)
+
+    def _upsert(self, db, rows: list[dict]):
+        """
+        Inserts 'rows', replacing expired (or concurrently written) rows for
+        the same cells.
+        """
+        table = models.TravelTime
+        key_columns = [table.origin_hash, table.destination_hash, table.travel_mode, table.time_bucket]
+        dialect = db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            statement = insert(table)
+            db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=key_columns,
+                    set_={
+                        "duration": statement.excluded.duration,
+                        "expires_at": statement.excluded.expires_at,
+                        "last_used_at": statement.excluded.last_used_at,
+                    },
+                ),
+                rows,
+            )
+            return
+        db.execute(
+            delete(table).where(tuple_(*key_columns).in_([
+                (row["origin_hash"], row["destination_hash"], row["travel_mode"], row["time_bucket"])
+                for row in rows
+            ]))
+        )
+        db.execute(table.__table__.insert(), rows)
+
+    def _evict(self, db, now: float):
+        """
+        Drops expired cells, then the least recently used ones above
+        CACHE_MAX_ENTRIES.
+        """
+        table = models.TravelTime
+        db.execute(delete(table).where(table.expires_at <= now))
+        count = db.scalar(select(func.count()).select_from(table))
+        excess = count - CACHE_MAX_ENTRIES
+        if excess > 0:
+            key_columns = (table.origin_hash, table.destination_hash, table.travel_mode, table.time_bucket)
+            oldest = select(*key_columns).order_by(table.last_used_at).limit(excess)
+            db.execute(delete(table).where(tuple_(*key_columns).in_(oldest)))
+        db.commit()
+
+
+class RedisStore:
+    """
+    Stores cached cells in a Redis-compatible server.
+    """
+
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _key(origin: int, destination: int, travel_mode: str, bucket: int) -> str:
+        return f"tt:{travel_mode}:{bucket}:{origin}:{destination}"
+
+    def get_many(self, origins: list[int], destinations: list[int], travel_mode: str, bucket: int):
+        pairs = [(origin, destination) for origin in origins for destination in destinations]
+        found = []
+        for chunk in _chunks(pairs):
+            values = self.client.mget([self._key(o, d, travel_mode, bucket) for o, d in chunk])
+            for (origin, destination), value in zip(chunk, values):
+                if value is not None:
+                    found.append((origin, destination, int(value)))
+        return np.array(found, dtype=np.int64).reshape(-1, 3)
+
+    def set_many(self, cells: list[tuple[int, int, int]], travel_mode: str, bucket: int):
+        pipe = self.client.pipeline(transaction=False)
+        for origin, destination, duration in cells:
+            pipe.set(self._key(origin, destination, travel_mode, bucket), duration, ex=CACHE_TTL_SECONDS)
+        pipe.execute()
+
+
+def _make_store():
+    if MATRIX_CACHE_URL and MATRIX_CACHE_URL.startswith(("redis://", "rediss://")):
+        return RedisStore(MATRIX_CACHE_URL)
+    return DatabaseStore()
+
+
+store = _make_store()
+
+
+#==============================================================================
+# Cached matrix
+#==============================================================================
+
+def get_distance_matrix(locations: list[str]):
+    """
+    Drop-in replacement for maps_client.get_distance_matrix.
+
+    Cached cells are served from the store; only the sub-matrix spanning the
+    missing cells is requested from the Routes API, and its results are
+    written back. Unreachable pairs are never cached.
+
+    Returns an int32 NumPy array, like maps_client.get_distance_matrix, and
+    like it raises maps_client.MapsAPIError if the Routes API fails.
+    """
+    bucket = time_bucket()
+    hashes = np.array(
+        [location_hash(maps_client.normalize_address(loc)) for loc in locations], dtype=np.int64,
+    )
+    # Work on distinct addresses: spellings of the same address share a row
+    keys, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    num_keys = len(keys)
+    durations = np.zeros((num_keys, num_keys), dtype=maps_client.MATRIX_DTYPE)
+    known = np.eye(num_keys, dtype=bool)
+
+    try:
+        cached = store.get_many(keys.tolist(), keys.tolist(), TRAVEL_MODE, bucket)
+    except Exception as e:
+        print(f"Travel-time cache lookup failed, fetching full matrix: {e}")
+        cached = np.empty((0, 3), dtype=np.int64)
+    if len(cached):
+        rows = np.searchsorted(keys, cached[:, 0])
+        cols = np.searchsorted(keys, cached[:, 1])
+        durations[rows, cols] = cached[:, 2]
+        known[rows, cols] = True
+
+    missing = ~known
+    num_missing = int(missing.sum())
+    num_hits = num_keys * (num_keys - 1) - num_missing
+    print(f"Travel-time cache: {num_hits} hits, {num_missing} misses.")
+    telemetry.count("matrix_cache_hits", num_hits)
+    telemetry.count("matrix_cache_misses", num_missing)
+
+    if num_missing:
+        # A new address contributes a whole row and a whole column of misses.
+        # Fetch fully-missing rows first, then one rectangle for the remaining
+        # misses, so adding a few addresses doesn't re-request the whole matrix.
+        rows_missing = missing.any(axis=1)
+        full_rows = rows_missing & (missing.sum(axis=1) == num_keys - 1)
+        new_cells = []
+        for block_rows in (np.flatnonzero(full_rows), np.flatnonzero(rows_missing & ~full_rows)):
+            if not len(block_rows):
+                continue
+            block_cols = np.flatnonzero(missing[block_rows].any(axis=0))
+            sub_matrix = maps_client.get_distance_matrix(
+                [locations[first[i]] for i in block_rows],
+                [locations[first[j]] for j in block_cols],
+            )
+            block = np.ix_(block_rows, block_cols)
+            block_missing = missing[block]
+            durations[block] = np.where(block_missing, sub_matrix, durations[block])
+
+            new_rows, new_cols = np.nonzero(block_missing & (sub_matrix != maps_client.UNREACHABLE))
+            new_cells.extend(zip(
+                keys[block_rows[new_rows]].tolist(),
+                keys[block_cols[new_cols]].tolist(),
+                sub_matrix[new_rows, new_cols].tolist(),
+            ))
+
+        try:
+            store.set_many(new_cells, TRAVEL_MODE, bucket)
+        except Exception as e:
+            print(f"Failed to write travel times to cache: {e}")
+
+    return durations[np.ix_(inverse, inverse)]
+
+
+#==============================================================================
+# Shared matrix files
+#==============================================================================
+
+def share_matrix(matrix) -> str | None:
+    """
+    Writes 'matrix' to a new .npy file in MATRIX_MMAP_DIR, unless the
+    directory is not configured or the matrix is smaller than
+    MATRIX_MMAP_MIN_NODES. Returns the file's path, or None.
+
+    Every call writes its own file; whoever asked for it deletes it with
+    release_matrix once the processes reading it are done.
+    """
+    if not MATRIX_MMAP_DIR or len(matrix) < MATRIX_MMAP_MIN_NODES:
+        return None
+    matrix = np.ascontiguousarray(matrix, dtype=maps_client.MATRIX_DTYPE)
+    os.makedirs(MATRIX_MMAP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=MATRIX_MMAP_DIR, prefix="matrix-", suffix=".npy")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, matrix)
+    return path
+
+
+def release_matrix(path: str | None):
+    """
+    Deletes a matrix file written by share_matrix. Processes that still have
+    it mapped keep reading it; new ones can't open it.
+    """
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def clear_shared_matrices():
+    """
+    Deletes the matrix files left in MATRIX_MMAP_DIR by solves that never
+    finished (a crashed worker or API). Only safe while nothing is solving.
+    """
+    if not MATRIX_MMAP_DIR or not os.path.isdir(MATRIX_MMAP_DIR):
+        return
+    for name in os.listdir(MATRIX_MMAP_DIR):
+        if name.startswith("matrix-") and name.endswith(".npy"):
+            release_matrix(os.path.join(MATRIX_MMAP_DIR, name))
+
+
+def load_matrix(path: str) -> np.ndarray:
+    """
+    Memory-maps a matrix file written by share_matrix, read-only.
+    """
+    return np.load(path, mmap_mode="r")
@@ -4,11 +4,17 @@ Defines the database schema and relationships for logistics optimization jobs
 and their associated shipments.
 """
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, DateTime, ForeignKey, Float, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
 
+# Job.status of a job waiting for a solve worker, and of a job one is
+# working on; a job in any of them can't be queued again
+QUEUED_STATUS = "queued"
+IN_PROGRESS_STATUSES = {"geocoding", "matrix", "solving"}
+ACTIVE_STATUSES = IN_PROGRESS_STATUSES | {QUEUED_STATUS}
+
 class Job(Base):
     """
     SQLAlchemy model for a logistics optimization job.
@@ -22,11 +28,40 @@ class Job(Base):
     
     # Use onupdate for fields that should update on any change to the row
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    # Fleet available to the job. Every vehicle starts at 'depot_address' and
+    # ends at 'end_depot_address' (default: back at the start depot).
+    # A NULL capacity means vehicles are not capacity-constrained.
+    num_vehicles = Column(Integer, default=1)
+    vehicle_capacity = Column(Float, nullable=True)
+    depot_address = Column(String, nullable=True)
+    end_depot_address = Column(String, nullable=True)
+
+    # Distance provider used to solve the job (see distance.py);
+    # NULL means the DISTANCE_PROVIDER default
+    distance_provider = Column(String, nullable=True)
+
+    # The latest solution (a serialized schemas.Solution), written by the
+    # solve worker, and the reason for the last failure, if any
+    solution = Column(Text, nullable=True)
+    error = Column(String, nullable=True)
+
+    # Progress of the running search (a serialized schemas.SolveProgress),
+    # written by the solve worker, and whether the client asked it to stop
+    # and keep the best solution found so far
+    progress = Column(Text, nullable=True)
+    stop_requested = Column(Boolean, default=False)
+
+    # optimization.job_fingerprint() of the inputs 'solution' was computed from
+    solution_fingerprint = Column(String(64), nullable=True)
     
     # Defines the one-to-many relationship from Job -> Shipment
     # 'back_populates' creates the bi-directional link.
     shipments = relationship("Shipment", back_populates="job")
 
+    # Serves keyset pagination of GET /jobs/, ordered by (created_at, id)
+    __table_args__ = (Index("ix_jobs_created_at_id", "created_at", "id"),)
+
 class Shipment(Base):
     """
     SQLAlchemy model for an individual shipment.
@@ -37,11 +72,67 @@ class Shipment(Base):
     id = Column(Integer, primary_key=True, index=True)
     
     # The foreign key linking this shipment to its parent job
-    job_id = Column(Integer, ForeignKey("jobs.id"))
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True)
     
     origin = Column(String, index=True)
     destination = Column(String, index=True)
     weight = Column(Float)
+
+    # Optional time windows (seconds from the start of the working day)
+    # and service durations at the pickup and the delivery
+    pickup_window_start = Column(Integer, nullable=True)
+    pickup_window_end = Column(Integer, nullable=True)
+    delivery_window_start = Column(Integer, nullable=True)
+    delivery_window_end = Column(Integer, nullable=True)
+    pickup_service_seconds = Column(Integer, default=0)
+    delivery_service_seconds = Column(Integer, default=0)
+
+    # Geocoded coordinates, filled in after the shipment is created
+    origin_lat = Column(Float, nullable=True)
+    origin_lng = Column(Float, nullable=True)
+    destination_lat = Column(Float, nullable=True)
+    destination_lng = Column(Float, nullable=True)
     
     # Defines the many-to-one relationship from Shipment -> Job
-    job = relationship("Job", back_populates="shipments")
\ No newline at end of file
+    job = relationship("Job", back_populates="shipments")
+
+class TravelTime(Base):
+    """
+    SQLAlchemy model for one cached cell of a travel-time matrix.
+    Rows are keyed by hashes of the normalized origin and destination (see
+    matrix_cache.location_hash), the travel mode and the time-of-day bucket,
+    so the same address pair is shared by every job that contains it.
+    """
+    __tablename__ = "travel_times"
+    # On SQLite, keep rows in the primary key's B-tree: a lookup is one search.
+    # A cache: recreated empty when its schema changes (see upgrade_schema).
+    __table_args__ = {"sqlite_with_rowid": False, "info": {"cache": True}}
+
+    origin_hash = Column(BigInteger, primary_key=True, autoincrement=False)
+    destination_hash = Column(BigInteger, primary_key=True, autoincrement=False)
+    travel_mode = Column(String(16), primary_key=True)
+    time_bucket = Column(Integer, primary_key=True, autoincrement=False)
+
+    # Travel duration in seconds, as reported by the Routes API
+    duration = Column(Integer)
+
+    # Unix timestamps used for TTL expiry and LRU eviction
+    expires_at = Column(Float, index=True)
+    last_used_at = Column(Float, index=True)
+
+
+class GeocodedAddress(Base):
+    """
+    SQLAlchemy model for a geocoded address.
+    Each distinct (normalized) address is geocoded once and reused by every
+    shipment and job that refers to it, including the depot.
+    """
+    __tablename__ = "geocoded_addresses"
+
+    # The normalized address string (see maps_client.normalize_address)
+    address_key = Column(String, primary_key=True)
+
+    address = Column(String)
+    lat = Column(Float)
+    lng = Column(Float)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,58 +1,446 @@
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
+import hashlib
+import json
+import math
+import multiprocessing
+import multiprocessing.util
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
 from . import schemas
 
 # NEW: Import our Google Maps client
 from . import maps_client
+from . import distance
+from . import geocoding
+from . import matrix_cache
+from . import telemetry
+
+DEPOT_LOCATION = "450 W 33rd St, New York, NY 10001"
+
+# Weights (kg) and capacities are floats, but OR-Tools dimensions are
+# integral, so both are expressed in thousandths of a kilogram.
+WEIGHT_SCALE = 1000
+
+
+# Cost of each second of the longest route, on top of the total travel
+# time: without it, a fleet whose capacity doesn't bind gets one long route
+ROUTE_SPAN_COST = int(os.getenv("ROUTE_SPAN_COST", 1))
+# Upper bound of a route's travel time in the "Travel" dimension
+ROUTE_SPAN_LIMIT = 2**62
+
+# Search settings behind each SolveOptions profile
+SOLVE_PROFILES = {
+    "fast": {
+        "first_solution_strategy": "PATH_CHEAPEST_ARC",
+        "local_search_metaheuristic": "GREEDY_DESCENT",
+        "time_limit_seconds": 2.0,
+        "solution_limit": None,
+        "num_search_workers": 1,
+        "span_cost_coefficient": ROUTE_SPAN_COST,
+    },
+    "balanced": {
+        "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+        "time_limit_seconds": 10.0,
+        "solution_limit": None,
+        "num_search_workers": 1,
+        "span_cost_coefficient": ROUTE_SPAN_COST,
+    },
+    "thorough": {
+        "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+        "time_limit_seconds": 60.0,
+        "solution_limit": None,
+        "num_search_workers": 4,
+        "span_cost_coefficient": ROUTE_SPAN_COST,
+    },
+}
+
+# Cores one solve may keep busy. Solves already run SOLVE_WORKERS at a time
+# (see worker.py), so by default they split the machine between them; a
+# parallel search or decomposition uses at most this many processes.
+SOLVE_WORKERS = int(os.getenv("SOLVE_WORKERS", os.cpu_count() or 1))
+SOLVE_CORES = int(os.getenv("SOLVE_CORES", max(1, (os.cpu_count() or 1) // SOLVE_WORKERS)))
+
+# How long to wait past the time limit (or a stop) for the helpers of a
+# parallel search to hand back their routes
+PORTFOLIO_GRACE_SECONDS = 0.5
+# How often a solve waiting on its helpers checks for a stop request, and
+# how many polls of a helper's search go by between looks at the stop signal
+STOP_POLL_SECONDS = 0.1
+STOP_CHECK_CALLS = 1000
+
+# First-solution strategies tried by the extra workers of a parallel search,
+# in order, after the configured one
+PORTFOLIO_STRATEGIES = [
+    "PARALLEL_CHEAPEST_INSERTION",
+    "PATH_CHEAPEST_ARC",
+    "SAVINGS",
+    "LOCAL_CHEAPEST_INSERTION",
+    "GLOBAL_CHEAPEST_ARC",
+    "SEQUENTIAL_CHEAPEST_INSERTION",
+    "CHRISTOFIDES",
+    "BEST_INSERTION",
+]
+
+
+# Incremental re-solves: a stored solution seeds the search as long as at
+# most this fraction of the job's shipments were added or removed since...
+INCREMENTAL_MAX_CHANGED_FRACTION = 0.2
+# ...and the seeded search gets this fraction of the profile's time limit
+INCREMENTAL_TIME_FRACTION = 0.25
+# With time windows, a new shipment goes into the first of its this many
+# cheapest insertions per vehicle that keeps the route on time
+INCREMENTAL_INSERTION_CHECKS = 50
+
+# Large jobs: above DECOMPOSE_MIN_SHIPMENTS shipments, the job is split into
+# geographic clusters of about DECOMPOSE_CLUSTER_SHIPMENTS shipments that are
+# solved in parallel (on SOLVE_CORES processes) and stitched together...
+DECOMPOSE_MIN_SHIPMENTS = int(os.getenv("DECOMPOSE_MIN_SHIPMENTS", 150))
+DECOMPOSE_CLUSTER_SHIPMENTS = int(os.getenv("DECOMPOSE_CLUSTER_SHIPMENTS", 60))
+# ...using this fraction of the time limit; the rest polishes the stitched
+# routes on the full model, across cluster boundaries
+DECOMPOSE_CLUSTER_TIME_FRACTION = 0.5
+
+# Fetch the road geometry of solved routes from the job's distance provider
+# and store it with the solution (see add_route_geometry)
+ROUTE_GEOMETRY = os.getenv("ROUTE_GEOMETRY", "true").lower() in ("1", "true", "yes")
+
+
+def resolve_solve_settings(options: schemas.SolveOptions | None = None) -> dict:
+    """
+    Merges a SolveOptions' explicit fields over its profile's defaults.
+    """
+    options = options or schemas.SolveOptions()
+    settings = dict(SOLVE_PROFILES[options.profile], profile=options.profile)
+    for field, value in options.model_dump(exclude={"profile"}).items():
+        if value is not None:
+            settings[field] = value
+    return settings
+
+
+def _no_phase(status):
+    """Default progress callback: ignores phase changes."""
+
+
+def job_depots(job):
+    """
+    Returns the (start, end) depot addresses of a job's vehicles.
+    Vehicles return to their start depot unless the job names an end depot.
+    """
+    start_depot = job.depot_address or DEPOT_LOCATION
+    end_depot = job.end_depot_address or start_depot
+    return start_depot, end_depot
+
+
+def scale_weight(weight) -> int:
+    """
+    Converts a weight in kg to the solver's integral capacity units.
+    """
+    return int(round((weight or 0) * WEIGHT_SCALE))
+
+
+def job_fingerprint(job, settings: dict | None = None) -> str:
+    """
+    Returns a hash of everything the solver reads from a job, plus the
+    search settings it runs with (see resolve_solve_settings).
+    Two solves with the same fingerprint produce equivalent solutions, so a
+    stored solution can be served instead of solving again.
+    """
+    start_depot, end_depot = job_depots(job)
+    payload = {
+        "depots": [
+            maps_client.normalize_address(start_depot),
+            maps_client.normalize_address(end_depot),
+        ],
+        "num_vehicles": job.num_vehicles or 1,
+        "vehicle_capacity": job.vehicle_capacity,
+        "distance_provider": job.distance_provider or distance.DISTANCE_PROVIDER,
+        "shipments": sorted(
+            [
+                shipment.id,
+                maps_client.normalize_address(shipment.origin),
+                maps_client.normalize_address(shipment.destination),
+                shipment.weight,
+                shipment.pickup_window_start,
+                shipment.pickup_window_end,
+                shipment.delivery_window_start,
+                shipment.delivery_window_end,
+                shipment.pickup_service_seconds or 0,
+                shipment.delivery_service_seconds or 0,
+            ]
+            for shipment in job.shipments
+        ),
+        "settings": settings or resolve_solve_settings(),
+    }
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def prepare_shared_locations(jobs, on_phase=_no_phase):
+    """
+    Does the external work of a batch of jobs once (see create_data_model's
+    'shared'): the addresses of all jobs are geocoded in one pass, then each
+    job gets its travel-time matrix. The jobs must use the same distance
+    provider. 'on_phase' is called like in create_data_model.
+
+    The matrices are cut from one matrix over the union of the jobs'
+    locations when that has no more cells than the jobs' own matrices put
+    together, i.e. when the jobs mostly share their addresses. Otherwise
+    each job's matrix is fetched on its own, one after the other, so pairs
+    common to several jobs come from the travel-time cache after the first.
+
+    Returns:
+        {job id: {'coords': {address key: {lat, lng}}, 'index': {address
+        key: row}, 'matrix': int32 array, 'matrix_file': None}} for the
+        jobs whose matrix could be built. A large matrix is written to a
+        shared file instead (see matrix_cache.share_matrix): 'matrix' is
+        None and 'matrix_file' its path.
+    """
+    provider = distance.get_provider(jobs[0].distance_provider)
+    unique_locations = {}
+    coords = {}
+    # Each job's address keys, in order (dicts as ordered sets)
+    job_keys = {}
+    for job in jobs:
+        keys = job_keys[job.id] = {}
+        for loc in job_depots(job):
+            key = maps_client.normalize_address(loc)
+            unique_locations.setdefault(key, loc)
+            keys[key] = None
+        for shipment in job.shipments:
+            origin, destination = geocoding.shipment_coordinates(shipment)
+            for loc, known in ((shipment.origin, origin), (shipment.destination, destination)):
+                key = maps_client.normalize_address(loc)
+                unique_locations.setdefault(key, loc)
+                keys[key] = None
+                if known is not None:
+                    coords[key] = known
 
-def create_data_model(job):
+    on_phase("geocoding")
+    missing = [loc for key, loc in unique_locations.items() if key not in coords]
+    print(
+        f"Batch of {len(jobs)} jobs: geocoding {len(missing)} of "
+        f"{len(unique_locations)} shared unique locations..."
+    )
+    if missing:
+        for loc, found in provider.geocode(missing).items():
+            if found is not None:
+                coords[maps_client.normalize_address(loc)] = found
+
+    # Locations that failed to geocode are left out; the jobs using them
+    # fail on their own geocoding step
+    job_keys = {
+        job_id: [key for key in keys if key in coords] for job_id, keys in job_keys.items()
+    }
+    located = [key for key in unique_locations if key in coords]
+    union_cells = len(located) ** 2
+    job_cells = sum(len(keys) ** 2 for keys in job_keys.values())
+
+    on_phase("matrix")
+    job_matrices = {}
+    if union_cells <= job_cells:
+        print(f"Fetching one shared matrix for {len(located)} locations...")
+        matrix = provider.matrix(
+            [unique_locations[key] for key in located],
+            [coords[key] for key in located],
+        )
+        if matrix is None:
+            return {}
+        matrix = np.asarray(matrix, dtype=maps_client.MATRIX_DTYPE)
+        row_of = {key: row for row, key in enumerate(located)}
+        for job_id, keys in job_keys.items():
+            rows = [row_of[key] for key in keys]
+            job_matrices[job_id] = matrix[np.ix_(rows, rows)]
+    else:
+        print(
+            f"Fetching the matrices of {len(jobs)} jobs one by one "
+            f"({job_cells} cells, against {union_cells} for their union)..."
+        )
+        for job_id, keys in job_keys.items():
+            matrix = provider.matrix(
+                [unique_locations[key] for key in keys],
+                [coords[key] for key in keys],
+            )
+            if matrix is not None:
+                job_matrices[job_id] = np.asarray(matrix, dtype=maps_client.MATRIX_DTYPE)
+
+    shared = {}
+    for job_id, matrix in job_matrices.items():
+        keys = job_keys[job_id]
+        matrix_file = matrix_cache.share_matrix(matrix)
+        shared[job_id] = {
+            'coords': {key: coords[key] for key in keys},
+            'index': {key: row for row, key in enumerate(keys)},
+            'matrix': None if matrix_file else matrix,
+            'matrix_file': matrix_file,
+        }
+    return shared
+
+
+def _time_window(start, end):
+    """
+    Returns the (earliest, latest) arrival of a stop, or None if unconstrained.
+    """
+    if start is None and end is None:
+        return None
+    return (start or 0, schemas.TIME_HORIZON_SECONDS if end is None else end)
+
+
+def create_data_model(job, on_phase=_no_phase, shared=None):
     """
     Prepares the data for the VRP solver.
     This version now geocodes locations and fetches a real distance matrix.
+    'on_phase' is called with "geocoding" and "matrix" as each phase starts.
+    With 'shared' locations (see prepare_shared_locations), coordinates and
+    travel times are taken from there; only locations it lacks are fetched.
     """
 
-    DEPOT_LOCATION = "450 W 33rd St, New York, NY 10001"
+    num_vehicles = job.num_vehicles or 1
+    start_depot, end_depot = job_depots(job)
+    provider = distance.get_provider(job.distance_provider)
+
+    # Node 0 is the start depot; a separate end depot, if any, is node 1
+    locations = [start_depot]
+    end_index = 0
+    if maps_client.normalize_address(end_depot) != maps_client.normalize_address(start_depot):
+        locations.append(end_depot)
+        end_index = 1
 
-    locations = [DEPOT_LOCATION]
+    # What each node is: None for depots, (shipment id, stop type) otherwise
+    nodes = [None] * len(locations)
+    demands = [0] * len(locations)
     pickups_deliveries = []
+    # Time window (earliest, latest arrival) of each node, or None, and the
+    # time spent at it
+    time_windows = [None] * len(locations)
+    service_times = [0] * len(locations)
 
     for shipment in job.shipments:
+        weight = scale_weight(shipment.weight)
+
         locations.append(shipment.origin)
+        nodes.append((shipment.id, "PICKUP"))
+        demands.append(weight)
+        time_windows.append(_time_window(shipment.pickup_window_start, shipment.pickup_window_end))
+        service_times.append(shipment.pickup_service_seconds or 0)
         pickup_index = len(locations) - 1
 
         locations.append(shipment.destination)
+        nodes.append((shipment.id, "DROP"))
+        demands.append(-weight)
+        time_windows.append(_time_window(shipment.delivery_window_start, shipment.delivery_window_end))
+        service_times.append(shipment.delivery_service_seconds or 0)
         drop_index = len(locations) - 1
 
         pickups_deliveries.append([pickup_index, drop_index])
 
+    vehicle_capacities = None
+    if job.vehicle_capacity is not None:
+        capacity = scale_weight(job.vehicle_capacity)
+        too_heavy = [s.id for s in job.shipments if scale_weight(s.weight) > capacity]
+        if too_heavy:
+            print(f"Error: Shipment(s) {too_heavy} exceed the vehicle capacity.")
+            return None
+        vehicle_capacities = [capacity] * num_vehicles
 
-    # --- 1. Build REAL Distance Matrix ---
-    print(f"Fetching distance matrix for {len(locations)} locations...")
-    matrix = maps_client.get_distance_matrix(locations)
-    if matrix is None:
-        print("Error: Failed to get distance matrix from Google Maps.")
-        return None
-    print("Successfully fetched matrix.")
-
-    # --- 2. Geocode all locations ---
-    # !!! THIS BLOCK WAS MISSING IN YOUR PASTED CODE !!!
-    print(f"Geocoding {len(locations)} locations...")
-    geocoded_locations = maps_client.geocode_locations(locations)
-    if None in geocoded_locations.values():
-        print("Error: One or more locations failed to geocode.")
-        return None
-    print("Successfully geocoded locations.")
-    # !!! END OF MISSING BLOCK !!!
+    # Many stops share an address (a warehouse used by every pickup, the
+    # depot), so geocoding and the matrix work on unique addresses only.
+    # 'node_locations' maps each node to its row of the compact matrix.
+    unique_locations = []
+    unique_index = {}
+    node_locations = []
+    for loc in locations:
+        key = maps_client.normalize_address(loc)
+        if key not in unique_index:
+            unique_index[key] = len(unique_locations)
+            unique_locations.append(loc)
+        node_locations.append(unique_index[key])
+
+    # --- 1. Geocode all locations ---
+    on_phase("geocoding")
+    # Shipments carry their own coordinates once geocoded; everything else
+    # (the depot, shipments created moments ago) comes from the geocode cache.
+    with telemetry.phase("geocoding"):
+        known_coords = dict(shared['coords']) if shared is not None else {}
+        for shipment in job.shipments:
+            origin, destination = geocoding.shipment_coordinates(shipment)
+            if origin is not None:
+                known_coords[maps_client.normalize_address(shipment.origin)] = origin
+            if destination is not None:
+                known_coords[maps_client.normalize_address(shipment.destination)] = destination
+
+        missing = [
+            loc for loc in unique_locations
+            if maps_client.normalize_address(loc) not in known_coords
+        ]
+        print(f"Geocoding {len(missing)} of {len(unique_locations)} unique locations...")
+        if missing:
+            for loc, coords in provider.geocode(missing).items():
+                known_coords[maps_client.normalize_address(loc)] = coords
+        if None in known_coords.values():
+            print("Error: One or more locations failed to geocode.")
+            return None
+        geocoded_locations = {
+            loc: known_coords[maps_client.normalize_address(loc)] for loc in locations
+        }
+        print("Successfully geocoded locations.")
+
+    # --- 2. Build REAL Distance Matrix ---
+    on_phase("matrix")
+    with telemetry.phase("matrix"):
+        unique_keys = [maps_client.normalize_address(loc) for loc in unique_locations]
+        if shared is not None and all(key in shared['index'] for key in unique_keys):
+            rows = [shared['index'][key] for key in unique_keys]
+            shared_matrix = shared['matrix']
+            if shared.get('matrix_file'):
+                shared_matrix = matrix_cache.load_matrix(shared['matrix_file'])
+            compact_matrix = shared_matrix[np.ix_(rows, rows)]
+            print(f"Using the shared matrix for {len(unique_locations)} unique locations.")
+        else:
+            print(
+                f"Fetching distance matrix for {len(unique_locations)} unique locations "
+                f"({len(locations)} stops)..."
+            )
+            compact_matrix = provider.matrix(
+                unique_locations,
+                [known_coords[key] for key in unique_keys],
+            )
+        if compact_matrix is None:
+            print(f"Error: Failed to get distance matrix from the {provider.name} provider.")
+            return None
+        print("Successfully fetched matrix.")
+
+    # Expand the compact matrix to one row/column per node
+    compact_matrix = np.asarray(compact_matrix, dtype=maps_client.MATRIX_DTYPE)
+    matrix = compact_matrix[np.ix_(node_locations, node_locations)]
+    # Large matrices are memory-mapped from a shared file, which is what
+    # the search processes of this solve then open
+    matrix_file = matrix_cache.share_matrix(matrix)
+    if matrix_file:
+        matrix = matrix_cache.load_matrix(matrix_file)
 
 
     # --- 3. Package data for the solver ---
     data = {}
     data['distance_matrix'] = matrix
+    data['distance_matrix_file'] = matrix_file
     data['pickups_deliveries'] = pickups_deliveries
-    data['num_vehicles'] = 1
-    data['depot'] = 0
+    data['num_vehicles'] = num_vehicles
+    data['starts'] = [0] * num_vehicles
+    data['ends'] = [end_index] * num_vehicles
+    data['demands'] = demands
+    data['vehicle_capacities'] = vehicle_capacities
+    data['time_windows'] = time_windows
+    data['service_times'] = service_times
 
+    data['unique_locations'] = unique_locations
+    data['node_locations'] = node_locations
     data['locations_map'] = locations
+    data['nodes'] = nodes
     data['shipment_map'] = job.shipments
     # !!! THIS LINE WAS ALSO MISSING - Stores the geocoded results !!!
     data['geocoded_locations'] = geocoded_locations
@@ -61,37 +449,123 @@ def create_data_model(job):
     return data
 
 
-def solve_vrp(job):
+def build_routing_model(data):
     """
-    Solves the Vehicle Routing Problem for a given job.
-    (This function remains unchanged, as it just operates on 'data')
+    Builds the OR-Tools routing model for a prepared data model.
+
+    Travel costs are registered as a transit matrix, so OR-Tools evaluates
+    arcs in native code instead of calling back into Python for every arc
+    it looks at during the search.
+
+    Returns:
+        The (manager, routing) pair.
     """
-    
-    # 1. Prepare the data
-    data = create_data_model(job)
-    
-    # Handle failure from create_data_model
-    if data is None:
-        return None
+    # OR-Tools is imported on first solve, not when the API imports this module
+    from ortools.constraint_solver import pywrapcp
 
-    # 2. Setup the VRP problem
+    matrix = data['distance_matrix']
     manager = pywrapcp.RoutingIndexManager(
-        len(data['distance_matrix']),
+        len(matrix),
         data['num_vehicles'],
-        data['depot']
+        data['starts'],
+        data['ends']
     )
     routing = pywrapcp.RoutingModel(manager)
 
-    # 3. Create the "cost" callback (how long is each segment?)
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
+    # The "cost" of each segment is its travel time. OR-Tools wants a
+    # nested list here; it keeps its own native copy of the values, and the
+    # (much larger) list of Python ints is dropped right after.
+    transit_matrix_index = routing.RegisterTransitMatrix(matrix.tolist())
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_matrix_index)
 
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-    
-    # 4. Add "Pickup & Delivery" constraints
+    add_pickups_and_deliveries(data, manager, routing)
+    add_capacity_dimension(data, routing)
+    add_time_dimension(data, manager, routing)
+    add_span_cost(data, routing, transit_matrix_index)
+    return manager, routing
+
+
+def uses_time(data) -> bool:
+    """
+    Whether any stop has a time window or a service time.
+    """
+    return any(data['time_windows']) or any(data['service_times'])
+
+
+def add_time_dimension(data, manager, routing):
+    """
+    Adds the "Time" dimension: when a vehicle reaches each node (travel time
+    plus the service time at the previous stop), kept within the node's
+    time window. Vehicles may wait for a window to open.
+    Jobs without time windows or service times get no dimension.
+    """
+    if not uses_time(data):
+        return
+    time_windows = data['time_windows']
+    service_times = data['service_times']
+
+    matrix = data['distance_matrix']
+    time_matrix = matrix + np.asarray(service_times, dtype=np.int64)[:, None]
+    time_index = routing.RegisterTransitMatrix(time_matrix.tolist())
+    routing.AddDimension(
+        time_index,
+        schemas.TIME_HORIZON_SECONDS,  # allowed waiting time
+        schemas.TIME_HORIZON_SECONDS,  # latest arrival anywhere
+        True,  # vehicles leave the depot at time 0
+        "Time",
+    )
+    time_dimension = routing.GetDimensionOrDie("Time")
+    for node, window in enumerate(time_windows):
+        if window is not None:
+            time_dimension.CumulVar(manager.NodeToIndex(node)).SetRange(*window)
+    # Among equally short routes, prefer those that finish early
+    for vehicle_id in range(data['num_vehicles']):
+        routing.AddVariableMinimizedByFinalizer(time_dimension.CumulVar(routing.End(vehicle_id)))
+
+
+def add_span_cost(data, routing, transit_index):
+    """
+    Adds the "Travel" dimension (travel time along each route) and charges
+    data['span_cost_coefficient'] per second of the longest route, so the
+    work is spread over the fleet instead of piling onto one vehicle.
+    Single-vehicle jobs, or a coefficient of 0, get no dimension.
+    """
+    coefficient = data.get('span_cost_coefficient') or 0
+    if coefficient <= 0 or data['num_vehicles'] < 2:
+        return
+    routing.AddDimension(
+        transit_index,
+        0,  # no waiting
+        ROUTE_SPAN_LIMIT,  # no limit: UNREACHABLE legs must still fit
+        True,
+        "Travel",
+    )
+    routing.GetDimensionOrDie("Travel").SetGlobalSpanCostCoefficient(coefficient)
+
+
+def add_capacity_dimension(data, routing):
+    """
+    Adds the "Capacity" dimension: the load carried by a vehicle (pickups
+    add a shipment's weight, drops remove it) never exceeds its capacity.
+    Jobs without a vehicle capacity get no dimension.
+    """
+    if data['vehicle_capacities'] is None:
+        return
+    demand_index = routing.RegisterUnaryTransitVector(data['demands'])
+    routing.AddDimensionWithVehicleCapacity(
+        demand_index,
+        0,  # no slack
+        data['vehicle_capacities'],
+        True,  # every vehicle leaves the depot empty
+        "Capacity",
+    )
+
+
+def add_pickups_and_deliveries(data, manager, routing):
+    """
+    Adds the "Pickup & Delivery" constraints: each shipment is picked up
+    before it is dropped off, by the same vehicle.
+    """
     for request in data['pickups_deliveries']:
         pickup_index = manager.NodeToIndex(request[0])
         delivery_index = manager.NodeToIndex(request[1])
@@ -100,66 +574,946 @@ def solve_vrp(job):
             routing.VehicleVar(pickup_index) == routing.VehicleVar(delivery_index)
         )
 
-    # 5. Set search parameters and solve
+
+def make_search_parameters(settings: dict, first_solution_strategy: str | None = None):
+    """
+    Translates resolved solve settings into OR-Tools search parameters.
+    """
+    from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    search_parameters.first_solution_strategy = getattr(
+        routing_enums_pb2.FirstSolutionStrategy,
+        first_solution_strategy or settings['first_solution_strategy'],
+    )
+    search_parameters.local_search_metaheuristic = getattr(
+        routing_enums_pb2.LocalSearchMetaheuristic,
+        settings['local_search_metaheuristic'],
     )
+    # At least 1 ms: a zero time limit means no limit at all
+    search_parameters.time_limit.FromMilliseconds(max(1, int(settings['time_limit_seconds'] * 1000)))
+    if settings['solution_limit']:
+        search_parameters.solution_limit = settings['solution_limit']
+    return search_parameters
 
-    solution = routing.SolveWithParameters(search_parameters)
 
-    # 6. If a solution is found, parse it into our schema
-    if solution:
-        return parse_solution(data, manager, routing, solution, job)
-    else:
-        print("Optimization failed: No solution found.")
+def solver_inputs(data):
+    """
+    Returns the part of a data model the search needs (no ORM objects),
+    small enough to send to another process. A memory-mapped matrix is
+    sent as its file path (see open_solver_inputs).
+    """
+    keys = (
+        'distance_matrix', 'pickups_deliveries', 'num_vehicles',
+        'starts', 'ends', 'demands', 'vehicle_capacities',
+        'time_windows', 'service_times', 'span_cost_coefficient',
+    )
+    inputs = {key: data.get(key) for key in keys}
+    if data.get('distance_matrix_file'):
+        inputs['distance_matrix'] = None
+        inputs['distance_matrix_file'] = data['distance_matrix_file']
+    return inputs
+
+
+def open_solver_inputs(inputs):
+    """
+    Maps the matrix file of solver inputs received from another process.
+    """
+    if inputs.get('distance_matrix_file'):
+        inputs = dict(inputs, distance_matrix=matrix_cache.load_matrix(inputs['distance_matrix_file']))
+    return inputs
+
+
+_search_pool = None
+# Set by a solve worker to end its helpers' searches (see stop_searches);
+# the helpers get it when they start
+_search_stop = None
+
+
+def submit_search(fn, *args):
+    """
+    Runs fn(*args) on this process's pool of SOLVE_CORES search helpers.
+    The pool is started on first use and kept for the next solves, so only
+    the first parallel search of a solve worker waits for it to start.
+    """
+    global _search_pool, _search_stop
+    if _search_pool is None:
+        context = multiprocessing.get_context("spawn")
+        _search_stop = context.Event()
+        _search_pool = ProcessPoolExecutor(
+            max_workers=SOLVE_CORES,
+            mp_context=context,
+            initializer=_start_helper,
+            initargs=(_search_stop,),
+        )
+        # A solve worker waits for its child processes when it exits, and
+        # the helpers only exit once told to: tell them first, while the
+        # pool's queues (closed at exit priority 10) still work
+        multiprocessing.util.Finalize(
+            _search_pool, _search_pool.shutdown, kwargs={'cancel_futures': True}, exitpriority=20,
+        )
+    try:
+        return _search_pool.submit(fn, *args)
+    except BrokenProcessPool:
+        # A helper died; the pool takes no more work
+        _search_pool.shutdown(wait=False)
+        _search_pool = None
+        return submit_search(fn, *args)
+
+
+def start_search_pool():
+    """
+    Starts this process's search helpers ahead of the first solve that
+    needs them; the solve workers' initializer. Nothing to start when a
+    solve gets a single core. Returns the futures of the helpers' start.
+    """
+    if SOLVE_CORES > 1:
+        return [submit_search(_load_solver) for _ in range(SOLVE_CORES)]
+    return []
+
+
+def _start_helper(search_stop):
+    global _search_stop
+    _search_stop = search_stop
+
+
+def _load_solver():
+    from ortools.constraint_solver import pywrapcp  # noqa: F401
+
+
+def stop_searches():
+    """
+    Tells the searches running on this process's helpers to end, each once
+    it has found a solution (see watch_stop).
+    """
+    if _search_stop is not None:
+        _search_stop.set()
+
+
+def wait_searches(futures, timeout: float, progress=None):
+    """
+    Waits up to 'timeout' seconds for searches running on the helpers, and
+    returns wait()'s (done, pending). A stop requested through 'progress'
+    meanwhile (see worker.ProgressReporter.stop_requested) is passed on to
+    the helpers, which then get PORTFOLIO_GRACE_SECONDS to hand back what
+    they have.
+    """
+    deadline = time.time() + timeout
+    while True:
+        remaining = max(0.0, deadline - time.time())
+        if progress is None:
+            return wait(futures, timeout=remaining)
+        done, pending = wait(futures, timeout=min(remaining, STOP_POLL_SECONDS))
+        if not pending or remaining <= STOP_POLL_SECONDS:
+            return done, pending
+        if progress.stop_requested():
+            stop_searches()
+            return wait(futures, timeout=min(remaining, PORTFOLIO_GRACE_SECONDS))
+
+
+def search_routes(
+    data,
+    settings: dict,
+    first_solution_strategy: str | None = None,
+    deadline: float | None = None,
+    stop_requested=None,
+):
+    """
+    Runs one search and returns its (objective, routes, counts), where
+    'routes' lists the visited nodes of each vehicle (depots excluded) and
+    'counts' are its search counters (see telemetry.search_counts), for the
+    caller to add to its solve. Used as the unit of work of a parallel search.
+
+    With a 'deadline' (a time.time() value), the search also ends by then:
+    time spent waiting for the process and building the model comes out of
+    its time limit. No time left means no search.
+
+    The search also ends, once it has found a solution, when
+    'stop_requested()' returns True; on a search helper, when the solve
+    worker calls stop_searches.
+
+    'objective' and 'routes' are None if no solution was found.
+    """
+    data = open_solver_inputs(data)
+    manager, routing = build_routing_model(data)
+    if stop_requested is None and _search_stop is not None:
+        stop_requested = _search_stop.is_set
+    if stop_requested is not None:
+        watch_stop(routing, stop_requested)
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None, None, {}
+        settings = dict(settings, time_limit_seconds=min(settings['time_limit_seconds'], remaining))
+    solution = routing.SolveWithParameters(
+        make_search_parameters(settings, first_solution_strategy)
+    )
+    counts = telemetry.search_counts(routing.solver())
+    if solution is None:
+        return None, None, counts
+    return solution.ObjectiveValue(), assignment_routes(manager, routing, solution), counts
+
+
+def assignment_routes(manager, routing, solution):
+    """
+    Returns the nodes visited by each vehicle in 'solution', depots excluded,
+    in the format RoutingModel.ReadAssignmentFromRoutes expects.
+    """
+    routes = []
+    for vehicle_id in range(routing.vehicles()):
+        route = []
+        index = solution.Value(routing.NextVar(routing.Start(vehicle_id)))
+        while not routing.IsEnd(index):
+            route.append(manager.IndexToNode(index))
+            index = solution.Value(routing.NextVar(index))
+        routes.append(route)
+    return routes
+
+
+def solve_data_model(
+    data,
+    settings: dict | None = None,
+    initial_routes=None,
+    seed_time_fraction: float = INCREMENTAL_TIME_FRACTION,
+    progress=None,
+):
+    """
+    Runs the OR-Tools search on a prepared data model.
+
+    With 'initial_routes' (per-vehicle node lists, see seed_routes), the
+    search starts from those routes instead of building a first solution and
+    runs for 'seed_time_fraction' of the time limit; data['seeded'] records
+    whether the routes were feasible and actually used.
+
+    Otherwise, with more than one search worker (at most SOLVE_CORES), the
+    configured strategy runs here while each extra worker runs another
+    first-solution strategy on a search helper (see submit_search), within
+    the same time limit; the best routes found win, and the helpers' search
+    counters are added to the solve's.
+
+    'progress' follows the search run here (see watch_search). A stop ends
+    it as usual and is passed on to the helpers (see wait_searches).
+
+    Returns:
+        The (manager, routing, solution) triple; 'solution' is None if the
+        solver found no solution.
+    """
+    settings = settings or resolve_solve_settings()
+    with telemetry.phase("build_model"):
+        manager, routing = build_routing_model(data)
+    if progress is not None:
+        watch_search(data, manager, routing, progress)
+    search_parameters = make_search_parameters(settings)
+
+    data['seeded'] = False
+    if initial_routes is not None:
+        routing.CloseModelWithParameters(search_parameters)
+        initial_solution = read_routes(manager, routing, initial_routes)
+        if initial_solution is not None:
+            data['seeded'] = True
+            incremental_parameters = make_search_parameters(dict(
+                settings,
+                time_limit_seconds=settings['time_limit_seconds'] * seed_time_fraction,
+            ))
+            with telemetry.phase("search"):
+                solution = routing.SolveFromAssignmentWithParameters(
+                    initial_solution, incremental_parameters
+                )
+            telemetry.record_search(routing.solver())
+            # With almost no time left the search may end before it has
+            # even restored the seed; the seed is still a solution
+            return manager, routing, solution or initial_solution
+        print("Seed routes are infeasible; falling back to a full solve.")
+        # The closed model can't be searched with other parameters
+        manager, routing = build_routing_model(data)
+        if progress is not None:
+            watch_search(data, manager, routing, progress)
+
+    num_workers = min(settings['num_search_workers'], SOLVE_CORES)
+    futures = []
+    if num_workers > 1:
+        first = settings['first_solution_strategy']
+        strategies = [s for s in PORTFOLIO_STRATEGIES if s != first][:num_workers - 1]
+        deadline = time.time() + settings['time_limit_seconds']
+        inputs = solver_inputs(data)
+        futures = [
+            submit_search(search_routes, inputs, settings, strategy, deadline)
+            for strategy in strategies
+        ]
+
+    with telemetry.phase("search"):
+        solution = routing.SolveWithParameters(search_parameters)
+        telemetry.record_search(routing.solver())
+        if not futures:
+            return manager, routing, solution
+
+        if progress is not None and progress.stopped:
+            stop_searches()
+            done, pending = wait(futures, timeout=PORTFOLIO_GRACE_SECONDS)
+        else:
+            done, pending = wait_searches(
+                futures, max(0.0, deadline - time.time()) + PORTFOLIO_GRACE_SECONDS, progress,
+            )
+    for future in pending:
+        future.cancel()
+    results = [future.result() for future in done if future.exception() is None]
+    # Helpers left behind don't report their counters
+    for _, _, counts in results:
+        telemetry.record_counts(counts)
+    results = [result for result in results if result[1] is not None]
+    if not results:
+        return manager, routing, solution
+
+    objective, best_routes, _ = min(results, key=lambda result: result[0])
+    if solution is None or objective < solution.ObjectiveValue():
+        solution = read_routes(manager, routing, best_routes) or solution
+    return manager, routing, solution
+
+
+def watch_search(data, manager, routing, progress):
+    """
+    Hooks a progress reporter (see worker.ProgressReporter) into a search.
+
+    progress.improved(objective, routes) is called with every improving
+    solution; 'routes' is a function returning its SolutionRoutes, to be
+    called during the callback only. progress.should_stop() is polled
+    throughout the search: once it returns True, the search ends with the
+    best solution found so far. progress.stop_requested() tells whether a
+    stop was requested at all, for the searches not watched here (see
+    wait_searches).
+    """
+    def on_solution():
+        progress.improved(
+            routing.CostVar().Value(),
+            lambda: current_routes(data, manager, routing),
+        )
+
+    routing.AddAtSolutionCallback(on_solution)
+    routing.AddSearchMonitor(routing.solver().CustomLimit(progress.should_stop))
+
+
+def watch_stop(routing, stop_requested):
+    """
+    Ends a search once it has found a solution and 'stop_requested()'
+    returns True, with the best solution found so far. For searches that
+    have no progress reporter: stop_requested is only called every
+    STOP_CHECK_CALLS polls.
+    """
+    found = False
+    countdown = STOP_CHECK_CALLS
+
+    def on_solution():
+        nonlocal found
+        found = True
+
+    def should_stop():
+        nonlocal countdown
+        countdown -= 1
+        if countdown > 0 or not found:
+            return False
+        countdown = STOP_CHECK_CALLS
+        return stop_requested()
+
+    routing.AddAtSolutionCallback(on_solution)
+    routing.AddSearchMonitor(routing.solver().CustomLimit(should_stop))
+
+
+def current_routes(data, manager, routing):
+    """
+    Returns the routes of the solution the search is at, as SolutionRoutes
+    without arrival times. Only valid inside a solution callback.
+    """
+    routes = []
+    for vehicle_id in range(data['num_vehicles']):
+        route_obj = schemas.SolutionRoute(vehicle_id=vehicle_id)
+        index = routing.NextVar(routing.Start(vehicle_id)).Value()
+        while not routing.IsEnd(index):
+            node_index = manager.IndexToNode(index)
+            if data['nodes'][node_index] is not None:
+                route_obj.stops.append(solution_stop(data, node_index))
+            index = routing.NextVar(index).Value()
+        if route_obj.stops:
+            routes.append(route_obj)
+    return routes
+
+
+def read_routes(manager, routing, routes):
+    """
+    Loads per-vehicle node lists (see assignment_routes) into an assignment
+    of a closed routing model. Returns None if the routes are infeasible.
+    """
+    index_routes = [[manager.NodeToIndex(node) for node in route] for route in routes]
+    return routing.ReadAssignmentFromRoutes(index_routes, True)
+
+
+def seed_routes(data, previous: schemas.Solution):
+    """
+    Builds initial routes for an incremental re-solve from a job's previous
+    solution: stops of shipments that still exist keep their vehicle and
+    order, and each new shipment is inserted where it adds the least travel
+    time.
+
+    Returns:
+        Per-vehicle node lists, or None when the job changed too much for
+        the previous solution to be a useful starting point.
+    """
+    num_vehicles = data['num_vehicles']
+    node_of = {stop: node for node, stop in enumerate(data['nodes']) if stop is not None}
+    current_ids = {stop[0] for stop in node_of}
+
+    routes = [[] for _ in range(num_vehicles)]
+    previous_ids = set()
+    for route in previous.routes:
+        if route.vehicle_id >= num_vehicles:
+            return None
+        for stop in route.stops:
+            previous_ids.add(stop.id)
+            node = node_of.get((stop.id, stop.type))
+            if node is not None:
+                routes[route.vehicle_id].append(node)
+
+    new_pairs = [
+        (pickup, drop) for pickup, drop in data['pickups_deliveries']
+        if data['nodes'][pickup][0] not in previous_ids
+    ]
+    changed = len(new_pairs) + len(previous_ids - current_ids)
+    if changed > INCREMENTAL_MAX_CHANGED_FRACTION * len(current_ids):
         return None
 
+    for pickup, drop in new_pairs:
+        if not _insert_cheapest(data, routes, pickup, drop):
+            return None
+    return routes
+
+
+def _insert_cheapest(data, routes, pickup, drop):
+    """
+    Inserts a (pickup, drop) pair into 'routes' at the positions that add
+    the least travel time, with the pickup before the drop and without
+    overloading the vehicle. Returns False if the pair fits nowhere.
+
+    With time windows or service times, the insertion must also keep every
+    stop of the route within its window: the cheapest insertions (up to
+    INCREMENTAL_INSERTION_CHECKS per vehicle) are tried in order.
+    """
+    matrix = data['distance_matrix']
+
+    def travel(rows, cols):
+        # In int64: sums involving UNREACHABLE overflow int32
+        return matrix[rows, cols].astype(np.int64)
+
+    demands = np.asarray(data['demands'])
+    capacities = data['vehicle_capacities']
+    timed = uses_time(data)
+    candidates = []  # (added cost, vehicle, pickup gap, drop gap)
+
+    for vehicle_id, route in enumerate(routes):
+        sequence = np.array([data['starts'][vehicle_id], *route, data['ends'][vehicle_id]])
+        before, after = sequence[:-1], sequence[1:]
+        base = travel(before, after)
+
+        # Cost of putting the pickup/drop into gap i (between sequence[i] and [i+1])
+        pickup_cost = travel(before, pickup) + travel(pickup, after) - base
+        drop_cost = travel(before, drop) + travel(drop, after) - base
+        same_gap_cost = travel(before, pickup) + travel(pickup, drop) + travel(drop, after) - base
+
+        # The shipment's weight is carried through every gap from pickup to drop
+        if capacities is None:
+            fits = np.ones(len(base), dtype=bool)
+        else:
+            gap_load = np.cumsum(demands[before])
+            fits = gap_load + demands[pickup] <= capacities[vehicle_id]
+
+        if timed:
+            candidates.extend(
+                (cost, vehicle_id, pickup_gap, drop_gap)
+                for cost, pickup_gap, drop_gap in _cheapest_gap_pairs(
+                    pickup_cost, drop_cost, same_gap_cost, fits, INCREMENTAL_INSERTION_CHECKS,
+                )
+            )
+            continue
+
+        best = None
+        best_pickup_gap = None  # cheapest feasible pickup gap before the current one
+        for gap in range(len(base)):
+            if not fits[gap]:
+                best_pickup_gap = None
+                continue
+            options = [(same_gap_cost[gap], gap)]
+            if best_pickup_gap is not None:
+                options.append((pickup_cost[best_pickup_gap] + drop_cost[gap], best_pickup_gap))
+            for cost, pickup_gap in options:
+                if best is None or cost < best[0]:
+                    best = (cost, vehicle_id, pickup_gap, gap)
+            if best_pickup_gap is None or pickup_cost[gap] < pickup_cost[best_pickup_gap]:
+                best_pickup_gap = gap
+        if best is not None:
+            candidates.append(best)
+
+    # Stable: among equal costs, the first vehicle wins
+    candidates.sort(key=lambda candidate: candidate[0])
+    for _, vehicle_id, pickup_gap, drop_gap in candidates:
+        route = list(routes[vehicle_id])
+        route.insert(pickup_gap, pickup)
+        # The drop goes into its gap, shifted by one for the inserted pickup
+        route.insert(drop_gap + 1, drop)
+        if not timed or _on_time(data, vehicle_id, route):
+            routes[vehicle_id] = route
+            return True
+    return False
+
+
+def _cheapest_gap_pairs(pickup_cost, drop_cost, same_gap_cost, fits, limit):
+    """
+    Returns the 'limit' cheapest (added cost, pickup gap, drop gap) of one
+    route, cheapest first, among those whose gaps from pickup to drop all
+    fit the load.
+    """
+    gaps = len(fits)
+    cost = pickup_cost[:, None] + drop_cost[None, :]
+    cost[np.diag_indices(gaps)] = same_gap_cost
+    # The last gap at or before each drop gap that can't take the load
+    last_unfit = np.maximum.accumulate(np.where(fits, -1, np.arange(gaps)))
+    pickup_gaps, drop_gaps = np.nonzero(np.triu(np.ones((gaps, gaps), dtype=bool)))
+    keep = pickup_gaps > last_unfit[drop_gaps]
+    pickup_gaps, drop_gaps = pickup_gaps[keep], drop_gaps[keep]
+    costs = cost[pickup_gaps, drop_gaps]
+    order = np.argsort(costs, kind="stable")[:limit]
+    return [(costs[k], pickup_gaps[k], drop_gaps[k]) for k in order]
+
+
+def _on_time(data, vehicle_id, route) -> bool:
+    """
+    Whether a vehicle driving 'route' from time 0 (see add_time_dimension)
+    reaches every stop within its time window, waiting for windows to open.
+    """
+    matrix = data['distance_matrix']
+    time_windows = data['time_windows']
+    service_times = data['service_times']
+    arrival = 0
+    node = data['starts'][vehicle_id]
+    for next_node in [*route, data['ends'][vehicle_id]]:
+        arrival += service_times[node] + int(matrix[node, next_node])
+        window = time_windows[next_node]
+        if window is not None:
+            if arrival > window[1]:
+                return False
+            arrival = max(arrival, window[0])
+        if arrival > schemas.TIME_HORIZON_SECONDS:
+            return False
+        node = next_node
+    return True
+
+
+def should_decompose(data, settings: dict) -> bool:
+    """
+    Whether to solve the job by decomposition (see decompose_routes):
+    as requested by settings['decompose'], or by job size if unset.
+    """
+    num_shipments = len(data['pickups_deliveries'])
+    if num_shipments < 2:
+        return False
+    decompose = settings.get('decompose')
+    if decompose is None:
+        decompose = num_shipments > DECOMPOSE_MIN_SHIPMENTS
+    # Chaining clusters on a shared vehicle shifts every later stop in time,
+    # which time windows rarely survive
+    num_clusters = math.ceil(num_shipments / DECOMPOSE_CLUSTER_SHIPMENTS)
+    if decompose and any(data['time_windows']) and data['num_vehicles'] < num_clusters:
+        print("Not decomposing: time windows need a vehicle per cluster.")
+        return False
+    return decompose
+
+
+def kmeans(points: np.ndarray, k: int, iterations: int = 50, seed: int = 0) -> np.ndarray:
+    """
+    Plain k-means (k-means++ seeding, then Lloyd iterations).
+    Returns the cluster label of each point; some labels may end up unused.
+    """
+    rng = np.random.default_rng(seed)
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        squared = ((points[:, None, :] - np.array(centers)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        if squared.sum() == 0:
+            break
+        centers.append(points[rng.choice(len(points), p=squared / squared.sum())])
+    centers = np.array(centers)
+
+    labels = None
+    for _ in range(iterations):
+        squared = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = squared.argmin(axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for cluster in range(len(centers)):
+            members = points[labels == cluster]
+            if len(members):
+                centers[cluster] = members.mean(axis=0)
+    return labels
+
+
+def _node_points(data) -> np.ndarray:
+    """
+    Returns the (x, y) position of every node, in degrees of latitude, with
+    longitudes scaled so distances are roughly isotropic.
+    """
+    coords = [data['geocoded_locations'][loc] for loc in data['locations_map']]
+    lat = np.array([c['lat'] for c in coords])
+    lng = np.array([c['lng'] for c in coords])
+    return np.column_stack([lng * np.cos(np.radians(lat.mean())), lat])
+
+
+def _cluster_vehicles(cluster_sizes: list[int], num_vehicles: int) -> list[list[int]]:
+    """
+    Assigns vehicles to clusters. With at least one vehicle per cluster, the
+    fleet is split in proportion to cluster size; otherwise each cluster
+    gets one vehicle, shared with its neighbours in the given cluster order.
+    """
+    num_clusters = len(cluster_sizes)
+    if num_vehicles < num_clusters:
+        return [[cluster * num_vehicles // num_clusters] for cluster in range(num_clusters)]
+
+    counts = [1] * num_clusters
+    for _ in range(num_vehicles - num_clusters):
+        busiest = max(range(num_clusters), key=lambda c: cluster_sizes[c] / counts[c])
+        counts[busiest] += 1
+    vehicles = []
+    next_vehicle = 0
+    for count in counts:
+        vehicles.append(list(range(next_vehicle, next_vehicle + count)))
+        next_vehicle += count
+    return vehicles
+
+
+def _cluster_inputs(data, pairs, vehicles):
+    """
+    Builds the solver inputs of one cluster: the depots plus the cluster's
+    pickup/drop nodes, served by 'vehicles'. Returns (inputs, nodes), where
+    nodes[i] is the full-model node of the cluster's node i.
+    """
+    depots = list(dict.fromkeys(data['starts'] + data['ends']))
+    nodes = depots + [node for pair in pairs for node in pair]
+    local = {node: i for i, node in enumerate(nodes)}
+    capacities = data['vehicle_capacities']
+    inputs = {
+        'distance_matrix': data['distance_matrix'][np.ix_(nodes, nodes)],
+        'pickups_deliveries': [[local[pickup], local[drop]] for pickup, drop in pairs],
+        'num_vehicles': len(vehicles),
+        'starts': [local[data['starts'][v]] for v in vehicles],
+        'ends': [local[data['ends'][v]] for v in vehicles],
+        'demands': [data['demands'][node] for node in nodes],
+        'time_windows': [data['time_windows'][node] for node in nodes],
+        'service_times': [data['service_times'][node] for node in nodes],
+        'vehicle_capacities': None if capacities is None else [capacities[v] for v in vehicles],
+        'span_cost_coefficient': data.get('span_cost_coefficient'),
+    }
+    return inputs, nodes
+
+
+def decompose_routes(data, settings: dict, deadline: float, progress=None):
+    """
+    Solves a large job as independent sub-problems: shipments are clustered
+    by k-means on their pickup and drop coordinates, each cluster is solved
+    on its own (in parallel on search helpers, see submit_search), and the
+    cluster routes are stitched into per-vehicle node lists for the full
+    model. All of it ends by 'deadline' (a time.time() value), or soon
+    after a stop is requested through 'progress' (see wait_searches): the
+    cluster searches then end once they have a solution.
+
+    Every cluster route starts and ends empty, so routes of clusters that
+    share a vehicle are simply chained, in order around the start depot.
+
+    Returns:
+        Per-vehicle node lists, or None if a cluster could not be solved.
+    """
+    pairs = data['pickups_deliveries']
+    points = _node_points(data)
+    shipment_points = np.array([np.concatenate([points[p], points[d]]) for p, d in pairs])
+    num_clusters = math.ceil(len(pairs) / DECOMPOSE_CLUSTER_SHIPMENTS)
+    labels = kmeans(shipment_points, num_clusters)
+
+    clusters = [
+        [pair for pair, label in zip(pairs, labels) if label == cluster]
+        for cluster in np.unique(labels)
+    ]
+    # Sweep the clusters around the depot, so a vehicle shared by
+    # consecutive clusters serves neighbouring areas
+    depot = points[data['starts'][0]]
+
+    def bearing(cluster):
+        center = points[[node for pair in cluster for node in pair]].mean(axis=0)
+        return math.atan2(center[1] - depot[1], center[0] - depot[0])
+
+    clusters.sort(key=bearing)
+    vehicles = _cluster_vehicles([len(cluster) for cluster in clusters], data['num_vehicles'])
+
+    workers = max(1, min(len(clusters), SOLVE_CORES))
+    cluster_settings = dict(settings, num_search_workers=1)
+    print(
+        f"Decomposing {len(pairs)} shipments into {len(clusters)} clusters "
+        f"on {workers} worker(s)..."
+    )
+
+    cluster_inputs = [
+        _cluster_inputs(data, cluster, cluster_vehicles)
+        for cluster, cluster_vehicles in zip(clusters, vehicles)
+    ]
+    # Clusters run in waves of 'workers'. Each wave gets an even share of
+    # the time left, so a slow start (helper start-up) shortens the first
+    # wave rather than the last, and the last wave ends by the deadline.
+    results = []
+    for start in range(0, len(cluster_inputs), workers):
+        wave = [inputs for inputs, _ in cluster_inputs[start:start + workers]]
+        waves_left = math.ceil((len(cluster_inputs) - start) / workers)
+        wave_deadline = time.time() + max(0.0, deadline - time.time()) / waves_left
+        if workers == 1:
+            # A single worker is this process: no helper to start
+            stop_requested = progress.stop_requested if progress is not None else None
+            results.append(
+                search_routes(wave[0], cluster_settings, None, wave_deadline, stop_requested)
+            )
+        else:
+            futures = [
+                submit_search(search_routes, inputs, cluster_settings, None, wave_deadline)
+                for inputs in wave
+            ]
+            done, pending = wait_searches(
+                futures, max(0.0, wave_deadline - time.time()) + PORTFOLIO_GRACE_SECONDS, progress,
+            )
+            for future in pending:
+                future.cancel()
+            results.extend(
+                future.result() if future in done and future.exception() is None else (None, None, {})
+                for future in futures
+            )
+        for _, _, counts in results[start:]:
+            telemetry.record_counts(counts)
+        if any(cluster_routes is None for _, cluster_routes, _ in results):
+            return None
+
+    routes = [[] for _ in range(data['num_vehicles'])]
+    for result, (_, nodes), cluster_vehicles in zip(results, cluster_inputs, vehicles):
+        _, cluster_routes, _ = result
+        for vehicle, route in zip(cluster_vehicles, cluster_routes):
+            routes[vehicle].extend(nodes[node] for node in route)
+    return routes
+
+
+def search_data_model(data, settings: dict, previous_solution=None, progress=None):
+    """
+    Searches a prepared data model the way a job's solve does. With a
+    'previous_solution' close enough to the job (see seed_routes), the
+    search starts from its routes; otherwise large jobs are solved by
+    decomposition (see decompose_routes) and the stitched routes polished
+    on the full model; otherwise, or if that fails, the search starts from
+    scratch. 'progress' follows the search of the full model, see
+    watch_search, and passes stop requests on to the cluster searches.
+
+    Returns:
+        The (manager, routing, solution) triple of solve_data_model;
+        data['seeded'] and data['decomposed'] record how the search went.
+    """
+    data['span_cost_coefficient'] = settings.get('span_cost_coefficient', ROUTE_SPAN_COST)
+    # The helpers may have been stopped for the last solve
+    if _search_stop is not None:
+        _search_stop.clear()
+    initial_routes = None
+    if previous_solution is not None:
+        initial_routes = seed_routes(data, previous_solution)
+    if initial_routes is not None:
+        print("Re-solving incrementally from the previous solution.")
+
+    seed_time_fraction = INCREMENTAL_TIME_FRACTION
+    search_settings = settings
+    data['decomposed'] = False
+    if initial_routes is None and should_decompose(data, settings):
+        deadline = time.time() + settings['time_limit_seconds']
+        with telemetry.phase("decompose"):
+            initial_routes = decompose_routes(
+                data, settings,
+                deadline=time.time() + settings['time_limit_seconds'] * DECOMPOSE_CLUSTER_TIME_FRACTION,
+                progress=progress,
+            )
+        # Polishing the stitched routes (or, if a cluster failed, the full
+        # solve) gets what is left of the time limit
+        search_settings = dict(settings, time_limit_seconds=max(0.0, deadline - time.time()))
+        seed_time_fraction = 1.0
+        data['decomposed'] = initial_routes is not None
+
+    return solve_data_model(
+        data, search_settings, initial_routes,
+        seed_time_fraction=seed_time_fraction, progress=progress,
+    )
+
+
+def solve_vrp(
+    job,
+    on_phase=_no_phase,
+    settings: dict | None = None,
+    previous_solution: schemas.Solution | None = None,
+    shared=None,
+    progress=None,
+):
+    """
+    Solves the Vehicle Routing Problem for a given job.
+    'on_phase' is called with the name of each phase ("geocoding",
+    "matrix", "solving") as it starts, so callers can report progress.
+    'settings' are resolved solve settings (default: the "balanced" profile).
+
+    With a 'previous_solution', the job is re-solved incrementally: the
+    search starts from the previous routes (with new shipments inserted)
+    and runs for a fraction of the time limit. Large changes fall back to a
+    full solve.
+
+    Otherwise, large jobs are solved by decomposition (see decompose_routes)
+    and the stitched routes are polished on the full model.
+
+    'shared' are the job's locations prepared with a batch of jobs (see
+    prepare_shared_locations). 'progress' follows the search, see
+    watch_search.
+    """
+    stats = telemetry.start_solve()
+    try:
+        return _solve_vrp(job, on_phase, settings, previous_solution, shared, progress, stats)
+    finally:
+        telemetry.finish_solve()
+
+
+def _solve_vrp(job, on_phase, settings, previous_solution, shared, progress, stats):
+    started = time.perf_counter()
+    settings = settings or resolve_solve_settings()
+    
+    # 1. Prepare the data
+    data = create_data_model(job, on_phase=on_phase, shared=shared)
+    
+    # Handle failure from create_data_model
+    if data is None:
+        return None
+
+    try:
+        # 2. Build the model and search, seeded with the previous routes if any
+        on_phase("solving")
+        manager, routing, solution = search_data_model(
+            data, settings, previous_solution, progress=progress,
+        )
+
+        # 3. If a solution is found, parse it into our schema
+        if solution:
+            with telemetry.phase("parse"):
+                result = parse_solution(data, manager, routing, solution, job)
+            if ROUTE_GEOMETRY:
+                with telemetry.phase("geometry"):
+                    add_route_geometry(data, result, distance.get_provider(job.distance_provider))
+            result.objective = solution.ObjectiveValue()
+            result.profile = settings['profile']
+            telemetry.record_objective(result.profile, result.objective)
+            result.wall_time_seconds = round(time.perf_counter() - started, 3)
+            result.incremental = data['seeded'] and not data['decomposed']
+            result.phase_seconds = {
+                name: round(seconds, 3) for name, seconds in stats.phase_seconds.items()
+            }
+            result.counters = dict(stats.counters)
+            return result
+        else:
+            print("Optimization failed: No solution found.")
+            return None
+    finally:
+        # The search processes are done with the matrix file
+        matrix_cache.release_matrix(data['distance_matrix_file'])
+
 def parse_solution(data, manager, routing, solution, job):
     """
     Converts the solver's output into our Pydantic schemas.
-    (This function remains unchanged)
+    Returns one SolutionRoute per vehicle that has at least one stop.
+    """
+    nodes = data['nodes']
+    matrix = data['distance_matrix']
+    time_dimension = routing.GetDimensionOrDie("Time") if uses_time(data) else None
+
+    routes = []
+    for vehicle_id in range(data['num_vehicles']):
+        route_obj = schemas.SolutionRoute(vehicle_id=vehicle_id)
+        index = routing.Start(vehicle_id)
+        arrival = 0
+        previous_node = None
+
+        while not routing.IsEnd(index):
+            node_index = manager.IndexToNode(index)
+
+            # Without a time dimension, vehicles simply drive from stop to stop
+            if time_dimension is not None:
+                arrival = solution.Min(time_dimension.CumulVar(index))
+            elif previous_node is not None:
+                arrival += int(matrix[previous_node, node_index])
+            previous_node = node_index
+
+            if nodes[node_index] is not None:
+                route_obj.stops.append(solution_stop(data, node_index, arrival))
+
+            index = solution.Value(routing.NextVar(index))
+
+        if route_obj.stops:
+            routes.append(route_obj)
+
+    return schemas.Solution(routes=routes)
+
+
+def solution_stop(data, node_index, arrival_seconds=None):
+    """
+    Returns the SolutionStop of a pickup or drop node.
     """
+    ship_id, stop_type = data['nodes'][node_index]
+    loc_name = data['locations_map'][node_index]
+    coords = data['geocoded_locations'][loc_name]
+    return schemas.SolutionStop(
+        id=ship_id,
+        location=loc_name,
+        type=stop_type,
+        lat=coords['lat'],
+        lng=coords['lng'],
+        arrival_seconds=arrival_seconds,
+    )
+
+
+def add_route_geometry(data, solution: schemas.Solution, provider):
+    """
+    Fills in the leg polylines of each route of 'solution', depot to depot,
+    from the distance provider. A route whose geometry cannot be fetched
+    keeps no polylines (clients then draw straight lines).
+    """
+    coords = data['geocoded_locations']
     locations_map = data['locations_map']
-    geocoded_locations = data['geocoded_locations']
-
-    # Inside parse_solution:
-    shipment_lookup = {}
-    shipment_id_counter = 0
-    for i, loc_str in enumerate(locations_map):
-        if i == 0: continue # Skip depot
-
-        shipment_id = job.shipments[shipment_id_counter].id
-        coords = geocoded_locations[loc_str] # Get {lat, lng} <-- We already have this!
-
-        # --- THIS IS THE FIX ---
-        # Make sure 'coords' is stored in the tuple for BOTH pickup and drop
-        if (i % 2) == 1: # Odd index = origin
-            shipment_lookup[i] = (shipment_id, loc_str, "PICKUP", coords) # Now stores 4 values
-        else: # Even index = destination
-            shipment_lookup[i] = (shipment_id, loc_str, "DROP", coords) # Now stores 4 values
-            shipment_id_counter += 1
-    # --- END OF FIX ---
-    
-    route_obj = schemas.SolutionRoute()
-    index = routing.Start(0)
-    
-    while not routing.IsEnd(index):
-        node_index = manager.IndexToNode(index)
-        
-# Inside the 'while' loop in parse_solution:
-        if node_index != 0:
-            ship_id, loc_name, stop_type, coords = shipment_lookup[node_index]
-            route_obj.stops.append(schemas.SolutionStop(
-                id=ship_id,
-                location=loc_name,
-                type=stop_type,
-                # --- ADD THESE TWO LINES ---
-                lat=coords['lat'],
-                lng=coords['lng']
-                # --- END OF ADDITION ---
-            ))
-        
-        index = solution.Value(routing.NextVar(index))
-    
-    return schemas.Solution(routes=[route_obj])
\ No newline at end of file
+    for route in solution.routes:
+        points = [coords[locations_map[data['starts'][route.vehicle_id]]]]
+        points += [{'lat': stop.lat, 'lng': stop.lng} for stop in route.stops]
+        points.append(coords[locations_map[data['ends'][route.vehicle_id]]])
+        route.polylines = provider.route_polylines(points) or []
+
+
+def compact_solution(solution: schemas.Solution) -> schemas.CompactSolution:
+    """
+    Converts a Solution into its columnar form (schemas.CompactSolution).
+    """
+    compact = schemas.CompactSolution(
+        **solution.model_dump(exclude={'routes'})
+    )
+    location_index = {}
+    points = []
+    for route in solution.routes:
+        compact_route = schemas.CompactRoute(
+            vehicle_id=route.vehicle_id,
+            ids=[stop.id for stop in route.stops],
+            types="".join(stop.type[0] for stop in route.stops),
+            arrival_seconds=[stop.arrival_seconds for stop in route.stops],
+            polylines=route.polylines,
+        )
+        for stop in route.stops:
+            if stop.location not in location_index:
+                location_index[stop.location] = len(compact.locations)
+                compact.locations.append(stop.location)
+                points.append((stop.lat, stop.lng))
+            compact_route.locations.append(location_index[stop.location])
+        compact.routes.append(compact_route)
+    compact.coordinates = distance.encode_polyline(points)
+    return compact
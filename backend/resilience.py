@@ -0,0 +1,318 @@
+"""
+Client layer between the app and the Maps APIs: rate limiting, retries,
+circuit breaking and request coalescing.
+
+Every call to an API goes through that API's Guard (see maps_client),
+which:
+
+- coalesces identical calls already in flight (SingleFlight): concurrent
+  lookups of the same address or matrix tile share one upstream call;
+- waits for a token of the API's rate limit (TokenBucket); a quota error
+  pauses the bucket, so the other threads back off too;
+- retries transient errors (quota, unavailable, timeouts, 5xx) with
+  exponential backoff and full jitter;
+- fails fast while the API is down (CircuitBreaker): after
+  MAPS_BREAKER_FAILURES consecutive failed attempts, calls are rejected for
+  MAPS_BREAKER_RESET_SECONDS, then a single probe call is let through.
+  Quota errors don't count: the API is up, we're just too fast.
+
+A call that cannot succeed raises ServiceError, with the last error as its
+cause. Errors that retrying won't fix (invalid request, denied key) are
+raised as they are, on the first attempt.
+
+All of this state is per process. Rate limits are divided between the
+processes that call the APIs (maps_client.MAPS_PROCESSES), and coalescing
+only sees the calls of its own process; across processes, identical lookups
+are shared through the geocode store, the travel-time cache and batch
+solves (POST /jobs/solve:batch).
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from . import telemetry
+
+# Retries per call after the first attempt, and the backoff between them:
+# attempt n waits a random time up to min(MAX, BASE * 2^n) seconds
+MAPS_RETRIES = int(os.getenv("MAPS_RETRIES", 4))
+MAPS_BACKOFF_BASE_SECONDS = float(os.getenv("MAPS_BACKOFF_BASE_SECONDS", 0.5))
+MAPS_BACKOFF_MAX_SECONDS = float(os.getenv("MAPS_BACKOFF_MAX_SECONDS", 30))
+
+# Consecutive failed attempts that open the circuit, and how long it stays open
+MAPS_BREAKER_FAILURES = int(os.getenv("MAPS_BREAKER_FAILURES", 5))
+MAPS_BREAKER_RESET_SECONDS = float(os.getenv("MAPS_BREAKER_RESET_SECONDS", 30))
+
+# Statuses worth retrying: gRPC / google-api-core status names and the
+# status field of Geocoding API responses
+RETRYABLE_STATUSES = {
+    "RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL", "ABORTED",
+    "OVER_QUERY_LIMIT", "UNKNOWN_ERROR",
+}
+QUOTA_STATUSES = {"RESOURCE_EXHAUSTED", "OVER_QUERY_LIMIT"}
+
+
+class ServiceError(Exception):
+    """
+    An API call failed for good: retries ran out or the circuit is open.
+    """
+
+
+class CircuitOpenError(ServiceError):
+    pass
+
+
+def _status(error):
+    """
+    Returns (status name, HTTP status code) of an API error, either of
+    which may be None.
+    """
+    # googlemaps.exceptions.ApiError carries the response's status string
+    status = getattr(error, "status", None)
+    # google.api_core.exceptions.GoogleAPICallError carries the HTTP code,
+    # googlemaps.exceptions.HTTPError a status_code
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        code = getattr(error, "status_code", None)
+    grpc_status = getattr(error, "grpc_status_code", None)
+    if not isinstance(status, str) and grpc_status is not None:
+        status = grpc_status.name
+    return (status if isinstance(status, str) else None), (code if isinstance(code, int) else None)
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether an error is transient, i.e. the same call may succeed later.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # googlemaps' own transport errors (connection reset, timeout)
+    if type(error).__name__ in ("Timeout", "TransportError"):
+        return True
+    status, code = _status(error)
+    if status is not None and status in RETRYABLE_STATUSES:
+        return True
+    return code is not None and (code == 429 or code >= 500)
+
+
+def is_quota_error(error: Exception) -> bool:
+    status, code = _status(error)
+    return status in QUOTA_STATUSES or code == 429
+
+
+def describe(error: Exception) -> str:
+    return str(error) or type(error).__name__
+
+
+def backoff_seconds(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff before retry number 'attempt' (from 0).
+    """
+    return random.uniform(0, min(MAPS_BACKOFF_MAX_SECONDS, MAPS_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+#==============================================================================
+# Building blocks
+#==============================================================================
+
+class TokenBucket:
+    """
+    Rate limiter shared by all threads of a process: 'rate' tokens per
+    second accumulate up to 'capacity', and every call takes its cost in
+    tokens, waiting if there aren't enough. A rate of 0 means no limit.
+
+    A call costlier than the whole bucket waits for a full bucket, then
+    takes its full cost: the bucket goes into debt, and the calls after it
+    wait until the rate has paid it back.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cost: float = 1.0):
+        if self.rate <= 0:
+            return
+        needed = min(cost, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.updated:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= needed:
+                        self.tokens -= cost
+                        return
+                    wait = (needed - self.tokens) / self.rate
+                else:
+                    # Paused after a quota error
+                    wait = self.updated - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Empties the bucket (keeping any debt) and stops it refilling for
+        'seconds'.
+        """
+        with self.lock:
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """
+    Opens after 'failures' consecutive failed attempts; while open, calls
+    are rejected. After 'reset_seconds' one probe call is let through: its
+    success closes the circuit, its failure opens it again, and a probe that
+    tells neither (see release_probe) lets the next call probe instead.
+    """
+
+    def __init__(self, name: str, failures: int, reset_seconds: float):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def check(self):
+        """
+        Raises CircuitOpenError if the call may not go ahead.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.probing or time.monotonic() - self.opened_at < self.reset_seconds:
+                telemetry.count("maps_api_rejected")
+                raise CircuitOpenError(f"{self.name} is unavailable; not retrying for now")
+            self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"{self.name} is back; closing its circuit.")
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.opened_at is not None or self.consecutive_failures >= self.failures:
+                if self.opened_at is None:
+                    print(
+                        f"{self.name} failed {self.consecutive_failures} times in a row; "
+                        f"rejecting calls for {self.reset_seconds:.0f}s."
+                    )
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release_probe(self):
+        """
+        Ends a call that says nothing about the API's health, so that if
+        it was the probe, the next call may probe.
+        """
+        with self.lock:
+            self.probing = False
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; callers that ask for a key
+    already in flight wait for that call and share its result or error.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            telemetry.count("maps_api_coalesced")
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+#==============================================================================
+# Guard
+#==============================================================================
+
+class Guard:
+    """
+    Everything between callers and one API: coalescing, rate limiting,
+    retries and circuit breaking. 'rate' is in tokens per second, with room
+    for bursts of 'burst' tokens.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name, MAPS_BREAKER_FAILURES, MAPS_BREAKER_RESET_SECONDS)
+        self.flights = SingleFlight()
+
+    def call(self, fn, key=None, cost: float = 1.0):
+        """
+        Returns fn(). Calls with the same (hashable) 'key' that overlap in
+        time share one fn() call; 'cost' is what the call takes from the
+        rate limit (e.g. elements of a matrix).
+        """
+        if key is None:
+            return self._call(fn, cost)
+        return self.flights.do(key, lambda: self._call(fn, cost))
+
+    def _call(self, fn, cost: float):
+        for attempt in range(MAPS_RETRIES + 1):
+            self.breaker.check()
+            self.bucket.acquire(cost)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    if _status(e) != (None, None):
+                        # The API answered; the request itself is wrong
+                        self.breaker.record_success()
+                    else:
+                        # Not an API error, e.g. a bug in handling the response
+                        self.breaker.release_probe()
+                    raise
+                telemetry.count("maps_api_errors")
+                if is_quota_error(e):
+                    # The API is up but we're over quota: hold back every
+                    # call of this process instead of opening the circuit
+                    self.breaker.record_success()
+                    self.bucket.pause(min(MAPS_BACKOFF_MAX_SECONDS, MAPS_BACKOFF_BASE_SECONDS * 2 ** attempt))
+                else:
+                    self.breaker.record_failure()
+                if attempt == MAPS_RETRIES:
+                    raise ServiceError(
+                        f"{self.name} failed after {attempt + 1} attempts: {describe(e)}"
+                    ) from e
+                delay = backoff_seconds(attempt)
+                telemetry.count("maps_api_retries")
+                print(f"{self.name} call failed ({describe(e)}); retrying in {delay:.1f}s...")
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
@@ -1,6 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
+
+# Longest span of time the solver plans routes over, in seconds
+TIME_HORIZON_SECONDS = 7 * 24 * 3600
 
 #==============================================================================
 # Shipment Schemas
@@ -15,6 +18,24 @@ class ShipmentBase(BaseModel):
     destination: str
     weight: float
 
+    # Optional time windows, in seconds from the start of the working day
+    # (when vehicles leave the depot), and time spent at each stop
+    pickup_window_start: Optional[int] = Field(None, ge=0, le=TIME_HORIZON_SECONDS)
+    pickup_window_end: Optional[int] = Field(None, ge=0, le=TIME_HORIZON_SECONDS)
+    delivery_window_start: Optional[int] = Field(None, ge=0, le=TIME_HORIZON_SECONDS)
+    delivery_window_end: Optional[int] = Field(None, ge=0, le=TIME_HORIZON_SECONDS)
+    pickup_service_seconds: int = Field(0, ge=0)
+    delivery_service_seconds: int = Field(0, ge=0)
+
+    @model_validator(mode="after")
+    def check_time_windows(self):
+        for stop in ("pickup", "delivery"):
+            start = getattr(self, f"{stop}_window_start")
+            end = getattr(self, f"{stop}_window_end")
+            if start is not None and end is not None and start > end:
+                raise ValueError(f"{stop}_window_start is after {stop}_window_end")
+        return self
+
 class ShipmentCreate(ShipmentBase):
     """
     Schema for creating a new Shipment.
@@ -30,11 +51,32 @@ class Shipment(ShipmentBase):
     id: int
     job_id: int
 
+    # Filled in asynchronously once the addresses have been geocoded
+    origin_lat: Optional[float] = None
+    origin_lng: Optional[float] = None
+    destination_lat: Optional[float] = None
+    destination_lng: Optional[float] = None
+
     class Config:
         # Enables ORM (Object-Relational Mapping) mode.
         # Tells Pydantic to read data from SQLAlchemy model attributes.
         from_attributes = True
 
+class BulkRowError(BaseModel):
+    """
+    A row of a bulk shipment upload that failed validation.
+    Rows are numbered from 1, not counting a CSV header.
+    """
+    row: int
+    error: str
+
+class BulkShipmentResult(BaseModel):
+    """
+    Result of a bulk shipment upload.
+    """
+    inserted: int
+    errors: List[BulkRowError] = []
+
 #==============================================================================
 # Job Schemas
 #==============================================================================
@@ -42,9 +84,17 @@ class Shipment(ShipmentBase):
 class JobBase(BaseModel):
     """
     Base Pydantic schema for a Job.
+    Includes the fleet the job is dispatched with.
     """
     status: Optional[str] = "pending"
 
+    num_vehicles: int = Field(1, ge=1)
+    vehicle_capacity: Optional[float] = Field(None, gt=0)  # kg per vehicle; None = unlimited
+    depot_address: Optional[str] = None  # None = the default depot
+    end_depot_address: Optional[str] = None  # None = return to the start depot
+    # Source of coordinates and travel times; None = the server default
+    distance_provider: Optional[Literal["google", "local"]] = None
+
 class JobCreate(JobBase):
     """
     Schema for creating a new Job.
@@ -59,6 +109,7 @@ class Job(JobBase):
     id: int
     created_at: datetime
     updated_at: Optional[datetime]
+    error: Optional[str] = None
     
     # This automatically nests the related Shipment objects
     # using the 'Shipment' read schema.
@@ -68,6 +119,96 @@ class Job(JobBase):
         from_attributes = True
 
 
+class JobSummary(JobBase):
+    """
+    Schema for listing Jobs without their shipments (GET /jobs/?summary=true).
+    Carries aggregated shipment totals instead of the nested list.
+    """
+    id: int
+    created_at: datetime
+    updated_at: Optional[datetime]
+    error: Optional[str] = None
+    shipment_count: int = 0
+    total_weight: float = 0.0
+
+    class Config:
+        from_attributes = True
+
+
+#==============================================================================
+# Solve Option Schemas
+#==============================================================================
+
+# OR-Tools strategy names accepted in SolveOptions
+FirstSolutionStrategy = Literal[
+    "AUTOMATIC",
+    "PATH_CHEAPEST_ARC",
+    "PATH_MOST_CONSTRAINED_ARC",
+    "SAVINGS",
+    "CHRISTOFIDES",
+    "BEST_INSERTION",
+    "PARALLEL_CHEAPEST_INSERTION",
+    "SEQUENTIAL_CHEAPEST_INSERTION",
+    "LOCAL_CHEAPEST_INSERTION",
+    "GLOBAL_CHEAPEST_ARC",
+    "LOCAL_CHEAPEST_ARC",
+]
+LocalSearchMetaheuristic = Literal[
+    "AUTOMATIC",
+    "GREEDY_DESCENT",
+    "GUIDED_LOCAL_SEARCH",
+    "SIMULATED_ANNEALING",
+    "TABU_SEARCH",
+    "GENERIC_TABU_SEARCH",
+]
+
+class SolveOptions(BaseModel):
+    """
+    Optional body of POST /jobs/{job_id}/solve.
+    A profile picks sensible search settings for a latency/quality trade-off;
+    any explicit field overrides the profile's value.
+    """
+    profile: Literal["fast", "balanced", "thorough"] = "balanced"
+
+    first_solution_strategy: Optional[FirstSolutionStrategy] = None
+    local_search_metaheuristic: Optional[LocalSearchMetaheuristic] = None
+    time_limit_seconds: Optional[float] = Field(None, gt=0)
+    solution_limit: Optional[int] = Field(None, ge=1)
+    # Searches run in parallel with different first-solution strategies;
+    # the best result wins. Capped by the server's cores per solve.
+    num_search_workers: Optional[int] = Field(None, ge=1, le=16)
+    # Solve large jobs as parallel geographic clusters; None = by job size
+    decompose: Optional[bool] = None
+    # Cost per second of the longest route, on top of the total travel time:
+    # higher values spread shipments more evenly over the fleet; 0 = none
+    span_cost_coefficient: Optional[int] = Field(None, ge=0, le=1000)
+
+
+class BatchSolveRequest(BaseModel):
+    """
+    Body of POST /jobs/solve:batch. 'options' and 'force' apply to every job
+    and mean the same as for POST /jobs/{job_id}/solve.
+    """
+    job_ids: List[int] = Field(..., min_length=1, max_length=500)
+    options: Optional[SolveOptions] = None
+    force: bool = False
+
+
+class BatchSolveJob(BaseModel):
+    """
+    What happened to one job of a batch solve request.
+    'status' is the job's status after the request ("queued" when queued,
+    "completed" when its stored solution is current) or "not_found".
+    """
+    job_id: int
+    status: str
+    detail: Optional[str] = None
+
+
+class BatchSolveResult(BaseModel):
+    jobs: List[BatchSolveJob]
+
+
 #==============================================================================
 # Solution Schemas
 #==============================================================================
@@ -86,15 +227,90 @@ class SolutionStop(BaseModel):
     lng: float
     # --- END OF ADDITION ---
 
+    # When the vehicle arrives, in seconds from the start of the working day
+    arrival_seconds: Optional[int] = None
+
 class SolutionRoute(BaseModel):
     """
     Represents the complete route for a single vehicle.
     """
+    vehicle_id: int = 0
     stops: List[SolutionStop] = []
 
+    # Road geometry of each leg (start depot -> first stop, ..., last stop ->
+    # end depot) as encoded polylines; empty if it could not be fetched
+    polylines: List[str] = []
+
 class Solution(BaseModel):
     """
     The final solution response, containing all routes.
-    For our simple VRP, we'll only have one route.
+    There is one route per vehicle that was given at least one shipment.
+    """
+    routes: List[SolutionRoute] = []
+
+    # Total travel time of all routes (the solver's objective), the search
+    # profile used, how long the whole solve took, and whether it was an
+    # incremental re-solve seeded from the job's previous solution
+    objective: Optional[int] = None
+    profile: Optional[str] = None
+    wall_time_seconds: Optional[float] = None
+    incremental: bool = False
+
+    # Whether the search was cut short by POST /jobs/{job_id}/stop
+    stopped: bool = False
+
+    # Seconds spent in each phase of the solve (geocoding, matrix, search,
+    # ...) and what it did (see telemetry.COUNTERS)
+    phase_seconds: Dict[str, float] = {}
+    counters: Dict[str, int] = {}
+
+class CompactRoute(BaseModel):
+    """
+    A SolutionRoute in columnar form: one list per stop attribute, with
+    locations given as indices into CompactSolution.locations and stop
+    types as one character per stop ("P" pickup, "D" drop).
     """
-    routes: List[SolutionRoute] = []
\ No newline at end of file
+    vehicle_id: int = 0
+    ids: List[int] = []
+    types: str = ""
+    locations: List[int] = []
+    arrival_seconds: List[Optional[int]] = []
+    polylines: List[str] = []
+
+class CompactSolution(BaseModel):
+    """
+    A Solution in compact form (GET /jobs/{job_id}/solution?format=compact).
+    Every distinct location is listed once; 'coordinates' holds their
+    positions, in the same order, as one encoded polyline (~1 m precision).
+    """
+    locations: List[str] = []
+    coordinates: str = ""
+    routes: List[CompactRoute] = []
+
+    objective: Optional[int] = None
+    profile: Optional[str] = None
+    wall_time_seconds: Optional[float] = None
+    incremental: bool = False
+    stopped: bool = False
+    phase_seconds: Dict[str, float] = {}
+    counters: Dict[str, int] = {}
+
+class SolveProgress(BaseModel):
+    """
+    Progress of a running search, published by the solve worker.
+    'routes' are those of the best solution so far, without arrival times.
+    """
+    objective: Optional[int] = None
+    solutions: int = 0
+    elapsed_seconds: float = 0.0
+    routes: List[SolutionRoute] = []
+
+class JobProgress(BaseModel):
+    """
+    One event of GET /jobs/{job_id}/events.
+    """
+    job_id: int
+    status: str
+    error: Optional[str] = None
+    stop_requested: bool = False
+    progress: Optional[SolveProgress] = None
@@ -0,0 +1,205 @@
+"""
+Instrumentation of the solve path: per-phase timings and counters.
+
+Every solve records how long each phase took (geocoding, matrix,
+build_model, search, parse, ...) and counts what it did (matrix elements
+requested, cache hits, API errors, search branches, ...). The figures of a
+solve and its objective are attached to its Solution, and are also
+exported as:
+
+- Prometheus metrics, served by GET /metrics, when prometheus_client is
+  installed. Solves run in worker processes, so set PROMETHEUS_MULTIPROC_DIR
+  to an empty directory to aggregate their metrics.
+- OpenTelemetry spans, one per phase, when opentelemetry is installed;
+  they go wherever the OpenTelemetry SDK is configured to send them.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Counters, by name, with their descriptions
+COUNTERS = {
+    "geocode_requests": "Addresses sent to the Geocoding API",
+    "matrix_elements_requested": "Origin/destination pairs requested from the Routes API",
+    "route_requests": "Routes requested from the Routes API for their geometry",
+    "matrix_cache_hits": "Travel times served from the travel-time cache",
+    "matrix_cache_misses": "Travel times missing from the travel-time cache",
+    "maps_api_errors": "Failed Geocoding or Routes API calls",
+    "maps_api_retries": "Geocoding or Routes API calls retried after a transient error",
+    "maps_api_coalesced": "Maps API lookups served by an identical call already in flight",
+    "maps_api_rejected": "Maps API calls rejected while the API's circuit was open",
+    "search_branches": "Branches explored by the OR-Tools search",
+    "search_failures": "Failures encountered by the OR-Tools search",
+    "search_accepted_neighbors": "Local search moves accepted by the OR-Tools search",
+    "solves_completed": "Jobs solved",
+    "solves_failed": "Jobs that failed to solve",
+}
+
+_phase_histogram = None
+_objective_histogram = None
+_counters = {}
+if prometheus_client is not None:
+    _phase_histogram = prometheus_client.Histogram(
+        "logiopt_solve_phase_seconds",
+        "Time spent in each phase of a solve",
+        ["phase"],
+        buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+    )
+    # Objectives are mostly travel seconds, from a few minutes of driving
+    # to a fleet's full day
+    _objective_histogram = prometheus_client.Histogram(
+        "logiopt_solve_objective",
+        "Objective value of the solutions found, by solver profile",
+        ["profile"],
+        buckets=(1e3, 3e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7),
+    )
+    _counters = {
+        name: prometheus_client.Counter(f"logiopt_{name}", description)
+        for name, description in COUNTERS.items()
+    }
+
+_tracer = trace.get_tracer("logiopt.solve") if trace is not None else None
+
+
+class SolveStats:
+    """
+    Timings (seconds per phase) and counters of one solve.
+    """
+
+    def __init__(self):
+        self.phase_seconds = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add_time(self, phase: str, seconds: float):
+        with self.lock:
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    def add_count(self, name: str, value: int):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+# The solve this process is working on. Worker processes solve one job at a
+# time; counts recorded outside a solve only go to Prometheus.
+_current = None
+
+
+def start_solve() -> SolveStats:
+    """
+    Starts collecting the timings and counters of a new solve.
+    """
+    global _current
+    _current = SolveStats()
+    return _current
+
+
+def finish_solve():
+    global _current
+    _current = None
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Times a phase of the current solve, inside an OpenTelemetry span if
+    OpenTelemetry is installed.
+    """
+    span = _tracer.start_as_current_span(f"solve.{name}") if _tracer is not None else nullcontext()
+    started = time.perf_counter()
+    with span:
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if _current is not None:
+                _current.add_time(name, elapsed)
+            if _phase_histogram is not None:
+                _phase_histogram.labels(phase=name).observe(elapsed)
+
+
+def count(name: str, value: int = 1):
+    """
+    Adds 'value' to one of the COUNTERS.
+    """
+    if value <= 0:
+        return
+    if _current is not None:
+        _current.add_count(name, value)
+    if name in _counters:
+        _counters[name].inc(value)
+
+
+def search_counts(solver) -> dict:
+    """
+    Returns the search counters of a finished OR-Tools search (a
+    pywrapcp.Solver), for searches run in another process to report back.
+    """
+    return {
+        "search_branches": solver.Branches(),
+        "search_failures": solver.Failures(),
+        "search_accepted_neighbors": solver.AcceptedNeighbors(),
+    }
+
+
+def record_search(solver):
+    """
+    Counts the work of a finished OR-Tools search (a pywrapcp.Solver).
+    """
+    record_counts(search_counts(solver))
+
+
+def record_counts(counts: dict):
+    """
+    Adds counts by name, e.g. those returned by search_counts.
+    """
+    for name, value in counts.items():
+        count(name, value)
+
+
+def record_objective(profile: str, objective: float):
+    """
+    Records the objective of a solution found with solver 'profile'.
+    """
+    if _objective_histogram is not None:
+        _objective_histogram.labels(profile=profile).observe(objective)
+
+
+def metrics_response():
+    """
+    Returns (body, content type) of the Prometheus metrics exposition,
+    or None if prometheus_client is not installed.
+    """
+    if prometheus_client is None:
+        return None
+    from prometheus_client import multiprocess
+
+    registry = prometheus_client.REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def instrument_app(app):
+    """
+    Adds OpenTelemetry request spans to the FastAPI app, if
+    opentelemetry-instrumentation-fastapi is installed.
+    """
+    try:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    except ImportError:
+        return
+    FastAPIInstrumentor.instrument_app(app)
@@ -0,0 +1,81 @@
+"""
+Tests of the routing model on hand-built data models (no database or
+distance provider): travel times are straight-line distances.
+
+    python -m pytest -q backend/tests
+"""
+
+import os
+
+# The backend modules read DATABASE_URL at import; nothing here uses it
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import random
+
+import numpy as np
+
+from backend import optimization
+
+
+def make_data(num_shipments, num_vehicles, seed=0):
+    """
+    A data model of 'num_shipments' random shipments around a depot at
+    node 0, served by vehicles without capacity limits.
+    """
+    rng = random.Random(seed)
+    points = np.array([(0.5, 0.5)] + [(rng.random(), rng.random()) for _ in range(2 * num_shipments)])
+    offsets = points[:, None, :] - points[None, :, :]
+    matrix = (np.hypot(offsets[..., 0], offsets[..., 1]) * 3600).astype(np.int32)
+    num_nodes = len(points)
+    return {
+        'distance_matrix': matrix,
+        'pickups_deliveries': [[1 + 2 * k, 2 + 2 * k] for k in range(num_shipments)],
+        'num_vehicles': num_vehicles,
+        'starts': [0] * num_vehicles,
+        'ends': [0] * num_vehicles,
+        'demands': [0] + [1, -1] * num_shipments,
+        'vehicle_capacities': None,
+        'time_windows': [None] * num_nodes,
+        'service_times': [0] * num_nodes,
+    }
+
+
+def used_vehicles(data, settings):
+    manager, routing, solution = optimization.solve_data_model(data, settings)
+    assert solution is not None
+    routes = optimization.assignment_routes(manager, routing, solution)
+    return sum(1 for route in routes if route)
+
+
+def fast_settings(**overrides):
+    settings = optimization.resolve_solve_settings()
+    return dict(
+        settings,
+        first_solution_strategy="PATH_CHEAPEST_ARC",
+        local_search_metaheuristic="GREEDY_DESCENT",
+        time_limit_seconds=1.0,
+        num_search_workers=1,
+        **overrides,
+    )
+
+
+def test_span_cost_spreads_shipments_over_the_fleet():
+    data = make_data(num_shipments=8, num_vehicles=3)
+    data['span_cost_coefficient'] = 1
+    assert used_vehicles(data, fast_settings()) > 1
+
+
+def test_without_span_cost_one_vehicle_does_everything():
+    data = make_data(num_shipments=8, num_vehicles=3)
+    data['span_cost_coefficient'] = 0
+    assert used_vehicles(data, fast_settings()) == 1
+
+
+def test_search_routes_reports_its_search_counters():
+    data = make_data(num_shipments=4, num_vehicles=2)
+    objective, routes, counts = optimization.search_routes(
+        optimization.solver_inputs(data), fast_settings(),
+    )
+    assert objective is not None
+    assert sorted(node for route in routes for node in route) == list(range(1, 9))
+    assert counts["search_branches"] > 0
@@ -0,0 +1,209 @@
+"""
+Unit tests for the rate limiter and circuit breaker of resilience.py, on a
+fake clock: sleeping advances it instead of waiting.
+
+    python -m pytest -q backend/tests
+"""
+
+import pytest
+
+from backend import resilience
+
+
+class FakeClock:
+    # Rates and costs below are powers of two, so waits add up exactly
+    def __init__(self):
+        self.now = 1024.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+#==============================================================================
+# TokenBucket
+#==============================================================================
+
+def test_bucket_starts_full(clock):
+    bucket = resilience.TokenBucket(rate=8, capacity=4)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.slept == 0
+
+
+def test_bucket_waits_for_tokens(clock):
+    bucket = resilience.TokenBucket(rate=8, capacity=4)
+    bucket.acquire(4)
+    bucket.acquire(2)
+    assert clock.slept == 0.25
+
+
+def test_bucket_refills_up_to_capacity(clock):
+    bucket = resilience.TokenBucket(rate=8, capacity=4)
+    bucket.acquire(4)
+    clock.now += 64
+    bucket.acquire(4)
+    bucket.acquire(1)
+    assert clock.slept == 0.125
+
+
+def test_bucket_charges_calls_above_capacity_in_full(clock):
+    bucket = resilience.TokenBucket(rate=8, capacity=4)
+    # Goes ahead on a full bucket, but leaves it 12 tokens short
+    bucket.acquire(16)
+    assert clock.slept == 0
+    # The next call waits until the debt is paid back and its own tokens are in
+    bucket.acquire(4)
+    assert clock.slept == 2
+
+
+def test_bucket_keeps_the_long_run_rate(clock):
+    bucket = resilience.TokenBucket(rate=8, capacity=4)
+    for _ in range(8):
+        bucket.acquire(16)
+    # 128 tokens at 8 per second, less the 4 the bucket started with; the
+    # last call's debt is left for whoever comes next
+    assert clock.slept == (128 - 4 - 12) / 8
+
+
+def test_bucket_pause_stops_refilling(clock):
+    bucket = resilience.TokenBucket(rate=8, capacity=4)
+    bucket.pause(2)
+    bucket.acquire(2)
+    assert clock.slept == 2.25
+
+
+def test_bucket_pause_keeps_debt(clock):
+    bucket = resilience.TokenBucket(rate=8, capacity=4)
+    bucket.acquire(8)
+    bucket.pause(1)
+    bucket.acquire(2)
+    assert clock.slept == 1.75
+
+
+def test_bucket_without_rate_never_waits(clock):
+    bucket = resilience.TokenBucket(rate=0, capacity=1)
+    for _ in range(100):
+        bucket.acquire(10)
+    assert clock.slept == 0
+
+
+#==============================================================================
+# CircuitBreaker
+#==============================================================================
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = resilience.CircuitBreaker("API", failures=3, reset_seconds=30)
+    for _ in range(2):
+        breaker.check()
+        breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.check()
+
+
+def test_breaker_success_resets_the_count(clock):
+    breaker = resilience.CircuitBreaker("API", failures=3, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.check()
+
+
+def test_breaker_lets_one_probe_through_after_reset(clock):
+    breaker = resilience.CircuitBreaker("API", failures=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 29
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.check()
+    clock.now += 1
+    breaker.check()
+    # Only the probe goes ahead until it returns
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.check()
+
+
+def test_breaker_closes_on_probe_success(clock):
+    breaker = resilience.CircuitBreaker("API", failures=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.check()
+    breaker.record_success()
+    breaker.check()
+    breaker.check()
+
+
+def test_breaker_reopens_on_probe_failure(clock):
+    breaker = resilience.CircuitBreaker("API", failures=2, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 30
+    breaker.check()
+    # One failed probe is enough, and the reset starts over
+    breaker.record_failure()
+    clock.now += 29
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.check()
+    clock.now += 1
+    breaker.check()
+
+
+#==============================================================================
+# Guard
+#==============================================================================
+
+class QuotaError(Exception):
+    status = "OVER_QUERY_LIMIT"
+
+
+def open_guard(clock, monkeypatch):
+    """
+    A guard without retries whose circuit is open, and due for a probe.
+    """
+    monkeypatch.setattr(resilience, "MAPS_RETRIES", 0)
+    guard = resilience.Guard("API", rate=0, burst=1)
+    for _ in range(guard.breaker.failures):
+        guard.breaker.record_failure()
+    clock.now += guard.breaker.reset_seconds
+    return guard
+
+
+def test_guard_quota_error_on_probe_closes_the_circuit(clock, monkeypatch):
+    guard = open_guard(clock, monkeypatch)
+
+    def over_quota():
+        raise QuotaError("over quota")
+
+    with pytest.raises(resilience.ServiceError):
+        guard.call(over_quota)
+    # The API answered: calls go ahead, and are no longer held as probes
+    assert guard.call(lambda: 1) == 1
+    assert guard.call(lambda: 2) == 2
+
+
+def test_guard_non_api_error_on_probe_lets_the_next_call_probe(clock, monkeypatch):
+    guard = open_guard(clock, monkeypatch)
+
+    def broken():
+        raise ValueError("not an API error")
+
+    with pytest.raises(ValueError):
+        guard.call(broken)
+    # Says nothing about the API: the circuit stays open, but isn't stuck
+    assert guard.breaker.opened_at is not None
+    assert guard.call(lambda: 1) == 1
+    assert guard.breaker.opened_at is None
@@ -0,0 +1,332 @@
+"""
+Background solve pipeline.
+
+POST /jobs/{job_id}/solve only enqueues the job; the solve itself runs on a
+pool of worker processes (OR-Tools holds the GIL for the whole search, so
+threads would not help). Each worker opens its own database session, moves
+the job through its status phases and stores the solution on the job.
+
+While the search runs, the worker also publishes its progress (best
+objective and routes so far) on the job row, where GET /jobs/{job_id}/events
+picks it up, and reads back stop requests from POST /jobs/{job_id}/stop.
+
+If a worker process dies, the pool is replaced and the jobs it was running
+or holding are marked failed; jobs still queued or running when the API
+restarts are marked failed on startup (see crud.fail_interrupted_jobs).
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+
+from . import crud, distance, matrix_cache, models, optimization, schemas, telemetry
+from .database import SessionLocal
+
+# Number of solver processes (default: one per CPU)
+SOLVE_WORKERS = int(os.getenv("SOLVE_WORKERS", os.cpu_count() or 1))
+
+# A queued or running job whose row hasn't changed for this long, in
+# seconds, is presumed orphaned: POST /jobs/{job_id}/solve?force=true may
+# queue it again. Running searches write their progress every second.
+STALE_JOB_SECONDS = int(os.getenv("STALE_JOB_SECONDS", 900))
+
+# How often a running search writes its progress to the database (and
+# checks for stop requests), and how often GET /jobs/{job_id}/events reads it
+PROGRESS_INTERVAL_SECONDS = float(os.getenv("PROGRESS_INTERVAL_SECONDS", 1.0))
+PROGRESS_POLL_SECONDS = float(os.getenv("PROGRESS_POLL_SECONDS", 0.5))
+# The search polls for a stop hundreds of thousands of times a second; only
+# every this many polls looks at the clock
+PROGRESS_CHECK_CALLS = 1000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Returns the shared worker pool, creating it on first use.
+    Workers are spawned rather than forked so they never inherit the API
+    process's database connections or gRPC channels.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=SOLVE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=optimization.start_search_pool,
+            )
+        return _executor
+
+
+def shutdown():
+    """
+    Stops the worker pool. Jobs that have not started yet are dropped.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _submit(fn, *args):
+    """
+    Submits fn(*args) to the worker pool. A pool one of whose workers died
+    (killed, out of memory, crashed in native code) refuses all work, so
+    it is replaced by a new one and the call submitted there.
+    """
+    global _executor
+    executor = get_executor()
+    try:
+        return executor.submit(fn, *args)
+    except BrokenProcessPool:
+        with _executor_lock:
+            if _executor is executor:
+                print("A solve worker died; starting a new worker pool.")
+                executor.shutdown(wait=False)
+                _executor = None
+        return get_executor().submit(fn, *args)
+
+
+def is_stale(db_job) -> bool:
+    """
+    Whether a queued or running job has shown no sign of life for
+    STALE_JOB_SECONDS (see there).
+    """
+    changed = db_job.updated_at or db_job.created_at
+    if changed is None:
+        return True
+    if changed.tzinfo is None:
+        # SQLite returns the UTC timestamps it stores without a zone
+        changed = changed.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - changed).total_seconds() > STALE_JOB_SECONDS
+
+
+def enqueue_solve(job_id: int, settings: dict, incremental: bool = True, shared=None):
+    """
+    Schedules a solve of the given job on the worker pool, with resolved
+    solve settings (see optimization.resolve_solve_settings). Unless
+    'incremental' is False, the job's stored solution seeds the search.
+    'shared' are the job's locations prepared with a batch (see
+    prepare_batch).
+    """
+    future = _submit(run_solve, job_id, settings, incremental, shared)
+    if shared is not None:
+        # The solve has its own copy of the job's part of the batch matrix
+        future.add_done_callback(lambda future: matrix_cache.release_matrix(shared['matrix_file']))
+    future.add_done_callback(lambda future: _fail_crashed_solve(job_id, future))
+    return future
+
+
+def _fail_crashed_solve(job_id: int, future):
+    """
+    Marks a job failed if its solve never returned: run_solve handles its
+    own errors, so an exception here means the worker process died.
+    """
+    if future.cancelled() or future.exception() is None:
+        return
+    print(f"Solve worker crashed on job {job_id}: {future.exception()}")
+    telemetry.count("solves_failed")
+    with SessionLocal() as db:
+        crud.update_job_status(
+            db, job_id=job_id, status="failed",
+            error=f"The solve worker crashed: {future.exception()}",
+        )
+
+
+class SolveStopped(Exception):
+    """
+    A stop was requested before the search started: there is no solution
+    to keep.
+    """
+
+
+class ProgressReporter:
+    """
+    Publishes the progress of a job's search on its row, at most every
+    PROGRESS_INTERVAL_SECONDS, and stops the search once a stop has been
+    requested and a solution found (see optimization.watch_search).
+    """
+
+    def __init__(self, db, job_id: int):
+        self.db = db
+        self.job_id = job_id
+        self.started = time.monotonic()
+        self.next_update = self.started
+        self.next_routes = self.started
+        self.progress = schemas.SolveProgress()
+        self.requested = False
+        self.stopped = False
+        self.countdown = PROGRESS_CHECK_CALLS
+
+    def improved(self, objective: int, routes):
+        self.progress.solutions += 1
+        # A stop requested during a decomposition ends the search at its
+        # first solution
+        self.stopped = self.requested
+        now = time.monotonic()
+        if now >= self.next_routes:
+            # The objective and routes published are always of one solution
+            self.progress.objective = objective
+            self.progress.routes = routes()
+            self.next_routes = now + PROGRESS_INTERVAL_SECONDS
+            self._publish()
+
+    def should_stop(self) -> bool:
+        self.countdown -= 1
+        if self.countdown > 0:
+            return self.stopped
+        self.countdown = PROGRESS_CHECK_CALLS
+        if not self.stopped and time.monotonic() >= self.next_update:
+            self._publish()
+        return self.stopped
+
+    def stop_requested(self) -> bool:
+        """
+        Whether a stop has been requested, solution or not, for the searches
+        that don't report here (see optimization.wait_searches). Reads the
+        job row at most every PROGRESS_INTERVAL_SECONDS.
+        """
+        if not self.requested and time.monotonic() >= self.next_update:
+            self._publish()
+        return self.requested
+
+    def _publish(self):
+        now = time.monotonic()
+        self.progress.elapsed_seconds = round(now - self.started, 3)
+        db_job = crud.save_job_progress(self.db, job_id=self.job_id, progress=self.progress)
+        self.requested = db_job is not None and bool(db_job.stop_requested)
+        # Stopping before the first solution would leave nothing to keep
+        if self.requested and self.progress.solutions > 0:
+            self.stopped = True
+        self.next_update = now + PROGRESS_INTERVAL_SECONDS
+
+
+def run_solve(job_id: int, settings: dict, incremental: bool = True, shared=None):
+    """
+    Solves one job. Runs inside a worker process.
+    """
+    with SessionLocal() as db:
+        db_job = crud.get_job(db, job_id=job_id)
+        if db_job is None:
+            print(f"Job {job_id} disappeared before it could be solved.")
+            return
+
+        def on_phase(status):
+            db_job = crud.update_job_status(db, job_id=job_id, status=status)
+            # Until the search starts, a stop ends the solve between phases
+            if db_job is not None and db_job.stop_requested:
+                raise SolveStopped()
+
+        # Fingerprint the inputs before solving, so shipments added while the
+        # solve runs correctly mark the stored solution as stale
+        fingerprint = optimization.job_fingerprint(db_job, settings)
+
+        previous_solution = None
+        if incremental and db_job.solution is not None:
+            previous_solution = schemas.Solution.model_validate_json(db_job.solution)
+
+        progress = ProgressReporter(db, job_id)
+        try:
+            solution = optimization.solve_vrp(
+                db_job, on_phase=on_phase, settings=settings,
+                previous_solution=previous_solution, shared=shared,
+                progress=progress,
+            )
+        except SolveStopped:
+            print(f"Job {job_id} stopped before its search started.")
+            crud.update_job_status(
+                db, job_id=job_id, status="failed",
+                error="Stopped before a solution was found",
+            )
+            return
+        except Exception as e:
+            print(f"Error solving job {job_id}: {e}")
+            telemetry.count("solves_failed")
+            crud.update_job_status(db, job_id=job_id, status="failed", error=str(e))
+            return
+
+        if not solution:
+            telemetry.count("solves_failed")
+            crud.update_job_status(
+                db, job_id=job_id, status="failed",
+                error="Optimization failed to find a solution",
+            )
+            return
+
+        solution.stopped = progress.stopped
+        telemetry.count("solves_completed")
+        crud.save_job_solution(db, job_id=job_id, solution=solution, fingerprint=fingerprint)
+
+
+def enqueue_batch(job_ids: list[int], settings: dict, incremental: bool = True):
+    """
+    Schedules the solves of a batch of jobs (POST /jobs/solve:batch): their
+    locations are prepared together on the worker pool (see prepare_batch),
+    then each job's solve is queued with its share. Jobs left out of the
+    preparation, or all of them if it failed, fetch their own.
+    """
+    future = _submit(prepare_batch, job_ids)
+    future.add_done_callback(
+        lambda future: _enqueue_prepared(job_ids, settings, incremental, future)
+    )
+    return future
+
+
+def _enqueue_prepared(job_ids, settings, incremental, future):
+    if future.cancelled():
+        return
+    shared = {}
+    if future.exception() is not None:
+        print(f"Batch preparation crashed: {future.exception()}; jobs fetch their own.")
+    else:
+        shared = future.result()
+
+    # Done callbacks run on the pool's management thread; queue from another
+    # so a pool replaced after a crash doesn't wait on the broken one
+    def enqueue():
+        for job_id in job_ids:
+            enqueue_solve(job_id, settings, incremental, shared.get(job_id))
+
+    threading.Thread(target=enqueue, daemon=True).start()
+
+
+def prepare_batch(job_ids: list[int]) -> dict:
+    """
+    Prepares the locations of a batch of jobs. Runs inside a worker process.
+
+    Jobs are grouped by distance provider, and each group is geocoded and
+    gets its travel times together (see
+    optimization.prepare_shared_locations). Returns {job id: shared
+    locations} for the jobs that could be prepared.
+    """
+    shared = {}
+    with SessionLocal() as db:
+        groups = {}
+        for job_id in job_ids:
+            db_job = crud.get_job(db, job_id=job_id)
+            if db_job is not None:
+                name = db_job.distance_provider or distance.DISTANCE_PROVIDER
+                groups.setdefault(name, []).append(db_job)
+
+        for jobs in groups.values():
+            def on_phase(status):
+                for db_job in jobs:
+                    db_job.status = status
+                db.commit()
+
+            try:
+                shared.update(optimization.prepare_shared_locations(jobs, on_phase=on_phase))
+            except Exception as e:
+                print(f"Error preparing batch locations: {e}")
+            prepared = sum(db_job.id in shared for db_job in jobs)
+            if prepared < len(jobs):
+                print(f"Shared locations unavailable for {len(jobs) - prepared} jobs; they fetch their own.")
+            # Back in line for their solves
+            on_phase(models.QUEUED_STATUS)
+    return shared
@@ -22,6 +22,8 @@ const GOOGLE_MAPS_API_KEY = import.meta.env.VITE_GOOGLE_MAPS_API_KEY;
 function App() {
   const [currentJob, setCurrentJob] = useState<api.Job | null>(null);
   const [solution, setSolution] = useState<api.Solution | null>(null);
+  // Progress of the running solve; its routes are shown until it completes
+  const [progress, setProgress] = useState<api.JobProgress | null>(null);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
@@ -53,21 +55,38 @@ function App() {
     setIsLoading(true);
     setError(null);
     setSolution(null);
+    setProgress(null);
     try {
-      const response = await api.solveJob(currentJob.id);
+      const response = await api.solveJob(currentJob.id, (update) => {
+        setProgress(update);
+        if (update.progress?.routes.length) {
+          setSolution({ routes: update.progress.routes });
+        }
+      });
       setSolution(response.data); // Set the final solution
       fetchJob(currentJob.id); // Re-fetch the job to show "completed" status
     } catch (err) {
       console.error("Failed to solve job", err);
       setError("Failed to solve job. Check API logs.");
     }
+    setProgress(null);
     setIsLoading(false);
   };
 
+  const handleStopOptimization = async () => {
+    if (!currentJob) return;
+    try {
+      await api.stopSolve(currentJob.id);
+    } catch (err) {
+      console.error("Failed to stop job", err);
+    }
+  };
+
   // A new function to reset the app state
   const handleStartNewJob = () => {
     setCurrentJob(null);
     setSolution(null);
+    setProgress(null);
     setError(null);
   };
 
@@ -104,11 +123,13 @@ function App() {
           <JobStatus
             job={currentJob}
             onRunOptimization={handleRunOptimization}
+            onStopOptimization={handleStopOptimization}
             isLoading={isLoading}
+            progress={progress}
           />
           {solution && (
             <>
-              <SolutionDisplay solution={solution} />
+              <SolutionDisplay solution={solution} inProgress={isLoading} />
               <Button
                 onClick={handleStartNewJob}
                 variant="outline"
@@ -1,4 +1,5 @@
 import axios from "axios";
+import { decodePolyline } from "@/lib/polyline";
 
 // The base URL for our FastAPI backend
 const API_BASE_URL = "http://localhost:8000";
@@ -22,22 +23,33 @@ const apiClient = axios.create({
 /**
  * Represents a single Shipment object as returned by the API.
  */
-export interface Shipment {
+export interface Shipment extends ShipmentCreate {
   id: number;
   job_id: number;
-  origin: string;
-  destination: string;
-  weight: number;
+  // Filled in by the backend once the addresses have been geocoded
+  origin_lat?: number | null;
+  origin_lng?: number | null;
+  destination_lat?: number | null;
+  destination_lng?: number | null;
 }
 
+// Where coordinates and travel times come from ("local" works offline)
+export type DistanceProvider = "google" | "local";
+
 /**
  * Represents a single Job object as returned by the API.
  */
 export interface Job {
   id: number;
   status: string;
+  num_vehicles: number;
+  vehicle_capacity: number | null;
+  depot_address: string | null;
+  end_depot_address: string | null;
+  distance_provider: DistanceProvider | null;
   created_at: string;
   updated_at: string | null;
+  error?: string | null;
   shipments: Shipment[];
 }
 
@@ -48,6 +60,14 @@ export interface ShipmentCreate {
   origin: string;
   destination: string;
   weight: number;
+  // Optional time windows, in seconds from the start of the working day,
+  // and time spent at each stop
+  pickup_window_start?: number | null;
+  pickup_window_end?: number | null;
+  delivery_window_start?: number | null;
+  delivery_window_end?: number | null;
+  pickup_service_seconds?: number;
+  delivery_service_seconds?: number;
 }
 
 //==============================================================================
@@ -71,13 +91,26 @@ export const getJobById = (jobId: number) => {
   return apiClient.get<Job>(`/jobs/${jobId}`);
 };
 
+/**
+ * The fleet a job is dispatched with. Omitted fields use backend defaults
+ * (one uncapacitated vehicle starting and ending at the default depot).
+ */
+export interface FleetOptions {
+  num_vehicles?: number;
+  vehicle_capacity?: number | null;
+  depot_address?: string | null;
+  end_depot_address?: string | null;
+  distance_provider?: DistanceProvider | null;
+}
+
 /**
  * Creates a new, empty job.
+ * @param fleet Optional fleet settings for the job.
  * @returns A promise that resolves to the newly created Job object.
  */
-export const createJob = () => {
+export const createJob = (fleet: FleetOptions = {}) => {
   // A new job is created with a default 'pending' status on the backend.
-  return apiClient.post<Job>("/jobs/", { status: "pending" });
+  return apiClient.post<Job>("/jobs/", { status: "pending", ...fleet });
 };
 
 /**
@@ -102,13 +135,19 @@ export interface SolutionStop {
   lat: number;
   lng: number;
   // --- END OF ADDITION ---
+
+  // Seconds from the start of the working day
+  arrival_seconds: number | null;
 }
 
 /**
  * Represents a single vehicle's route.
  */
 export interface SolutionRoute {
+  vehicle_id: number;
   stops: SolutionStop[];
+  // Encoded road geometry of each leg, depot to depot (may be empty)
+  polylines?: string[];
 }
 
 /**
@@ -116,13 +155,150 @@ export interface SolutionRoute {
  */
 export interface Solution {
   routes: SolutionRoute[];
+  // True if the search was stopped early with stopSolve
+  stopped?: boolean;
+}
+
+/**
+ * Progress of a running search: the best routes found so far.
+ */
+export interface SolveProgress {
+  objective: number | null;
+  solutions: number;
+  elapsed_seconds: number;
+  routes: SolutionRoute[];
+}
+
+/**
+ * One event of a job's solve stream (GET /jobs/{job_id}/events).
+ */
+export interface JobProgress {
+  job_id: number;
+  status: string;
+  error: string | null;
+  stop_requested: boolean;
+  progress: SolveProgress | null;
+}
+
+/**
+ * A solution in the backend's compact, columnar form (?format=compact).
+ */
+interface CompactSolution {
+  locations: string[];
+  coordinates: string; // Encoded polyline of the locations' positions
+  routes: {
+    vehicle_id: number;
+    ids: number[];
+    types: string; // "P" or "D" per stop
+    locations: number[]; // Indices into CompactSolution.locations
+    arrival_seconds: (number | null)[];
+    polylines: string[];
+  }[];
+  stopped: boolean;
 }
 
+/**
+ * Expands a compact solution back into the regular Solution shape.
+ */
+const expandSolution = (compact: CompactSolution): Solution => {
+  const positions = decodePolyline(compact.coordinates);
+  return {
+    stopped: compact.stopped,
+    routes: compact.routes.map((route): SolutionRoute => ({
+      vehicle_id: route.vehicle_id,
+      polylines: route.polylines,
+      stops: route.ids.map((id, i): SolutionStop => ({
+        id,
+        location: compact.locations[route.locations[i]],
+        type: route.types[i] === "P" ? "PICKUP" : "DROP",
+        ...positions[route.locations[i]],
+        arrival_seconds: route.arrival_seconds[i],
+      })),
+    })),
+  };
+};
+
+/**
+ * Fetches the stored solution of a solved job, including the road geometry
+ * of its routes. The solution is transferred in compact form.
+ * @param jobId The ID of the job.
+ * @returns A promise that resolves to the Solution object.
+ */
+export const getSolution = async (jobId: number) => {
+  const response = await apiClient.get<CompactSolution>(`/jobs/${jobId}/solution`, {
+    params: { format: "compact" },
+  });
+  return { ...response, data: expandSolution(response.data) };
+};
+
 /**
  * Triggers the optimization solver for a given job.
+ * The backend queues the job (202) and solves it in the background, so this
+ * follows the job's event stream until it completes and then fetches the
+ * solution.
  * @param jobId The ID of the job to solve.
+ * @param onProgress Called with the job's phase and best routes so far.
  * @returns A promise that resolves to the Solution object.
  */
-export const solveJob = (jobId: number) => {
-  return apiClient.post<Solution>(`/jobs/${jobId}/solve`);
+export const solveJob = async (
+  jobId: number,
+  onProgress?: (progress: JobProgress) => void
+) => {
+  await apiClient.post<Job>(`/jobs/${jobId}/solve`);
+  await new Promise<void>((resolve, reject) => {
+    const events = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+    events.addEventListener("progress", (event) => {
+      onProgress?.(JSON.parse((event as MessageEvent).data));
+    });
+    events.addEventListener("completed", () => {
+      events.close();
+      resolve();
+    });
+    events.addEventListener("failed", (event) => {
+      events.close();
+      const { error } = JSON.parse((event as MessageEvent).data) as JobProgress;
+      reject(new Error(error ?? `Optimization failed for job ${jobId}`));
+    });
+    // The job isn't queued or being solved, so no result is coming
+    events.addEventListener("idle", () => {
+      events.close();
+      reject(new Error(`Job ${jobId} is not being solved`));
+    });
+    // EventSource reconnects on network errors by itself; only give up
+    // once it has stopped trying
+    events.onerror = () => {
+      if (events.readyState === EventSource.CLOSED) {
+        reject(new Error(`Lost the progress stream of job ${jobId}`));
+      }
+    };
+  });
+  return getSolution(jobId);
+};
+
+/**
+ * Stops a running solve early; solveJob then resolves with the best
+ * solution found so far.
+ * @param jobId The ID of the job being solved.
+ */
+export const stopSolve = (jobId: number) => {
+  return apiClient.post<Job>(`/jobs/${jobId}/stop`);
+};
+
+/**
+ * What happened to one job of a batch solve request.
+ */
+export interface BatchSolveJob {
+  job_id: number;
+  status: string;
+  detail: string | null;
+}
+
+/**
+ * Queues several jobs for optimization at once. They share one geocoding
+ * and travel-time matrix pass; poll each job (or use solveJob) for results.
+ * @param jobIds The IDs of the jobs to solve.
+ * @returns A promise that resolves to the status of each job.
+ */
+export const solveJobs = (jobIds: number[]) => {
+  return apiClient.post<{ jobs: BatchSolveJob[] }>("/jobs/solve:batch", { job_ids: jobIds });
 };
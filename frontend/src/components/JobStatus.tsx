@@ -1,19 +1,28 @@
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card";
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from "@/components/ui/table";
-import type { Job } from "@/api";
+import type { Job, JobProgress } from "@/api";
 
 interface JobStatusProps {
   job: Job;
   onRunOptimization: () => void; // Callback to parent
+  onStopOptimization: () => void;
   isLoading: boolean;
+  progress: JobProgress | null; // Live progress of the running solve
 }
 
-export function JobStatus({ job, onRunOptimization, isLoading }: JobStatusProps) {
+export function JobStatus({
+  job,
+  onRunOptimization,
+  onStopOptimization,
+  isLoading,
+  progress,
+}: JobStatusProps) {
+  const search = progress?.progress;
   return (
     <Card className="w-full max-w-md mt-6">
       <CardHeader>
-        <CardTitle>Job #{job.id} Status: <span className="text-blue-600 uppercase">{job.status}</span></CardTitle>
+        <CardTitle>Job #{job.id} Status: <span className="text-blue-600 uppercase">{progress?.status ?? job.status}</span></CardTitle>
         <CardDescription>
           {job.shipments.length === 0 
             ? "No shipments added yet." 
@@ -51,6 +60,25 @@ export function JobStatus({ job, onRunOptimization, isLoading }: JobStatusProps)
           >
             {isLoading ? "Optimizing..." : "Run Optimization"}
           </Button>
+
+          {isLoading && progress && (
+            <>
+              {search && search.objective !== null && (
+                <p className="text-sm text-gray-600 mt-3">
+                  Best total travel time so far: {Math.round(search.objective / 60)} min
+                  ({search.solutions} improvements in {search.elapsed_seconds.toFixed(0)} s)
+                </p>
+              )}
+              <Button
+                onClick={onStopOptimization}
+                disabled={progress.stop_requested}
+                variant="outline"
+                className="w-full mt-3"
+              >
+                {progress.stop_requested ? "Stopping..." : "Stop and Keep Best Routes"}
+              </Button>
+            </>
+          )}
         </CardContent>
       )}
     </Card>
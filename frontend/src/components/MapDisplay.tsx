@@ -1,13 +1,14 @@
 import { Map, AdvancedMarker, useMap } from "@vis.gl/react-google-maps";
 import type { Solution } from "@/api";
+import { decodePolyline } from "@/lib/polyline";
 import { useEffect } from "react";
 
 interface MapDisplayProps {
   solution: Solution | null;
 }
 
-// A bright color for the route line
-const ROUTE_COLOR = "#007BFF";
+// One bright color per vehicle route (cycled if there are more vehicles)
+const ROUTE_COLORS = ["#007BFF", "#E8590C", "#2F9E44", "#AE3EC9", "#F08C00", "#1098AD"];
 
 /**
  * A helper component to automatically adjust the map's viewport
@@ -17,37 +18,43 @@ function MapBoundsUpdater({ solution }: MapDisplayProps) {
   const map = useMap();
 
   useEffect(() => {
-    if (!map || !solution || solution.routes[0].stops.length === 0) return;
+    if (!map || !solution) return;
+    const routes = solution.routes.filter((route) => route.stops.length > 0);
+    if (routes.length === 0) return;
 
     // Create a new bounds object
     const bounds = new google.maps.LatLngBounds();
 
-    // Build the path for the polyline
-    const path = solution.routes[0].stops.map((stop) => ({
-      lat: stop.lat,
-      lng: stop.lng,
-    }));
+    // Draw one polyline per vehicle route: along the roads when the route
+    // comes with leg geometry, otherwise as straight lines between stops
+    const polylines = routes.map((route, routeIndex) => {
+      const path = route.polylines?.length
+        ? route.polylines.flatMap((leg) => decodePolyline(leg))
+        : route.stops.map((stop) => ({
+            lat: stop.lat,
+            lng: stop.lng,
+          }));
 
-    // Extend the bounds to include every stop in the route
-    path.forEach((point) => {
-      bounds.extend(point);
-    });
+      // Extend the bounds to include every point of the route
+      path.forEach((point) => {
+        bounds.extend(point);
+      });
 
-    // Create the polyline using the Google Maps API
-    const polyline = new google.maps.Polyline({
-      path: path,
-      strokeColor: ROUTE_COLOR,
-      strokeOpacity: 0.8,
-      strokeWeight: 5,
-      map: map,
+      return new google.maps.Polyline({
+        path: path,
+        strokeColor: ROUTE_COLORS[routeIndex % ROUTE_COLORS.length],
+        strokeOpacity: 0.8,
+        strokeWeight: 5,
+        map: map,
+      });
     });
 
     // Tell the map to fit those bounds
     map.fitBounds(bounds, 100); // 100px padding
 
-    // Cleanup function to remove the polyline when component unmounts or solution changes
+    // Cleanup function to remove the polylines when component unmounts or solution changes
     return () => {
-      polyline.setMap(null);
+      polylines.forEach((polyline) => polyline.setMap(null));
     };
   }, [map, solution]); // Re-run whenever the map or solution changes
 
@@ -62,9 +69,16 @@ export function MapDisplay({ solution }: MapDisplayProps) {
   const defaultCenter = { lat: 45.0, lng: -98.0 };
   const defaultZoom = 3;
 
-  // Calculate the path for the markers
-  const routePath = solution
-    ? solution.routes[0].stops.map((stop) => ({ lat: stop.lat, lng: stop.lng }))
+  // Calculate the marker positions, numbered per route
+  const markers = solution
+    ? solution.routes.flatMap((route, routeIndex) =>
+        route.stops.map((stop, stopIndex) => ({
+          key: `${route.vehicle_id}-${stopIndex}`,
+          position: { lat: stop.lat, lng: stop.lng },
+          label: stopIndex + 1,
+          color: ROUTE_COLORS[routeIndex % ROUTE_COLORS.length],
+        }))
+      )
     : [];
 
   return (
@@ -78,10 +92,13 @@ export function MapDisplay({ solution }: MapDisplayProps) {
       >
         {/* Draw all the markers */}
         {solution &&
-          routePath.map((point, index) => (
-            <AdvancedMarker key={index} position={point}>
-              <div className="bg-blue-600 text-white rounded-full w-8 h-8 flex items-center justify-center font-bold shadow-lg">
-                {index + 1}
+          markers.map((marker) => (
+            <AdvancedMarker key={marker.key} position={marker.position}>
+              <div
+                className="text-white rounded-full w-8 h-8 flex items-center justify-center font-bold shadow-lg"
+                style={{ backgroundColor: marker.color }}
+              >
+                {marker.label}
               </div>
             </AdvancedMarker>
           ))}
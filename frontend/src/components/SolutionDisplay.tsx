@@ -9,39 +9,50 @@ import {
 
 interface SolutionDisplayProps {
   solution: Solution;
+  inProgress?: boolean; // The best routes so far of a running solve
 }
 
-export function SolutionDisplay({ solution }: SolutionDisplayProps) {
-  // We only expect one route for our simple VRP
-  const route = solution.routes[0];
-
+export function SolutionDisplay({ solution, inProgress = false }: SolutionDisplayProps) {
   return (
     <Card className="w-full max-w-md mt-6 bg-green-50 border-green-200">
       <CardHeader>
-        <CardTitle className="text-green-800">Optimization Complete!</CardTitle>
+        <CardTitle className="text-green-800">
+          {inProgress
+            ? "Best Routes So Far..."
+            : solution.stopped
+              ? "Optimization Stopped Early"
+              : "Optimization Complete!"}
+        </CardTitle>
         <CardDescription>
-          Here is the most efficient route for your vehicle.
+          {solution.routes.length === 1
+            ? "Here is the most efficient route for your vehicle."
+            : `Here are the most efficient routes for your ${solution.routes.length} vehicles.`}
         </CardDescription>
       </CardHeader>
-      <CardContent>
-        <div className="flex flex-col space-y-2">
-          <div className="font-semibold text-gray-700">Depot (Start)</div>
-          <ol className="list-decimal list-inside pl-2 space-y-2">
-            {route.stops.map((stop, index) => (
-              <li key={index} className="text-gray-900">
-                <span
-                  className={`font-medium ${
-                    stop.type === "PICKUP" ? "text-blue-600" : "text-purple-600"
-                  }`}
-                >
-                  {stop.type}
-                </span>
-                : {stop.location} (Shipment #{stop.id})
-              </li>
-            ))}
-          </ol>
-          <div className="font-semibold text-gray-700 mt-2">Depot (End)</div>
-        </div>
+      <CardContent className="space-y-6">
+        {solution.routes.map((route) => (
+          <div key={route.vehicle_id} className="flex flex-col space-y-2">
+            {solution.routes.length > 1 && (
+              <div className="font-bold text-gray-800">Vehicle #{route.vehicle_id + 1}</div>
+            )}
+            <div className="font-semibold text-gray-700">Depot (Start)</div>
+            <ol className="list-decimal list-inside pl-2 space-y-2">
+              {route.stops.map((stop, index) => (
+                <li key={index} className="text-gray-900">
+                  <span
+                    className={`font-medium ${
+                      stop.type === "PICKUP" ? "text-blue-600" : "text-purple-600"
+                    }`}
+                  >
+                    {stop.type}
+                  </span>
+                  : {stop.location} (Shipment #{stop.id})
+                </li>
+              ))}
+            </ol>
+            <div className="font-semibold text-gray-700 mt-2">Depot (End)</div>
+          </div>
+        ))}
       </CardContent>
     </Card>
   );
@@ -0,0 +1,32 @@
+/**
+ * Decodes a polyline in Google's encoded polyline format (5 decimal places),
+ * as returned by the backend for route legs and compact solutions.
+ * @param encoded The encoded polyline.
+ * @returns The points of the polyline, in order.
+ */
+export function decodePolyline(encoded: string): google.maps.LatLngLiteral[] {
+  const points: google.maps.LatLngLiteral[] = [];
+  let index = 0;
+  let lat = 0;
+  let lng = 0;
+
+  // Each value is a zig-zag encoded delta, in 5-bit chunks offset by 63
+  const nextValue = () => {
+    let result = 0;
+    let shift = 0;
+    let chunk: number;
+    do {
+      chunk = encoded.charCodeAt(index++) - 63;
+      result |= (chunk & 0x1f) << shift;
+      shift += 5;
+    } while (chunk >= 0x20);
+    return result & 1 ? ~(result >> 1) : result >> 1;
+  };
+
+  while (index < encoded.length) {
+    lat += nextValue();
+    lng += nextValue();
+    points.push({ lat: lat / 1e5, lng: lng / 1e5 });
+  }
+  return points;
+}